@@ -18,6 +18,16 @@ from PtyLab.ExperimentalData.ExperimentalData import ExperimentalData
 from PtyLab.Reconstruction.Reconstruction import Reconstruction
 from PtyLab.Params.Params import Params
 from PtyLab.utils.utils import ifft2c, fft2c, orthogonalizeModes, circ
+from PtyLab.utils import positionScheduling
+from PtyLab.utils.errorAccounting import ResidualReservoir
+from PtyLab.utils.objectSpectrum import ObjectSpectrum
+from PtyLab.utils.fftBackends import setFFTBackend
+from PtyLab.utils.instrumentation import instrumentation, enableInstrumentation, debug
+from PtyLab.utils.profiler import StageProfiler
+from PtyLab.utils.memoryTracker import MemoryTracker
+from PtyLab.utils.precision import getPrecision, asPrecision, isUpcast, upcastFields
+from PtyLab.io.lazyPtychogram import LazyPtychogram
+from PtyLab.io.framePrefetcher import FramePrefetcher
 from PtyLab.Monitor.Monitor import Monitor
 from matplotlib import pyplot as plt
 
@@ -83,6 +93,12 @@ class BaseEngine(object):
     ):
         # These statements don't copy any data, they just keep a reference to the object
         self.betaObject = 0.25
+        # weights of the overlapping updates in the batched (params.batchSize > 1) update, see
+        # batchPositionUpdate. 1 is a plain mean, Engines with their own alpha (e.g. mPIE) override these
+        self.alphaObject = 1
+        self.alphaProbe = 1
+        # Engines with a batched position loop set this to True, the others run sequentially, see _checkMISC
+        self.supportsBatches = False
         self.reconstruction: Reconstruction = reconstruction
         self.experimentalData = experimentalData
         self.params = params
@@ -91,6 +107,27 @@ class BaseEngine(object):
 
         # datalogger
         self.logger = logging.getLogger("BaseEngine")
+        # per-stage timing, turned on with params.profiling
+        self.profiler = StageProfiler()
+        # reads the frames of a lazy ptychogram ahead of the position loop, see _prefetchFrames
+        self.framePrefetcher = None
+        # float32 sqrt(ptychogram), see _setAmplitudeTable
+        self.amplitudeTable = None
+        # reconstruction fields that are kept in the precision of params.precision, see _setPrecision
+        self.complexFields = [
+            "object",
+            "probe",
+            "objectBuffer",
+            "probeBuffer",
+            "objectMomentum",
+            "probeMomentum",
+            "initialGuessObject",
+            "initialGuessProbe",
+            "reference",
+        ]
+        self.realFields = ["errorAtPos", "background"]
+        # fields of the position loop that are checked for upcasts after every iteration, see _checkPrecision
+        self.loopFields = ["esw", "ESW", "eswUpdate", "Iestimated"]
 
     def _prepareReconstruction(self):
         """
@@ -107,10 +144,53 @@ class BaseEngine(object):
         self._setObjectProbeROI()
         self._showInitialGuesses()
         self._initializePCParameters()
+        self._setPrecision()
         self._checkGPU()  # checkGPU needs to be the last
+        self._setAmplitudeTable()
+        self._setProfiler()
 
         # self.reconstruction.probe_storage.push(self.reconstruction.probe, 0, self.experimentalData.ptychogram.shape[0])
 
+    def _setAmplitudeTable(self):
+        """
+        Precompute the measured amplitudes sqrt(ptychogram) in float32 if params.amplitudeTable is set, so that the
+        standard and interferometric intensity projections do not take the square root of the measured data at every
+        position. Not used with CPSC, adaptive denoising (which change the measured intensities) or a lazy ptychogram.
+        """
+        ptychogram = self.experimentalData.ptychogram
+        if (
+            not self.params.amplitudeTable
+            or self.params.intensityConstraint not in ["standard", "interferometric"]
+            or self.params.CPSCswitch
+            or self.params.adaptiveDenoisingSwitch
+            or isinstance(ptychogram, LazyPtychogram)
+        ):
+            self.amplitudeTable = None
+            self._amplitudeSource = None
+            return
+        # the table follows the ptychogram (fftshift, transfer to the GPU)
+        if getattr(self, "_amplitudeSource", None) is not ptychogram:
+            xp = getArrayModule(ptychogram)
+            self.amplitudeTable = xp.sqrt(ptychogram, dtype=np.float32)
+            self._amplitudeSource = ptychogram
+
+    def _setProfiler(self):
+        """
+        Time the stages of the engine if params.profiling is set, see engine.profiler.summary(), and track the memory
+        use at the end of every stage if params.memoryTracking is set, see engine.profiler.memory.
+        """
+        self.profiler.enabled = self.params.profiling or self.params.memoryTracking
+        self.profiler.synchronize = self.params.gpuSwitch
+        self.profiler.memory = (
+            MemoryTracker(self, gpu=self.params.gpuSwitch)
+            if self.params.memoryTracking
+            else None
+        )
+        if self.profiler.enabled:
+            self.profiler.attach(self)
+        else:
+            self.profiler.detach(self)
+
     def _setCPSC(self):
         """
         set constrained-pixel-sum constraint:
@@ -192,32 +272,34 @@ class BaseEngine(object):
             # self.colShifts = dx.flatten()#np.array([-1, 0, 1, -1, 0, 1, -1, 0, 1])
             self.colShifts = np.array([-1, 0, 1, -1, 0, 1, -1, 0, 1])
             self.startAtIteration = 1
+            # windows of the spectrum of the current object for FPM, see positionCorrectionBatch
+            self.objectSpectrum = ObjectSpectrum()
             self.meanEncoder00 = np.mean(self.experimentalData.encoder[:, 0]).copy()
             self.meanEncoder01 = np.mean(self.experimentalData.encoder[:, 1]).copy()
 
     def _initializeErrors(self):
         """
         initialize all kinds of errors:
-        detectorError is a matrix calculated at each iteration (numFrames,Nd,Nd);
-        errorAtPos sums over detectorError at each iteration, (numFrames,1);
+        errorAtPos is the (masked) detector error of every frame, reduced to a scalar in getRMSD, (numFrames,);
         reconstruction.error sums over errorAtPos, one number at each iteration;
+        residualReservoir optionally keeps the full residual maps of a few positions (params.residualReservoirSize)
         """
-        # initialize detector error matrices
-        if self.params.saveMemory:
-            self.reconstruction.detectorError = 0
-        else:
-            if not hasattr(self.reconstruction, "detectorError"):
-                self.reconstruction.detectorError = np.zeros(
-                    (
-                        self.experimentalData.numFrames,
-                        self.reconstruction.Nd,
-                        self.reconstruction.Nd,
-                    )
-                )
-        # initialize energy at each scan position
-        if not hasattr(self.reconstruction, "errorAtPos"):
+        # initialize error at each scan position
+        if (
+            not hasattr(self.reconstruction, "errorAtPos")
+            or self.reconstruction.errorAtPos.shape != (self.experimentalData.numFrames,)
+        ):
             self.reconstruction.errorAtPos = np.zeros(
-                (self.experimentalData.numFrames, 1), dtype=np.float32
+                self.experimentalData.numFrames, dtype=np.float32
+            )
+        # initialize the store of full residual maps
+        if (
+            not hasattr(self.reconstruction, "residualReservoir")
+            or len(self.reconstruction.residualReservoir.positionIndices)
+            != min(self.params.residualReservoirSize, self.experimentalData.numFrames)
+        ):
+            self.reconstruction.residualReservoir = ResidualReservoir(
+                self.params.residualReservoirSize, self.experimentalData.numFrames
             )
         # initialize final error
         if not hasattr(self.reconstruction, "error"):
@@ -350,6 +432,15 @@ class BaseEngine(object):
         """
         checks miscellaneous quantities specific certain Engines
         """
+        if self.params.instrumentation is not None:
+            enableInstrumentation(self.params.instrumentation)
+
+        if self.params.batchSize > 1 and not self.supportsBatches:
+            warnings.warn(
+                f"{type(self).__name__} has no batched update, params.batchSize = {self.params.batchSize} is "
+                "ignored and the positions are updated one by one"
+            )
+
         if self.params.backgroundModeSwitch:
             self.reconstruction.background = 1e-1 * np.ones(
                 (self.reconstruction.Np, self.reconstruction.Np)
@@ -357,7 +448,7 @@ class BaseEngine(object):
 
         # preallocate intensity scaling vector
         if self.params.intensityConstraint == "fluctuation":
-            self.intensityScaling = np.ones(self.experimentalData.numFrames)
+            self.params.intensityScaling = np.ones(self.experimentalData.numFrames)
 
         if self.params.intensityConstraint == "interferometric":
             self.reconstruction.reference = np.ones(
@@ -400,8 +491,11 @@ class BaseEngine(object):
 
     def _checkFFT(self):
         """
-        shift arrays to accelerate fft
+        select the FFT backend, set the kernel cache budgets and shift arrays to accelerate fft
         """
+        setFFTBackend(self.params.fftBackend, workers=self.params.fftWorkers)
+        for name, nbytes in self.params.kernelCacheBudgets.items():
+            Operators.Operators.set_kernel_cache_budget(name, nbytes)
         if self.params.fftshiftSwitch:
             if self.params.fftshiftFlag == 0:
                 print("check fftshift...")
@@ -658,6 +752,202 @@ class BaseEngine(object):
             self.positionIndices = np.argsort(dist)
         else:
             raise ValueError("position order not properly set")
+        self._prefetchFrames(self.positionIndices)
+
+    def _prefetchFrames(self, order):
+        """
+        Start reading the frames of a lazy ptychogram (see ExperimentalData.loadData) in order, if
+        params.prefetchFrames is set.
+        :param order: position indices in the order in which they will be used
+        """
+        ptychogram = self.experimentalData.ptychogram
+        if not (isinstance(ptychogram, LazyPtychogram) and self.params.prefetchFrames):
+            if self.framePrefetcher is not None:
+                self.framePrefetcher.close()
+            self.framePrefetcher = None
+            return
+        if self.framePrefetcher is None or self.framePrefetcher.ptychogram is not ptychogram:
+            if self.framePrefetcher is not None:
+                self.framePrefetcher.close()
+            self.framePrefetcher = FramePrefetcher(
+                ptychogram, self.params.prefetchFrames, self.params.prefetchWorkers
+            )
+        self.framePrefetcher.start(order)
+
+    def getNonOverlappingGroups(self):
+        """
+        Groups of mutually non-overlapping positions, obtained by colouring the patch-overlap graph.
+        The object patches of the positions within a group are disjoint, so their object updates do not interfere in
+        a batch. The probe is still updated once per batch (see batchPositionUpdate), so a batched update of a group
+        is not the same as updating its positions one after the other.
+        The colouring is cached and only recomputed when the positions or Np change. For a random position order
+        (see setPositionOrder) the order of the groups and of the positions within the groups is randomized.
+        :return: list of arrays with position indices
+        """
+        positions = np.asarray(self.reconstruction.positions)
+        cache = getattr(self, "_overlapColouring", None)
+        if (
+            cache is None
+            or cache[0] != self.reconstruction.Np
+            or not np.array_equal(cache[1], positions)
+        ):
+            neighbours = positionScheduling.getOverlapGraph(
+                positions, self.reconstruction.Np
+            )
+            colours = positionScheduling.colourOverlapGraph(neighbours)
+            self._overlapColouring = (self.reconstruction.Np, positions.copy(), colours)
+            self.logger.debug(
+                "Split %d positions into %d non-overlapping groups",
+                len(colours),
+                colours.max() + 1,
+            )
+        colours = self._overlapColouring[2]
+        shuffle = (
+            self.params.positionOrder == "random"
+            and len(self.reconstruction.error) >= 2
+        )
+        return positionScheduling.getNonOverlappingGroups(colours, shuffle=shuffle)
+
+    def getPositionBatches(self):
+        """
+        Split the current position order (see setPositionOrder) into mini-batches of params.batchSize positions.
+        If params.batchNonOverlapping is set, the batches are taken from getNonOverlappingGroups instead,
+        so that no two positions in a batch overlap.
+        :return: list of arrays with position indices
+        """
+        batchSize = max(1, int(self.params.batchSize))
+        if self.params.batchNonOverlapping:
+            groups = self.getNonOverlappingGroups()
+        else:
+            groups = [self.positionIndices]
+        batches = [
+            group[start : start + batchSize]
+            for group in groups
+            for start in range(0, len(group), batchSize)
+        ]
+        if self.framePrefetcher is not None:
+            self._prefetchFrames(np.concatenate(batches))
+        return batches
+
+    def getObjectPatches(self, positionIndices):
+        """
+        Gather the object patches of several scan positions into one stacked array.
+        :param positionIndices: array of B position indices
+        :return: copy of the object patches, shape (B, nlambda, nosm, 1, nslice, Np, Np)
+        """
+        xp = getArrayModule(self.reconstruction.object)
+        Np = self.reconstruction.Np
+        return xp.stack(
+            [
+                self.reconstruction.object[..., row : row + Np, col : col + Np]
+                for row, col in self.reconstruction.positions[positionIndices]
+            ]
+        )
+
+    def _getBatchUpdateBuffers(self, dtype_real):
+        """
+        Object-sized accumulation buffers for batchPositionUpdate. They are allocated once and reset
+        patch-wise after every batch, so a batch does not cost a full-object allocation.
+        :return: numerator (shape of the object), denominator (nosm and npsm axes collapsed)
+        """
+        xp = getArrayModule(self.reconstruction.object)
+        shape = self.reconstruction.object.shape
+        buffers = getattr(self, "_batchUpdateBuffers", None)
+        if (
+            buffers is None
+            or buffers[0].shape != shape
+            or buffers[0].dtype != self.reconstruction.object.dtype
+            or getArrayModule(buffers[0]) is not xp
+        ):
+            buffers = (
+                xp.zeros_like(self.reconstruction.object),
+                xp.zeros((shape[0], 1) + shape[2:], dtype=dtype_real),
+            )
+            self._batchUpdateBuffers = buffers
+        return buffers
+
+    def batchPositionUpdate(self, positionIndices, objectPatchUpdate=None, probeUpdate=None):
+        """
+        Mini-batch version of the sequential PIE position loop (used when params.batchSize > 1).
+
+        The object patches of all positions are stacked along a new leading axis, so that object2detector,
+        the intensity projection and detector2object run as a single batched FFT. The object and probe updates of
+        the individual positions are the ones of the engine (objectPatchUpdate and probeUpdate), computed from the
+        object and probe at the start of the batch. Where patches overlap, the object update is their mean weighted
+        by alphaObject * max(|P|^2) + (1 - alphaObject) * |P|^2, and likewise the probe update is the mean of the
+        probe updates weighted by the object intensity of the patches (alphaProbe), so overlapping patches do not
+        overshoot. A batch of one position is the sequential update.
+
+        :param positionIndices: array of B position indices
+        :param objectPatchUpdate: function(objectPatch, DELTA) that returns the updated object patch of one
+            position, self.objectPatchUpdate by default
+        :param probeUpdate: function(objectPatch, DELTA, positionIndex) that returns the updated probe,
+            self.probeUpdate by default
+        :return: the object patches before the update, shape (B, nlambda, nosm, 1, nslice, Np, Np)
+        """
+        if self.params.intensityConstraint == "interferometric":
+            raise NotImplementedError(
+                "The interferometric intensity constraint is not implemented for params.batchSize > 1"
+            )
+        if objectPatchUpdate is None:
+            objectPatchUpdate = self.objectPatchUpdate
+        if probeUpdate is None:
+
+            def probeUpdate(objectPatch, DELTA, positionIndex):
+                return self.probeUpdate(objectPatch, DELTA)
+
+        xp = getArrayModule(self.reconstruction.object)
+        Np = self.reconstruction.Np
+        probe = self.reconstruction.probe
+
+        objectPatches = self.getObjectPatches(positionIndices)
+
+        # make exit surface waves, shape (B, nlambda, nosm, npsm, nslice, Np, Np)
+        self.reconstruction.esw = objectPatches * probe
+
+        # propagate to camera, intensityProjection, propagate back to object
+        self.intensityProjection(positionIndices)
+
+        # difference term
+        DELTA = self.reconstruction.eswUpdate - self.reconstruction.esw
+
+        # object update: weighted mean of the updates of the positions, accumulated in object-sized buffers
+        absP2 = xp.sum(xp.abs(probe) ** 2, axis=(1, 2), keepdims=True)
+        objectWeight = self.alphaObject * xp.max(absP2) + (1 - self.alphaObject) * absP2
+        objectNumerator, objectDenominator = self._getBatchUpdateBuffers(absP2.dtype)
+        slices = []
+        for objectPatch, delta, (row, col) in zip(
+            objectPatches, DELTA, self.reconstruction.positions[positionIndices]
+        ):
+            sy = slice(row, row + Np)
+            sx = slice(col, col + Np)
+            objectNumerator[..., sy, sx] += objectWeight * (
+                objectPatchUpdate(objectPatch, delta) - objectPatch
+            )
+            objectDenominator[..., sy, sx] += objectWeight
+            slices.append((sy, sx))
+        # overlapping patches receive the same (accumulated) update, so they can be written one by one
+        for objectPatch, (sy, sx) in zip(objectPatches, slices):
+            self.reconstruction.object[..., sy, sx] = (
+                objectPatch + objectNumerator[..., sy, sx] / objectDenominator[..., sy, sx]
+            )
+        # only reset what was touched, the buffers are reused by the next batch
+        for sy, sx in slices:
+            objectNumerator[..., sy, sx] = 0
+            objectDenominator[..., sy, sx] = 0
+
+        # probe update: weighted mean of the probe updates of the positions
+        probeNumerator = 0
+        probeDenominator = 0
+        for objectPatch, delta, positionIndex in zip(objectPatches, DELTA, positionIndices):
+            absO2 = xp.sum(xp.abs(objectPatch) ** 2, axis=1, keepdims=True)
+            probeWeight = self.alphaProbe * xp.max(absO2) + (1 - self.alphaProbe) * absO2
+            probeNumerator = probeNumerator + probeWeight * (
+                probeUpdate(objectPatch, delta, positionIndex) - probe
+            )
+            probeDenominator = probeDenominator + probeWeight
+        self.reconstruction.probe = probe + probeNumerator / probeDenominator
+        return objectPatches
 
     def changeExperimentalData(self, experimentalData: ExperimentalData):
 
@@ -680,16 +970,69 @@ class BaseEngine(object):
         Convert the datasets to single precision. Matches: convert2single.m
         :return:
         """
-        self.dtype_complex = np.complex64
-        self.dtype_real = np.float32
+        self.params.precision = "single"
+        self._setPrecision()
+
+    def convert2double(self):
+        """
+        Convert the datasets to double precision, e.g. to validate a single precision reconstruction.
+        :return:
+        """
+        self.params.precision = "double"
+        self._setPrecision()
+
+    def _setPrecision(self):
+        """
+        Select the precision policy of params.precision (see utils.precision) for this engine and cast the
+        reconstruction and the measured data to it. The propagation kernels are cached per precision.
+        """
+        self.precision = getPrecision(self.params.precision)
+        self.dtype_complex = self.precision.complex
+        self.dtype_real = self.precision.real
         self._match_dtypes_complex()
         self._match_dtypes_real()
 
     def _match_dtypes_complex(self):
-        raise NotImplementedError()
+        for name in self.complexFields:
+            value = getattr(self.reconstruction, name, None)
+            if value is not None:
+                setattr(self.reconstruction, name, asPrecision(value, self.precision))
 
     def _match_dtypes_real(self):
-        raise NotImplementedError()
+        for name in self.realFields:
+            value = getattr(self.reconstruction, name, None)
+            if value is not None:
+                setattr(self.reconstruction, name, asPrecision(value, self.precision))
+        if getattr(self, "probeWindow", None) is not None:
+            self.probeWindow = asPrecision(self.probeWindow, self.precision)
+        # the measured data is only ever narrowed, double precision does not need float64 data
+        if isUpcast(self.experimentalData.ptychogram, self.precision):
+            self.experimentalData.setPtychogramStorage("float32")
+        for name in ["ptychogramDownsampled", "W", "emptyBeam"]:
+            value = getattr(self.experimentalData, name, None)
+            if isUpcast(value, self.precision):
+                setattr(self.experimentalData, name, asPrecision(value, self.precision))
+
+    def _checkPrecision(self):
+        """
+        Flag the fields that were upcast beyond params.precision during the last iteration, e.g. by a float64 array
+        in an update. With params.precisionCheck = 'warn' they are cast back, 'raise' raises a TypeError.
+        """
+        if not self.params.precisionCheck:
+            return
+        upcast = upcastFields(
+            self.reconstruction, self.complexFields + self.realFields + self.loopFields, self.precision
+        )
+        if not upcast:
+            return
+        message = f"Fields upcast beyond {self.params.precision} precision: " + ", ".join(
+            f"{name} ({dtype})" for name, dtype in upcast
+        )
+        if self.params.precisionCheck == "raise":
+            raise TypeError(message)
+        warnings.warn(message)
+        self._match_dtypes_complex()
+        self._match_dtypes_real()
 
     def object2detector(self, esw=None):
         """
@@ -829,24 +1172,20 @@ class BaseEngine(object):
         matches getErrorMetrics.m
         :return:
         """
-        if not self.params.saveMemory:
-            # Calculate mean error for all positions (make separate function for all of that)
-            if self.params.FourierMaskSwitch:
-                self.reconstruction.errorAtPos = np.sum(
-                    np.abs(self.reconstruction.detectorError) * self.experimentalData.W,
-                    axis=(-1, -2),
-                )
-            else:
-                self.reconstruction.errorAtPos = np.sum(
-                    np.abs(self.reconstruction.detectorError), axis=(-1, -2)
-                )
-        self.reconstruction.errorAtPos = asNumpyArray(
-            self.reconstruction.errorAtPos
-        ) / asNumpyArray(self.experimentalData.energyAtPos + 1e-20)
-        eAverage = np.sum(self.reconstruction.errorAtPos)
+        # errorAtPos has been filled position by position in getRMSD, normalize it in-place
+        # (it stays on the GPU, if used, so only the final sum is transferred)
+        xp = getArrayModule(self.reconstruction.errorAtPos)
+        self.reconstruction.errorAtPos /= xp.asarray(
+            self.experimentalData.energyAtPos + 1e-20, dtype=np.float32
+        )
+        eAverage = float(asNumpyArray(xp.sum(self.reconstruction.errorAtPos)))
 
         # append to error vector (for plotting error as function of iteration)
         self.reconstruction.error = np.append(self.reconstruction.error, eAverage)
+        if instrumentation.enabled:
+            instrumentation.count("iterations")
+            instrumentation.gauge("error", eAverage)
+        self._checkPrecision()
 
     def getRMSD(self, positionIndex):
         """
@@ -860,46 +1199,61 @@ class BaseEngine(object):
             self.reconstruction.Imeasured - self.reconstruction.Iestimated
         )
 
-        # todo saveMemory implementation
-        if self.params.saveMemory:
-            if self.params.FourierMaskSwitch and not self.params.CPSCswitch:
-                self.reconstruction.errorAtPos[positionIndex] = xp.sum(
-                    self.currentDetectorError * self.experimentalData.W
+        # reduce the (masked) error of this frame to a scalar, the full map is not stored
+        detectorError = self.currentDetectorError
+        if self.params.FourierMaskSwitch:
+            W = self.experimentalData.W
+            if detectorError.shape[-2:] != W.shape[-2:]:
+                # CPSC: the mask is defined on the measured (downsampled) detector grid, bin the error first
+                f = detectorError.shape[-1] // W.shape[-1]
+                detectorError = xp.sum(
+                    detectorError.reshape(
+                        detectorError.shape[:-2] + (W.shape[-2], f, W.shape[-1], f)
+                    ),
+                    axis=(-3, -1),
                 )
-            elif self.params.FourierMaskSwitch and self.params.CPSCswitch:
-                raise NotImplementedError
-            else:
-
-                self.reconstruction.errorAtPos[positionIndex] = asNumpyArray(xp.sum(
-                    self.currentDetectorError
-                ))
-        else:
-            self.reconstruction.detectorError[positionIndex] = self.currentDetectorError
+            detectorError = detectorError * W
+        self.reconstruction.errorAtPos[positionIndex] = xp.sum(
+            detectorError, axis=(-2, -1)
+        )
+        self.reconstruction.residualReservoir.push(
+            positionIndex, self.currentDetectorError
+        )
 
     def intensityProjection(self, positionIndex):
         """Compute the projected intensity.
         Barebones, need to implement other methods
+
+        :param positionIndex: index of the scan position. Can also be an array of indices, in which case
+            reconstruction.esw holds the stacked exit waves of all these positions (see batchPositionUpdate)
         """
         # figure out whether or not to use the GPU
         xp = getArrayModule(self.reconstruction.esw)
         # zero division mitigator
         gimmel = 1e-10
+        if instrumentation.enabled:
+            instrumentation.count("intensityProjection.positions", np.size(positionIndex))
 
         # propagate to detector
         self.object2detector()
 
         # get estimated intensity (2D array, in the case of multislice, only take the last slice)
+        # the axes are counted from the end so that a leading batch axis is kept
         if self.params.intensityConstraint == "interferometric":
             self.reconstruction.Iestimated = xp.sum(
                 xp.abs(self.reconstruction.ESW + self.reconstruction.reference) ** 2,
-                axis=(0, 1, 2),
-            )[-1]
+                axis=(-6, -5, -4),
+            )[..., -1, :, :]
         else:
             self.reconstruction.Iestimated = xp.sum(
-                xp.abs(self.reconstruction.ESW) ** 2, axis=(0, 1, 2)
-            )[-1]
-            self.logger.debug(
-                f"Estimated intensity: {self.reconstruction.Iestimated.sum()}, Measured: {self.experimentalData.ptychogram[positionIndex].sum()}"
+                xp.abs(self.reconstruction.ESW) ** 2, axis=(-6, -5, -4)
+            )[..., -1, :, :]
+            # the sums are only computed when the message is actually logged
+            debug(
+                self.logger,
+                "Estimated intensity: %s, Measured: %s",
+                lambda: self.reconstruction.Iestimated.sum(),
+                lambda: self.experimentalData.ptychogram[positionIndex].sum(),
             )
         if self.params.backgroundModeSwitch:
             self.reconstruction.Iestimated += self.reconstruction.background
@@ -907,10 +1261,17 @@ class BaseEngine(object):
         # get measured intensity todo implement kPIE
         if self.params.CPSCswitch:
             self.decompressionProjection(positionIndex)
+        elif self.framePrefetcher is not None:
+            self.reconstruction.Imeasured = self.framePrefetcher.get(positionIndex)
         else:
             self.reconstruction.Imeasured = self.experimentalData.ptychogram[
                 positionIndex
             ]
+        if self.reconstruction.Imeasured.dtype.kind == "u":
+            # compact photon counts, see ExperimentalData.setPtychogramStorage
+            self.reconstruction.Imeasured = self.reconstruction.Imeasured.astype(
+                np.float32
+            )
 
         self.getRMSD(positionIndex)
 
@@ -925,19 +1286,30 @@ class BaseEngine(object):
                 aleph = xp.sum(
                     self.reconstruction.Imeasured
                     * self.reconstruction.Iestimated
-                    * self.experimentalData.W
+                    * self.experimentalData.W,
+                    axis=(-2, -1),
+                    keepdims=True,
                 ) / xp.sum(
                     self.reconstruction.Imeasured
                     * self.reconstruction.Imeasured
-                    * self.experimentalData.W
+                    * self.experimentalData.W,
+                    axis=(-2, -1),
+                    keepdims=True,
                 )
             else:
                 aleph = xp.sum(
-                    self.reconstruction.Imeasured * self.reconstruction.Iestimated
+                    self.reconstruction.Imeasured * self.reconstruction.Iestimated,
+                    axis=(-2, -1),
+                    keepdims=True,
                 ) / xp.sum(
-                    self.reconstruction.Imeasured * self.reconstruction.Imeasured
+                    self.reconstruction.Imeasured * self.reconstruction.Imeasured,
+                    axis=(-2, -1),
+                    keepdims=True,
                 )
-            self.params.intensityScaling[positionIndex] = aleph
+            # positionIndex is a single index or the indices of a batch
+            self.params.intensityScaling[positionIndex] = asNumpyArray(aleph).reshape(
+                np.shape(positionIndex)
+            )
             # scaled projection
             frac = (
                 (1 + aleph)
@@ -964,10 +1336,19 @@ class BaseEngine(object):
             self.params.intensityConstraint == "standard"
             or self.params.intensityConstraint == "interferometric"
         ):
-            frac = xp.sqrt(
-                self.reconstruction.Imeasured
-                / (self.reconstruction.Iestimated + gimmel)
-            )
+            # the table is not used once the ptychogram has been replaced (e.g. resampled by aPIE)
+            if (
+                self.amplitudeTable is not None
+                and self._amplitudeSource is self.experimentalData.ptychogram
+            ):
+                frac = self.amplitudeTable[positionIndex] / xp.sqrt(
+                    self.reconstruction.Iestimated + gimmel
+                )
+            else:
+                frac = xp.sqrt(
+                    self.reconstruction.Imeasured
+                    / (self.reconstruction.Iestimated + gimmel)
+                )
 
         else:
             raise ValueError("intensity constraint not properly specified!")
@@ -980,7 +1361,8 @@ class BaseEngine(object):
         ):
             frac = self.experimentalData.W * frac + (1 - self.experimentalData.W)
 
-        # update ESW
+        # update ESW, frac is broadcast over the wavelength, mode and slice axes
+        frac = frac[..., None, None, None, None, :, :]
         if self.params.intensityConstraint == "interferometric":
             temp = (
                 self.reconstruction.ESW + self.reconstruction.reference
@@ -994,18 +1376,23 @@ class BaseEngine(object):
 
         # update background (see PhD thsis by Peng Li)
         if self.params.backgroundModeSwitch:
+            frac = frac[..., 0, 0, 0, 0, :, :]
+            backgroundUpdate = (
+                1 + 1 / self.experimentalData.numFrames * (xp.sqrt(frac) - 1)
+            ) ** 2
+            # for a batch of positions, apply the updates of all positions
+            backgroundUpdate = xp.prod(
+                backgroundUpdate, axis=tuple(range(backgroundUpdate.ndim - 2))
+            )
             if self.params.FourierMaskSwitch:
                 self.reconstruction.background = (
                     self.reconstruction.background
-                    * (1 + 1 / self.experimentalData.numFrames * (xp.sqrt(frac) - 1))
-                    ** 2
+                    * backgroundUpdate
                     * self.experimentalData.W
                 )
             else:
                 self.reconstruction.background = (
-                    self.reconstruction.background
-                    * (1 + 1 / self.experimentalData.numFrames * (xp.sqrt(frac) - 1))
-                    ** 2
+                    self.reconstruction.background * backgroundUpdate
                 )
 
         # back propagate to object plane
@@ -1024,12 +1411,15 @@ class BaseEngine(object):
         frac = self.experimentalData.ptychogramDownsampled[positionIndex] / (
             xp.sum(
                 self.reconstruction.Iestimated.reshape(
-                    self.reconstruction.Nd // self.params.CPSCupsamplingFactor,
-                    self.params.CPSCupsamplingFactor,
-                    self.reconstruction.Nd // self.params.CPSCupsamplingFactor,
-                    self.params.CPSCupsamplingFactor,
+                    self.reconstruction.Iestimated.shape[:-2]
+                    + (
+                        self.reconstruction.Nd // self.params.CPSCupsamplingFactor,
+                        self.params.CPSCupsamplingFactor,
+                        self.reconstruction.Nd // self.params.CPSCupsamplingFactor,
+                        self.params.CPSCupsamplingFactor,
+                    )
                 ),
-                axis=(1, 3),
+                axis=(-3, -1),
             )
             + np.finfo(np.float32).eps
         )
@@ -1113,6 +1503,10 @@ class BaseEngine(object):
                 else:
                     Iestimated = asNumpyArray(self.reconstruction.Iestimated)
                     Imeasured = asNumpyArray(self.reconstruction.Imeasured)
+                # for batched updates, only show the last position of the batch
+                if Iestimated.ndim > 2:
+                    Iestimated = Iestimated.reshape((-1,) + Iestimated.shape[-2:])[-1]
+                    Imeasured = Imeasured.reshape((-1,) + Imeasured.shape[-2:])[-1]
 
                 self.monitor.updateDiffractionDataMonitor(
                     Iestimated=Iestimated, Imeasured=Imeasured
@@ -1231,80 +1625,82 @@ class BaseEngine(object):
         :param sx:
         :return:
         """
+        # sy and sx follow from the position index
+        return self.positionCorrectionBatch(objectPatch[None], [positionIndex])[0]
 
-        xp = getArrayModule(objectPatch)
-        if len(self.reconstruction.error) > self.startAtIteration:
-            self.logger.debug("Calculating position correction")
-            # position gradients
-            # shiftedImages = xp.zeros((self.rowShifts.shape + objectPatch.shape))
-            cc = xp.zeros((len(self.rowShifts), 1))
-
-            # use the real-space object (FFT for FPM)
-            O = self.reconstruction.object
-            Opatch = objectPatch
+    def positionCorrectionBatch(self, objectPatches, positionIndices):
+        """
+        Position gradients of several scan positions at once, see positionCorrection.
+
+        The object patches before the update are cross-correlated with the updated object at the same positions,
+        using one batched FFT cross-correlation, and the position gradient is the centroid of the correlation over
+        the shifts of params.positionCorrectionSwitch_radius (the 3x3 neighbourhood for radius < 2). The
+        gradients stay on the device until all of them are known. For FPM the spectrum windows of the updated object
+        come from self.objectSpectrum, which tracks the patch updates, without a full-object FFT per position.
+        :param objectPatches: object patches before the update, (B, nlambda, nosm, 1, nslice, Np, Np)
+        :param positionIndices: the B position indices
+        :return: position updates delta_p, (B, 2)
+        """
+        positionIndices = np.atleast_1d(positionIndices)
+        if len(self.reconstruction.error) <= self.startAtIteration:
+            return np.zeros((len(positionIndices), 2))
+        self.logger.debug("Calculating position correction")
+        xp = getArrayModule(objectPatches)
+        Np = self.reconstruction.Np
+
+        # the updated object at the same positions, in real space (Fourier space for FPM)
+        O = self.reconstruction.object
+        positions = self.reconstruction.positions[positionIndices]
+        if self.experimentalData.operationMode == "FPM":
+            self.objectSpectrum.update(O, positions, objectPatches)
+            Ocurrent = self.objectSpectrum.windows(O, positions, Np)
+            Opatches = fft2c(objectPatches)
+        else:
+            Ocurrent = xp.stack(
+                [O[..., row : row + Np, col : col + Np] for row, col in positions]
+            )
+            Opatches = objectPatches
+
+        Oshifted = Opatches
+        radius = self.params.positionCorrectionSwitch_radius
+        if radius < 2:
+            rowShifts, colShifts = self.rowShifts, self.colShifts
+            betaGrad = 1000
+            r = 3
+        else:
+            # the correlation is periodic in Np, larger shifts would alias
+            radius = min(radius, (Np - 1) // 2)
+            rowShifts, colShifts = [
+                shifts.flatten()
+                for shifts in np.mgrid[-radius : radius + 1, -radius : radius + 1]
+            ]
+            # remove the mean of the updated patches and the mean of the full (updated) object from the patches
             if self.experimentalData.operationMode == "FPM":
-                O = fft2c(self.reconstruction.object)
-                Opatch = fft2c(objectPatch)
-
-
-            if self.params.positionCorrectionSwitch_radius < 2:
-                # do the direct one as it's a bit faster
-
-                for shifts in range(len(self.rowShifts)):
-                    tempShift = xp.roll(Opatch, self.rowShifts[shifts], axis=-2)
-                    # shiftedImages[shifts, ...] = xp.roll(tempShift, self.colShifts[shifts], axis=-1)
-                    shiftedImages = xp.roll(tempShift, self.colShifts[shifts], axis=-1)
-                    cc[shifts] = xp.squeeze(
-                        xp.sum(shiftedImages.conj() * O[..., sy, sx], axis=(-2, -1))
-                    )
-                    del tempShift, shiftedImages
-                    betaGrad = 1000
-                    r = 3
+                objectMean = ObjectSpectrum.mean(O)
             else:
-                # print('doing FT position correction')
-                ss = slice(-self.params.positionCorrectionSwitch_radius, self.params.positionCorrectionSwitch_radius+1)
-                rowShifts, colShifts = xp.mgrid[ss,ss]
-                self.rowShifts = rowShifts.flatten()
-                self.colShifts = colShifts.flatten()
-                FT_O = xp.fft.fft2(O[...,sy,sx] - O[...,sy, sx].mean())
-                FT_Op = xp.fft.fft2(Opatch - O.mean())
-                xcor = xp.fft.ifft2(FT_O * FT_Op.conj())
-                xcor = abs(xp.fft.fftshift(xcor))
-                N = xcor.shape[-1]
-                sy = slice(N//2-self.params.positionCorrectionSwitch_radius, N//2+self.params.positionCorrectionSwitch_radius + 1)
-                xcor = xcor[...,sy, sy]
-                cc = xcor.flatten()
-                betaGrad = 5
-                r = 10
-                #dy, dx = xp.unravel_index(xp.argmax(xcor), xcor.shape)
-                #dx = dx.get()
-            # truncated cross - correlation
-            # cc = xp.squeeze(xp.sum(shiftedImages.conj() * self.reconstruction.object[..., sy, sx], axis=(-2, -1)))
-            cc = abs(cc)
-
-
-            normFactor = xp.sum(Opatch.conj() * Opatch, axis=(-2, -1)).real
-            grad_x = betaGrad * xp.sum(
-                (cc.T - xp.mean(cc)) / normFactor * xp.array(self.colShifts)
-            )
-            grad_y = betaGrad * xp.sum(
-                (cc.T - xp.mean(cc)) / normFactor * xp.array(self.rowShifts)
-            )
-            #r = np.clip(self.params.positionCorrectionSwitch_radius//5, 3, self.reconstruction.Np//10) # maximum shift in pixels?
-
-            if abs(grad_x) > r:
-                grad_x = r * grad_x / abs(grad_x)
-            if abs(grad_y) > r:
-                grad_y = r * grad_y / abs(grad_y)
-            grad_y = asNumpyArray(grad_y)
-            grad_x = asNumpyArray(grad_x)
-            delta_p = self.daleth * np.array([grad_y, grad_x])
-            self.D[positionIndex, :] = (
-                delta_p
-                + self.beth * self.D[positionIndex, :]
-            )
-            return delta_p
-        return np.zeros(2)
+                objectMean = O.mean()
+            patchAxes = tuple(range(1, Ocurrent.ndim))
+            Ocurrent = Ocurrent - Ocurrent.mean(axis=patchAxes, keepdims=True)
+            Oshifted = Opatches - objectMean
+            betaGrad = 5
+            r = 10
+
+        # cc[s] = sum(conj(shift(Opatch, s)) * Ocurrent), for all shifts s at once
+        xcor = xp.fft.ifft2(xp.fft.fft2(Ocurrent) * xp.fft.fft2(Oshifted).conj())
+        xcor = xcor[..., rowShifts % Np, colShifts % Np]
+        # truncated cross - correlation, (B, number of shifts)
+        cc = abs(xcor.reshape(len(positionIndices), -1, len(rowShifts)).sum(axis=1))
+
+        normFactor = xp.sum(abs(Opatches) ** 2, axis=tuple(range(1, Opatches.ndim)))
+        weights = (cc - cc.mean(axis=1, keepdims=True)) / normFactor[:, None]
+        shifts = xp.asarray(np.stack([rowShifts, colShifts], axis=1), dtype=weights.dtype)
+        grad = betaGrad * (weights @ shifts)
+        # maximum shift in pixels
+        grad = asNumpyArray(xp.clip(grad, -r, r))
+
+        delta_p = self.daleth * grad
+        self.D[positionIndices, :] = delta_p + self.beth * self.D[positionIndices, :]
+        return delta_p
 
     def position_update_to_change_in_z(self, loop):
         """
@@ -1430,14 +1826,17 @@ class BaseEngine(object):
             # l2 regularizer
             self.reconstruction.object *= 1 - self.params.l2reg_object_aleph
             self.reconstruction.probe *= 1 - self.params.l2reg_probe_aleph
+            self.profiler.lap("constraint.l2reg")
 
         # enforce empty beam constraint
         if self.params.modulusEnforcedProbeSwitch:
             self.modulusEnforcedProbe()
+            self.profiler.lap("constraint.modulusEnforcedProbe")
 
         if self.params.orthogonalizationSwitch:
             if np.mod(loop, self.params.orthogonalizationFrequency) == 0:
                 self.orthogonalization()
+                self.profiler.lap("constraint.orthogonalization")
 
         # probe normalization to measured PSD todo: check for multiwave and multi object states
         if self.params.probePowerCorrectionSwitch:
@@ -1448,6 +1847,7 @@ class BaseEngine(object):
                 )
                 * self.experimentalData.maxProbePower
             )
+            self.profiler.lap("constraint.probePowerCorrection")
 
         if (
             self.params.comStabilizationSwitch is not None
@@ -1455,12 +1855,14 @@ class BaseEngine(object):
         ):
             if loop % int(self.params.comStabilizationSwitch) == 0:
                 self.comStabilization()
+                self.profiler.lap("constraint.comStabilization")
 
         if self.params.PSDestimationSwitch:
             raise NotImplementedError()
 
         if self.params.probeBoundary:
             self.reconstruction.probe *= self.probeWindow
+            self.profiler.lap("constraint.probeBoundary")
 
         if self.params.absorbingProbeBoundary:
             if self.experimentalData.operationMode == "FPM":
@@ -1476,6 +1878,7 @@ class BaseEngine(object):
 
             # experimental: also apply in fourier space
             # self.reconstruction.probe = ifft2c(fft2c(self.reconstruction.probe)*self.probeWindow)
+            self.profiler.lap("constraint.absorbingProbeBoundary")
 
         # Todo: objectSmoothenessSwitch,probeSmoothenessSwitch,
         if self.params.probeSmoothenessSwitch:
@@ -1485,6 +1888,7 @@ class BaseEngine(object):
                 self.params.probeSmoothenessWidth,
                 self.params.probeSmoothnessAleph,
             )
+            self.profiler.lap("constraint.probeSmootheness")
 
         if self.params.objectSmoothenessSwitch:
             self.reconstruction.object = smooth_amplitude(
@@ -1492,6 +1896,7 @@ class BaseEngine(object):
                 self.params.objectSmoothenessWidth,
                 self.params.objectSmoothnessAleph,
             )
+            self.profiler.lap("constraint.objectSmootheness")
 
         if self.params.absObjectSwitch:
             self.reconstruction.object = (
@@ -1499,6 +1904,7 @@ class BaseEngine(object):
             ) * self.reconstruction.object + self.params.absObjectBeta * abs(
                 self.reconstruction.object
             )
+            self.profiler.lap("constraint.absObject")
 
         if self.params.absProbeSwitch:
             self.reconstruction.probe = (
@@ -1506,6 +1912,7 @@ class BaseEngine(object):
             ) * self.reconstruction.probe + self.params.absProbeBeta * abs(
                 self.reconstruction.probe
             )
+            self.profiler.lap("constraint.absProbe")
 
         # this is intended to slowly push non-measured object region to abs value lower than
         # the max abs inside object ROI allowing for good contrast when monitoring object
@@ -1521,6 +1928,7 @@ class BaseEngine(object):
                     )
                 )
             )
+            self.profiler.lap("constraint.objectContrast")
         if self.params.couplingSwitch and self.reconstruction.nlambda > 1:
             self.reconstruction.probe[0] = (
                 1 - self.params.couplingAleph
@@ -1546,6 +1954,7 @@ class BaseEngine(object):
             ] + self.params.couplingAleph * self.reconstruction.probe[
                 -2
             ]
+            self.profiler.lap("constraint.coupling")
         if self.params.binaryProbeSwitch:
             probePeakAmplitude = np.max(abs(self.reconstruction.probe))
             probeThresholded = self.reconstruction.probe.copy()
@@ -1560,10 +1969,12 @@ class BaseEngine(object):
                 (1 - self.params.binaryProbeAleph) * self.reconstruction.probe
                 + self.params.binaryProbeAleph * probeThresholded
             )
+            self.profiler.lap("constraint.binaryProbe")
 
         if self.params.positionCorrectionSwitch:
 
             self.positionCorrectionUpdate()
+            self.profiler.lap("constraint.positionCorrectionUpdate")
 
         if (
             self.params.map_position_to_z_change
@@ -1571,6 +1982,7 @@ class BaseEngine(object):
             and self.params.positionCorrectionSwitch
         ):
             self.position_update_to_change_in_z(loop)
+            self.profiler.lap("constraint.map_position_to_z_change")
 
         if self.params.TV_autofocus:
             merit, AOI_image, allmerits = self.reconstruction.TV_autofocus(self.params, loop=loop)
@@ -1578,10 +1990,15 @@ class BaseEngine(object):
                 merit, AOI_image, metric_name=self.params.TV_autofocus_metric,
                 allmerits=allmerits,
             )
+            self.profiler.lap("constraint.TV_autofocus")
 
         # if self.params.OPRP and loop % self.params.OPRP_tsvd_interval == 0:
         #     self.reconstruction.probe_storage.tsvd()
 
+        if self.params.positionCorrectionSwitch:
+            # the constraints change the object outside the patch updates that the spectrum tracks
+            self.objectSpectrum.reset()
+
     def orthogonalization(self):
         """
         Perform orthogonalization
@@ -1787,7 +2204,7 @@ class BaseEngine(object):
         Ameasured = self.reconstruction.Imeasured**0.5
         Aestimated = xp.abs(self.reconstruction.Iestimated) ** 0.5
 
-        noise = xp.abs(xp.mean(Ameasured - Aestimated))
+        noise = xp.abs(xp.mean(Ameasured - Aestimated, axis=(-2, -1), keepdims=True))
 
         Ameasured = Ameasured - noise
         Ameasured[Ameasured < 0] = 0
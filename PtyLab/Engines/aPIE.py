@@ -2,7 +2,10 @@ import numpy as np
 from matplotlib import pyplot as plt
 import tqdm
 from typing import Any
-from scipy.interpolate import interp2d
+import copy
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from PtyLab.utils.visualisation import hsvplot
 
 try:
@@ -19,6 +22,7 @@ from PtyLab.Engines.BaseEngine import BaseEngine
 from PtyLab.ExperimentalData.ExperimentalData import ExperimentalData
 from PtyLab.Params.Params import Params
 from PtyLab.utils.gpuUtils import getArrayModule, asNumpyArray
+from PtyLab.utils.profiler import StageProfiler
 from PtyLab.Monitor.Monitor import Monitor
 from PtyLab.Operators.Operators import aspw
 import logging
@@ -61,6 +65,27 @@ class aPIE(BaseEngine):
         if not hasattr(self.reconstruction, "thetaHistory"):
             self.reconstruction.thetaHistory = np.array([])
 
+        # number of angles tried per iteration (the current one and numCandidates - 1 random ones), and the number
+        # of threads that run their sweeps (None: one per candidate, at most one per core)
+        self.numCandidates = 2
+        self.numWorkers = None
+        # the reconstruction fields that a candidate sweep changes, the ones of the winner are kept. This includes
+        # the side effects of applyConstraints (position correction, z update and autofocus)
+        self.candidateFields = [
+            "object",
+            "probe",
+            "background",
+            "error",
+            "errorAtPos",
+            "residualReservoir",
+            "purityProbe",
+            "purityObject",
+            "zo",
+            "encoder_corrected",
+            "zMomentum",
+        ]
+        # the same for the engine: the position correction momentum and the state of the z optimizer
+        self.candidateEngineFields = ["D", "optlib", "i_z_optimizer"]
         self.thetaSearchRadiusMin = 0.01
         self.thetaSearchRadiusMax = 0.1
         self.ptychogramUntransformed = self.experimentalData.ptychogram.copy()
@@ -73,6 +98,8 @@ class aPIE(BaseEngine):
         self._prepareReconstruction()
 
         xp = getArrayModule(self.reconstruction.object)
+        # the measured ptychogram, on the same device as the reconstruction, is resampled for every candidate theta
+        ptychogramUntransformed = xp.asarray(self.ptychogramUntransformed)
 
         # linear search
         thetaSearchRadiusList = np.linspace(
@@ -82,6 +109,11 @@ class aPIE(BaseEngine):
         self.pbar = tqdm.trange(
             self.numIterations, desc="aPIE", file=sys.stdout, leave=True
         )
+        # the candidate sweeps run concurrently
+        numWorkers = self.numWorkers or min(self.numCandidates, os.cpu_count())
+        pool = ThreadPoolExecutor(numWorkers) if numWorkers > 1 else None
+        mapCandidates = map if pool is None else pool.map
+
         for loop in self.pbar:
             # save theta search history
             self.reconstruction.thetaHistory = np.append(
@@ -89,144 +121,41 @@ class aPIE(BaseEngine):
                 asNumpyArray(self.reconstruction.theta),
             )
 
-            # select two angles (todo check if three angles behave better)
+            # select the candidate angles: the current one and numCandidates - 1 random ones within the search radius
             theta = (
                 np.array(
-                    [
-                        self.reconstruction.theta,
+                    [self.reconstruction.theta]
+                    + [
                         self.reconstruction.theta
-                        + thetaSearchRadiusList[loop] * (-1 + 2 * np.random.rand()),
+                        + thetaSearchRadiusList[loop] * (-1 + 2 * np.random.rand())
+                        for _ in range(self.numCandidates - 1)
                     ]
                 )
                 + self.reconstruction.thetaMomentum
             )
 
-            # save object and probe
-            probeTemp = self.reconstruction.probe.copy()
-            objectTemp = self.reconstruction.object.copy()
-
-            # probe and object buffer (todo maybe there's more elegant way )
-            probeBuffer = xp.zeros_like(
-                probeTemp
-            )  # shape=(np.array([probeTemp, probeTemp])).shape)
-            probeBuffer = [probeBuffer, probeBuffer]
-            objectBuffer = xp.zeros_like(
-                objectTemp
-            )  # , shape=(np.array([objectTemp, objectTemp])).shape)  # for polychromatic case this will need to be multimode
-            objectBuffer = [objectBuffer, objectBuffer]
-            # initialize error
-            errorTemp = np.zeros((2, 1))
-
-            for k in range(2):
-                self.reconstruction.probe = probeTemp
-                self.reconstruction.object = objectTemp
-                # reset ptychogram (transform into estimate coordinates)
-                Xq = T_inv(
-                    self.reconstruction.Xd,
-                    self.reconstruction.Yd,
-                    self.reconstruction.zo,
-                    theta[k],
-                )  # todo check if 1D is enough to save time
-                for l in range(self.experimentalData.numFrames):
-                    temp = self.ptychogramUntransformed[l]
-                    f = interp2d(
-                        self.reconstruction.xd,
-                        self.reconstruction.xd,
-                        temp,
-                        kind="linear",
-                        fill_value=0,
-                    )
-                    temp2 = abs(f(Xq[0], self.reconstruction.xd))
-                    temp2 = np.nan_to_num(temp2)
-                    temp2[temp2 < 0] = 0
-                    self.experimentalData.ptychogram[l] = xp.array(temp2)
-
-                # renormalization(for energy conservation) # todo not layer by layer?
-                self.experimentalData.ptychogram = (
-                    self.experimentalData.ptychogram
-                    / np.linalg.norm(self.experimentalData.ptychogram)
-                    * np.linalg.norm(self.ptychogramUntransformed)
+            # every candidate sweeps its own copy of the object and probe
+            candidates = [self._makeCandidate() for _ in theta]
+            for candidate in candidates:
+                # drawn here, so that the threads do not use the global random generator
+                candidate.setPositionOrder()
+            errorTemp = list(
+                mapCandidates(
+                    lambda candidate, t: candidate._candidateSweep(
+                        t, ptychogramUntransformed, loop
+                    ),
+                    candidates,
+                    theta,
                 )
+            )
 
-                self.experimentalData.W = np.ones_like(self.reconstruction.Xd)
-                fw = interp2d(
-                    self.reconstruction.xd,
-                    self.reconstruction.xd,
-                    self.experimentalData.W,
-                    kind="linear",
-                    fill_value=0,
-                )
-                self.experimentalData.W = abs(fw(Xq[0], self.reconstruction.xd))
-                self.experimentalData.W = np.nan_to_num(self.experimentalData.W)
-                self.experimentalData.W[self.experimentalData.W == 0] = 1e-3
-                self.experimentalData.W = xp.array(self.experimentalData.W)
-
-                # todo check if it is right
-                if self.params.fftshiftSwitch:
-                    self.experimentalData.ptychogram = xp.fft.ifftshift(
-                        self.experimentalData.ptychogram, axes=(-1, -2)
-                    )
-                    self.experimentalData.W = xp.fft.ifftshift(
-                        self.experimentalData.W, axes=(-1, -2)
-                    )
-
-                # set position order
-                self.setPositionOrder()
-
-                for positionLoop, positionIndex in enumerate(self.positionIndices):
-                    ### patch1 ###
-                    # get object patch1
-                    row1, col1 = self.reconstruction.positions[positionIndex]
-                    sy = slice(row1, row1 + self.reconstruction.Np)
-                    sx = slice(col1, col1 + self.reconstruction.Np)
-                    # note that object patch has size of probe array
-                    objectPatch = self.reconstruction.object[..., sy, sx].copy()
-
-                    # make exit surface wave
-                    self.reconstruction.esw = objectPatch * self.reconstruction.probe
-
-                    # propagate to camera, intensityProjection, propagate back to object
-                    self.intensityProjection(positionIndex)
-
-                    # difference term1
-                    DELTA = self.reconstruction.eswUpdate - self.reconstruction.esw
-
-                    # object update
-                    self.reconstruction.object[..., sy, sx] = self.objectPatchUpdate(
-                        objectPatch, DELTA
-                    )
-
-                    # probe update
-                    self.reconstruction.probe = self.probeUpdate(objectPatch, DELTA)
-
-                # get error metric
-                self.getErrorMetrics()
-                # remove error from error history
-                errorTemp[k] = self.reconstruction.error[-1]
-                self.reconstruction.error = np.delete(self.reconstruction.error, -1)
-
-                # apply Constraints
-                self.applyConstraints(loop)
-                # update buffer
-                probeBuffer[k] = self.reconstruction.probe
-                objectBuffer[k] = self.reconstruction.object
-
-            if errorTemp[1] < errorTemp[0]:
-                dtheta = theta[1] - theta[0]
-                self.reconstruction.theta = theta[1]
-                self.reconstruction.probe = probeBuffer[1]
-                self.reconstruction.object = objectBuffer[1]
-                self.reconstruction.error = np.append(
-                    self.reconstruction.error, errorTemp[1]
-                )
-            else:
-                dtheta = 0
-                self.reconstruction.theta = theta[0]
-                self.reconstruction.probe = probeBuffer[0]
-                self.reconstruction.object = objectBuffer[0]
-                self.reconstruction.error = np.append(
-                    self.reconstruction.error, errorTemp[0]
-                )
+            # keep the winner
+            best = int(np.argmin(errorTemp))
+            dtheta = theta[best] - theta[0]
+            self._applyCandidate(candidates[best])
+            self.reconstruction.theta = theta[best]
+            for candidate in candidates:
+                self.profiler.merge(candidate.profiler)
 
             self.reconstruction.thetaMomentum = (
                 self.feedback * dtheta
@@ -276,6 +205,9 @@ class aPIE(BaseEngine):
 
             self.showReconstruction(loop)
 
+        if pool is not None:
+            pool.shutdown()
+
         if self.params.gpuFlag:
             self.logger.info("switch to cpu")
             self._move_data_to_cpu()
@@ -283,6 +215,148 @@ class aPIE(BaseEngine):
 
         # self.thetaSearchRadiusMax = thetaSearchRadiusList[loop]
 
+    def _makeCandidate(self):
+        """
+        Copy of the engine for one candidate angle, which can be swept in a worker thread. The untransformed
+        ptychogram, positions and kernels are shared (read-only). Everything the sweep writes is the candidate's
+        own: the candidateFields, the fields of the position loop (esw, Imeasured, ...), the parameters (e.g.
+        intensityScaling) and the profiler. The detector data is replaced by _candidateSweep.
+        """
+        candidate = copy.copy(self)
+        candidate.params = copy.copy(self.params)
+        candidate.reconstruction = copy.copy(self.reconstruction)
+        candidate.experimentalData = copy.copy(self.experimentalData)
+        candidate.framePrefetcher = None
+        for owner in [candidate.params, candidate.reconstruction]:
+            for name, value in vars(owner).items():
+                if isinstance(value, list) or hasattr(value, "__array__"):
+                    setattr(owner, name, copy.copy(value))
+        for owner, candidateOwner, names in self._candidateOwners(candidate):
+            for name in names:
+                value = getattr(owner, name, None)
+                # scalars are not changed in place (and setting zo again would drop the coordinate grids)
+                if value is not None and not np.isscalar(value):
+                    setattr(candidateOwner, name, copy.deepcopy(value))
+        candidate.profiler = StageProfiler(
+            enabled=self.profiler.enabled, synchronize=self.profiler.synchronize
+        )
+        # the copied timers still call the methods of self
+        self.profiler.detach(candidate)
+        if candidate.profiler.enabled:
+            candidate.profiler.attach(candidate)
+        return candidate
+
+    def _candidateOwners(self, candidate):
+        """
+        (engine object, candidate object, field names) of the candidate state.
+        """
+        return [
+            (self.reconstruction, candidate.reconstruction, self.candidateFields),
+            (self, candidate, self.candidateEngineFields),
+        ]
+
+    def _applyCandidate(self, candidate):
+        """
+        Keep the state of the winning candidate: the candidateFields (including the changes of applyConstraints,
+        e.g. zo and encoder_corrected), the candidateEngineFields, the intensity scaling and the resampled detector
+        data.
+        """
+        for owner, candidateOwner, names in self._candidateOwners(candidate):
+            for name in names:
+                if hasattr(candidateOwner, name):
+                    value = getattr(candidateOwner, name)
+                    # unchanged fields are not set again, the setters of zo and encoder_corrected drop caches
+                    if value is not getattr(owner, name, None):
+                        setattr(owner, name, value)
+        if hasattr(candidate.params, "intensityScaling"):
+            self.params.intensityScaling = candidate.params.intensityScaling
+        self.experimentalData.ptychogram = candidate.experimentalData.ptychogram
+        self.experimentalData.W = candidate.experimentalData.W
+
+    def _candidateSweep(self, theta, ptychogramUntransformed, loop):
+        """
+        One ePIE sweep over all positions with the detector resampled for angle theta. Runs on a candidate made
+        by _makeCandidate, possibly in a worker thread.
+        :return: error of the sweep
+        """
+        xp = getArrayModule(self.reconstruction.object)
+        # reset ptychogram (transform into estimate coordinates)
+        (
+            self.experimentalData.ptychogram,
+            self.experimentalData.W,
+        ) = self.resampleDetector(theta, ptychogramUntransformed)
+
+        # todo check if it is right
+        if self.params.fftshiftSwitch:
+            self.experimentalData.ptychogram = xp.fft.ifftshift(
+                self.experimentalData.ptychogram, axes=(-1, -2)
+            )
+            self.experimentalData.W = xp.fft.ifftshift(
+                self.experimentalData.W, axes=(-1, -2)
+            )
+
+        for positionLoop, positionIndex in enumerate(self.positionIndices):
+            ### patch1 ###
+            # get object patch1
+            row1, col1 = self.reconstruction.positions[positionIndex]
+            sy = slice(row1, row1 + self.reconstruction.Np)
+            sx = slice(col1, col1 + self.reconstruction.Np)
+            # note that object patch has size of probe array
+            objectPatch = self.reconstruction.object[..., sy, sx].copy()
+
+            # make exit surface wave
+            self.reconstruction.esw = objectPatch * self.reconstruction.probe
+
+            # propagate to camera, intensityProjection, propagate back to object
+            self.intensityProjection(positionIndex)
+
+            # difference term1
+            DELTA = self.reconstruction.eswUpdate - self.reconstruction.esw
+
+            # object update
+            self.reconstruction.object[..., sy, sx] = self.objectPatchUpdate(
+                objectPatch, DELTA
+            )
+
+            # probe update
+            self.reconstruction.probe = self.probeUpdate(objectPatch, DELTA)
+
+        # get error metric
+        self.getErrorMetrics()
+
+        # apply Constraints
+        self.applyConstraints(loop)
+        return self.reconstruction.error[-1]
+
+    def resampleDetector(self, theta, ptychogram):
+        """
+        Transform the measured ptychogram into the estimate coordinates for angle theta, and renormalize it for
+        energy conservation. The coordinate map is cached per theta (see detectorResamplingMap), and applied to
+        all frames at once.
+        :param theta: angle in degrees
+        :param ptychogram: untransformed ptychogram (numpy or cupy)
+        :return: resampled ptychogram, weights W of the detector pixels
+        """
+        xp = getArrayModule(ptychogram)
+        i0, i1, w0, w1 = detectorResamplingMap(
+            float(theta),
+            float(self.reconstruction.zo),
+            int(self.reconstruction.Nd),
+            float(self.reconstruction.dxd),
+            on_gpu=xp is not np,
+        )
+        w0 = w0.astype(ptychogram.dtype)
+        w1 = w1.astype(ptychogram.dtype)
+        # linear interpolation along x, the same for all rows and frames
+        resampled = ptychogram[..., i0] * w0
+        resampled += ptychogram[..., i1] * w1
+        # renormalization (for energy conservation) # todo not layer by layer?
+        resampled *= xp.linalg.norm(ptychogram) / xp.linalg.norm(resampled)
+
+        W = xp.broadcast_to(w0 + w1, resampled.shape[-2:]).astype(np.float64)
+        W[W == 0] = 1e-3
+        return resampled, W
+
     def objectPatchUpdate(self, objectPatch: np.ndarray, DELTA: np.ndarray):
         """
         Todo add docstring
@@ -349,5 +423,30 @@ def T_inv(xd, yd, z, theta):
     return x
 
 
+@lru_cache(maxsize=32)
+def detectorResamplingMap(theta, zo, Nd, dxd, on_gpu=False):
+    """
+    Linear interpolation map from the detector coordinates to the estimate coordinates for angle theta.
+
+    The transformation only changes the x coordinate (see T_inv), so the map is one-dimensional: resampled column j
+    is w0[j] * column i0[j] + w1[j] * column i1[j]. Coordinates outside of the detector get zero weights.
+    :return: i0, i1, w0, w1 (numpy arrays, or cupy arrays if on_gpu)
+    """
+    xd = np.linspace(-Nd / 2, Nd / 2, int(Nd)) * dxd
+    # coordinates of the first detector row, in increasing order
+    xq = np.sort(T_inv(xd, xd[0], zo, theta))
+    i1 = np.clip(np.searchsorted(xd, xq, side="right"), 1, Nd - 1)
+    i0 = i1 - 1
+    with np.errstate(invalid="ignore"):
+        w1 = (xq - xd[i0]) / (xd[i1] - xd[i0])
+        outside = ~((xq >= xd[0]) & (xq <= xd[-1]))
+    w1[outside] = 0
+    w0 = 1 - w1
+    w0[outside] = 0
+    if on_gpu:
+        return cp.asarray(i0), cp.asarray(i1), cp.asarray(w0), cp.asarray(w1)
+    return i0, i1, w0, w1
+
+
 def toDegree(theta: Any) -> float:
     return np.pi * theta / 180
@@ -54,6 +54,7 @@ class e3PIE(BaseEngine):
             self.reconstruction.dz,
             self.reconstruction.wavelength / self.reconstruction.refrIndex,
             self.reconstruction.Lp,
+            precision=self.params.precision,
         )[1]
         # shift transfer function to avoid fftshifts for FFTS
         self.reconstruction.H = np.fft.ifftshift(self.optimizableH)
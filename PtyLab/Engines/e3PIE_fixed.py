@@ -49,7 +49,7 @@ class e3PIE(BaseEngine):
             # preallocate transfer function
             self.reconstruction.H = aspw(np.squeeze(self.reconstruction.probe[0, 0, 0, 0, ...]), self.reconstruction.dz,
                                          self.reconstruction.wavelength / self.reconstruction.refrIndex,
-                                         self.reconstruction.Lp)[1]
+                                         self.reconstruction.Lp, precision=self.params.precision)[1]
             # shift transfer function to avoid fftshifts for FFTS
             # self.reconstruction.H = np.fft.ifftshift(self.optimizableH)
             self.reconstruction.H = np.fft.ifftshift(self.reconstruction.H)
@@ -59,7 +59,7 @@ class e3PIE(BaseEngine):
             # preallocate transfer function
             self.reconstruction.H = aspw(xp.squeeze(self.reconstruction.probe[0, 0, 0, 0, ...]), self.reconstruction.dz,
                                          self.reconstruction.wavelength / self.reconstruction.refrIndex,
-                                         self.reconstruction.Lp)[1]
+                                         self.reconstruction.Lp, precision=self.params.precision)[1]
             # shift transfer function to avoid fftshifts for FFTS
             # self.reconstruction.H = np.fft.ifftshift(self.optimizableH)
             self.reconstruction.H = xp.fft.ifftshift(self.reconstruction.H)
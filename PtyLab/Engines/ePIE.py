@@ -36,6 +36,8 @@ class ePIE(BaseEngine):
         self.logger = logging.getLogger("ePIE")
         self.logger.info("Sucesfully created ePIE ePIE_engine")
         self.logger.info("Wavelength attribute: %s", self.reconstruction.wavelength)
+        # params.batchSize > 1 uses batchPositionUpdate
+        self.supportsBatches = True
         self.initializeReconstructionParams()
 
     def initializeReconstructionParams(self):
@@ -67,43 +69,56 @@ class ePIE(BaseEngine):
                     0,
                     self.experimentalData.ptychogram.shape[0],
                 )
-            for positionLoop, positionIndex in enumerate(self.positionIndices):
-                # get object patch
-                with cp.cuda.Stream(non_blocking=True) as stream:
-                    if self.params.OPRP:
-                        self.reconstruction.probe = (
-                            self.reconstruction.probe_storage.get(positionIndex)
-                        )
-                    row, col = self.reconstruction.positions[positionIndex]
-                    sy = slice(row, row + self.reconstruction.Np)
-                    sx = slice(col, col + self.reconstruction.Np)
-                    # note that object patch has size of probe array
-                    objectPatch = self.reconstruction.object[..., sy, sx].copy()
-
-                    # make exit surface wave
-                    self.reconstruction.esw = objectPatch * self.reconstruction.probe
-
-                    # propagate to camera, intensityProjection, propagate back to object
-                    self.intensityProjection(positionIndex)
-
-                    # difference term
-                    DELTA = self.reconstruction.eswUpdate - self.reconstruction.esw
-
-                    # object update
-                    self.reconstruction.object[..., sy, sx] = self.objectPatchUpdate(
-                        objectPatch, DELTA
+            if self.params.batchSize > 1:
+                if self.params.OPRP:
+                    raise NotImplementedError(
+                        "OPRP is not implemented for params.batchSize > 1"
                     )
-
-                    # probe update
-                    self.reconstruction.probe = self.probeUpdate(objectPatch, DELTA)
-                    if self.params.OPRP:
-                        self.reconstruction.probe_storage.push(
-                            self.reconstruction.probe,
-                            positionIndex,
-                            self.experimentalData.ptychogram.shape[0],
-                        )
-                    stream.synchronize()
+                for positionLoop, positionIndices in enumerate(
+                    self.getPositionBatches()
+                ):
+                    # batched propagation, intensityProjection and accumulated object and probe update
+                    self.batchPositionUpdate(positionIndices)
                     yield loop, positionLoop
+            else:
+                for positionLoop, positionIndex in enumerate(self.positionIndices):
+                    # get object patch
+                    with cp.cuda.Stream(non_blocking=True) as stream:
+                        if self.params.OPRP:
+                            self.reconstruction.probe = (
+                                self.reconstruction.probe_storage.get(positionIndex)
+                            )
+                        with self.profiler.stage("patchExtraction"):
+                            row, col = self.reconstruction.positions[positionIndex]
+                            sy = slice(row, row + self.reconstruction.Np)
+                            sx = slice(col, col + self.reconstruction.Np)
+                            # note that object patch has size of probe array
+                            objectPatch = self.reconstruction.object[..., sy, sx].copy()
+
+                        # make exit surface wave
+                        self.reconstruction.esw = objectPatch * self.reconstruction.probe
+
+                        # propagate to camera, intensityProjection, propagate back to object
+                        self.intensityProjection(positionIndex)
+
+                        # difference term
+                        DELTA = self.reconstruction.eswUpdate - self.reconstruction.esw
+
+                        # object update
+                        self.reconstruction.object[..., sy, sx] = self.objectPatchUpdate(
+                            objectPatch, DELTA
+                        )
+
+                        # probe update
+                        self.reconstruction.probe = self.probeUpdate(objectPatch, DELTA)
+                        if self.params.OPRP:
+                            self.reconstruction.probe_storage.push(
+                                self.reconstruction.probe,
+                                positionIndex,
+                                self.experimentalData.ptychogram.shape[0],
+                            )
+                        stream.synchronize()
+                        yield loop, positionLoop
 
             # get error metric
             self.getErrorMetrics()
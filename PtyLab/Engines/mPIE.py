@@ -36,6 +36,8 @@ class mPIE(BaseEngine):
         self.logger = logging.getLogger("mPIE")
         self.logger.info("Sucesfully created mPIE mPIE_engine")
         self.logger.info("Wavelength attribute: %s", self.reconstruction.wavelength)
+        # params.batchSize > 1 uses batchPositionUpdate
+        self.supportsBatches = True
         # initialize mPIE Params
         self.initializeReconstructionParams()
         self.params.momentumAcceleration = True
@@ -107,60 +109,87 @@ class mPIE(BaseEngine):
         for loop in self.pbar:
             # set position order
             self.setPositionOrder()
-            self.pbar_pos = tqdm.tqdm(self.positionIndices, leave=False, desc='ptychogram', file=sys.stdout)
-            for positionLoop, positionIndex in enumerate(self.pbar_pos):
-                # get object patch, stored as self.probe
-                # self.reconstruction.make_probe(positionIndex)
-
-                row, col = self.reconstruction.positions[positionIndex]
-                sy = slice(row, row + self.reconstruction.Np)
-                sx = slice(col, col + self.reconstruction.Np)
-                # note that object patch has size of probe array
-                objectPatch = self.reconstruction.object[..., sy, sx].copy()
-
-                # make exit surface wave
-                self.reconstruction.esw = objectPatch * self.reconstruction.probe
-
-                # propagate to camera, intensityProjection, propagate back to object
-                self.intensityProjection(positionIndex)
-
-                # difference term
-                DELTA = self.reconstruction.eswUpdate - self.reconstruction.esw
-                # self.viewer.layers['update'].data[positionIndex] = abs(DELTA ** 2).get()
-                # import pyqtgraph as pg
-                # pg.QtGui.QGuiApplication.processEvents()
-
-                # object update
-                if self.params.objectTVregSwitch and loop % self.params.objectTVfreq == 0:
-                    object_patch = self.objectPatchUpdate_TV(objectPatch, DELTA)
-                else:
-                    object_patch = self.objectPatchUpdate(objectPatch, DELTA)
-
+            if self.params.batchSize > 1:
                 if self.keepPatches:
-                    self.patches[positionIndex, ..., sy, sx] = asNumpyArray(
-                        abs(object_patch) ** 2
+                    raise NotImplementedError(
+                        "keepPatches is not implemented for params.batchSize > 1"
                     )
+                self.pbar_pos = tqdm.tqdm(self.getPositionBatches(), leave=False, desc='ptychogram', file=sys.stdout)
+                # the object and probe updates of a single position, see batchPositionUpdate
+                if self.params.objectTVregSwitch and loop % self.params.objectTVfreq == 0:
+                    objectPatchUpdate = self.objectPatchUpdate_TV
                 else:
-                    self.reconstruction.object[..., sy, sx] = object_patch
-
-                # probe update
-                weight = 1
-                if self.params.weigh_probe_updates_by_intensity:
-                    weight = self.experimentalData.relative_intensity(positionIndex)
-                    # print(f'for position {positionIndex}, using weight {weight}')
+                    objectPatchUpdate = self.objectPatchUpdate
 
-                self.reconstruction.probe = self.probeUpdate(objectPatch, DELTA, weight)
-                # self.reconstruction.push_probe_update(self.reconstruction.probe, positionIndex, self.experimentalData.ptychogram.shape[0])
+                def probeUpdate(objectPatch, DELTA, positionIndex):
+                    weight = self.probeUpdateWeight(positionIndex)
+                    return self.probeUpdate(objectPatch, DELTA, weight)
 
-                if self.params.positionCorrectionSwitch:
-                    shifter = self.positionCorrection(objectPatch, positionIndex, sy, sx)
-                    #self.pbar_pos.write(f'Corr: {shifter[0]*1e6:.2f} um x {shifter[1]*1e6:.2f} um')
+                for positionIndices in self.pbar_pos:
+                    # batched propagation, intensityProjection and accumulated object and probe update
+                    objectPatches = self.batchPositionUpdate(
+                        positionIndices, objectPatchUpdate, probeUpdate
+                    )
 
-                # momentum updates
-                if np.random.rand(1) > 0.95:
-                    self.objectMomentumUpdate()
-                    self.probeMomentumUpdate()
-                # yield positionLoop, positionIndex
+                    if self.params.positionCorrectionSwitch:
+                        self.positionCorrectionBatch(objectPatches, positionIndices)
+
+                    # momentum updates, at the same rate per position as the sequential loop
+                    if np.random.rand(1) > 0.95 ** len(positionIndices):
+                        self.objectMomentumUpdate()
+                        self.probeMomentumUpdate()
+            else:
+                self.pbar_pos = tqdm.tqdm(self.positionIndices, leave=False, desc='ptychogram', file=sys.stdout)
+                for positionLoop, positionIndex in enumerate(self.pbar_pos):
+                    # get object patch, stored as self.probe
+                    # self.reconstruction.make_probe(positionIndex)
+
+                    with self.profiler.stage("patchExtraction"):
+                        row, col = self.reconstruction.positions[positionIndex]
+                        sy = slice(row, row + self.reconstruction.Np)
+                        sx = slice(col, col + self.reconstruction.Np)
+                        # note that object patch has size of probe array
+                        objectPatch = self.reconstruction.object[..., sy, sx].copy()
+
+                    # make exit surface wave
+                    self.reconstruction.esw = objectPatch * self.reconstruction.probe
+
+                    # propagate to camera, intensityProjection, propagate back to object
+                    self.intensityProjection(positionIndex)
+
+                    # difference term
+                    DELTA = self.reconstruction.eswUpdate - self.reconstruction.esw
+                    # self.viewer.layers['update'].data[positionIndex] = abs(DELTA ** 2).get()
+                    # import pyqtgraph as pg
+                    # pg.QtGui.QGuiApplication.processEvents()
+
+                    # object update
+                    if self.params.objectTVregSwitch and loop % self.params.objectTVfreq == 0:
+                        object_patch = self.objectPatchUpdate_TV(objectPatch, DELTA)
+                    else:
+                        object_patch = self.objectPatchUpdate(objectPatch, DELTA)
+
+                    if self.keepPatches:
+                        self.patches[positionIndex, ..., sy, sx] = asNumpyArray(
+                            abs(object_patch) ** 2
+                        )
+                    else:
+                        self.reconstruction.object[..., sy, sx] = object_patch
+
+                    # probe update
+                    weight = self.probeUpdateWeight(positionIndex)
+                    self.reconstruction.probe = self.probeUpdate(objectPatch, DELTA, weight)
+                    # self.reconstruction.push_probe_update(self.reconstruction.probe, positionIndex, self.experimentalData.ptychogram.shape[0])
+
+                    if self.params.positionCorrectionSwitch:
+                        shifter = self.positionCorrection(objectPatch, positionIndex, sy, sx)
+                        #self.pbar_pos.write(f'Corr: {shifter[0]*1e6:.2f} um x {shifter[1]*1e6:.2f} um')
+
+                    # momentum updates
+                    if np.random.rand(1) > 0.95:
+                        self.objectMomentumUpdate()
+                        self.probeMomentumUpdate()
+                    # yield positionLoop, positionIndex
 
             # get error metric
             self.getErrorMetrics()
@@ -180,6 +209,17 @@ class mPIE(BaseEngine):
 
             # todo clearMemory implementation
 
+    def probeUpdateWeight(self, positionIndex):
+        """
+        Weight of the probe update at a position, the relative intensity of the frame if
+        params.weigh_probe_updates_by_intensity is set.
+        :param positionIndex:
+        :return:
+        """
+        if self.params.weigh_probe_updates_by_intensity:
+            return self.experimentalData.relative_intensity(positionIndex)
+        return 1
+
     def objectMomentumUpdate(self):
         """
         momentum update object, save updated objectMomentum and objectBuffer.
@@ -199,6 +199,9 @@ class mqNewton(BaseEngine):
 
         self.reconstruction.object -= self.betaObject_m * update
         self.reconstruction.objectBuffer = self.reconstruction.object.copy()
+        if self.params.positionCorrectionSwitch:
+            # the whole object changed in-place, see ObjectSpectrum
+            self.objectSpectrum.reset()
 
     def probeMomentumUpdate(self, loop):
         """
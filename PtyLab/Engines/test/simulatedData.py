@@ -0,0 +1,40 @@
+import h5py
+import numpy as np
+
+
+def writeSimulatedData(filename, Nd=32, numSide=4, seed=0):
+    """
+    Write a small simulated CPM data set (random object, circular probe, Fraunhofer diffraction) to filename, so
+    that the engines can be tested without the example data.
+    :param Nd: number of detector pixels
+    :param numSide: the scan is a numSide x numSide grid
+    """
+    rng = np.random.default_rng(seed)
+    wavelength = 632.8e-9
+    zo = 5e-2
+    dxd = 2 * 4.5e-6 * 128 / Nd
+    dxp = wavelength * zo / (Nd * dxd)
+    step = Nd // 5
+    grid = (np.arange(numSide) - numSide / 2) * step
+    Y, X = np.meshgrid(grid, grid)
+    positions = np.stack([Y.ravel(), X.ravel()], 1) + rng.integers(-2, 3, (numSide**2, 2))
+    No = int(positions.max() - positions.min() + 2 * Nd)
+    No += No % 2
+    object = np.exp(1j * rng.random((No, No))) * (0.5 + 0.5 * rng.random((No, No)))
+    x = np.arange(Nd) - Nd / 2
+    X, Y = np.meshgrid(x, x)
+    probe = (X**2 + Y**2 < (Nd / 5) ** 2).astype(complex)
+    ptychogram = []
+    for row, col in positions.astype(int) + No // 2 - Nd // 2:
+        esw = object[row : row + Nd, col : col + Nd] * probe
+        ptychogram.append(
+            abs(np.fft.fftshift(np.fft.fft2(np.fft.ifftshift(esw), norm="ortho"))) ** 2
+        )
+    with h5py.File(filename, "w") as archive:
+        archive.create_dataset("ptychogram", data=np.array(ptychogram, dtype=np.float32))
+        archive.create_dataset("encoder", data=positions * dxp)
+        archive.create_dataset("wavelength", data=wavelength)
+        archive.create_dataset("dxd", data=dxd)
+        archive.create_dataset("zo", data=zo)
+        archive.create_dataset("entrancePupilDiameter", data=Nd / 2.5 * dxp)
+        archive.create_dataset("orientation", data=0)
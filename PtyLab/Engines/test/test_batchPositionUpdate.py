@@ -0,0 +1,207 @@
+import os
+import tempfile
+import unittest
+import warnings
+from unittest import TestCase
+import numpy as np
+import PtyLab
+from PtyLab import Engines
+from PtyLab.Engines.test.simulatedData import writeSimulatedData
+
+
+class TestBatchPositionUpdate(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "simulated.hdf5")
+        writeSimulatedData(self.filename)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def initialize(self, engine, filename=None):
+        experimentalData, reconstruction, params, monitor, engine = PtyLab.easyInitialize(
+            filename or self.filename, engine=engine, dummyMonitor=True
+        )
+        engine._prepareReconstruction()
+        rng = np.random.default_rng(1)
+        # two probe modes, so that the mode sums of the updates matter
+        shape = reconstruction.object.shape
+        reconstruction.object = (rng.random(shape) + 1j * rng.random(shape)).astype(np.complex64)
+        shape = (1, 1, 2, 1, reconstruction.Np, reconstruction.Np)
+        reconstruction.probe = (rng.random(shape) + 1j * rng.random(shape)).astype(np.complex64)
+        return engine
+
+    def sequentialUpdate(self, engine, positionIndex, objectPatchUpdate, probeUpdate):
+        """One step of the sequential position loop."""
+        reconstruction = engine.reconstruction
+        row, col = reconstruction.positions[positionIndex]
+        sy = slice(row, row + reconstruction.Np)
+        sx = slice(col, col + reconstruction.Np)
+        objectPatch = reconstruction.object[..., sy, sx].copy()
+        reconstruction.esw = objectPatch * reconstruction.probe
+        engine.intensityProjection(positionIndex)
+        DELTA = reconstruction.eswUpdate - reconstruction.esw
+        reconstruction.object[..., sy, sx] = objectPatchUpdate(objectPatch, DELTA)
+        reconstruction.probe = probeUpdate(objectPatch, DELTA, positionIndex)
+
+    def checkSingleBatch(self, engine, objectPatchUpdate=None, probeUpdate=None):
+        """
+        Batches of one position through batchPositionUpdate give the sequential update.
+        """
+        reconstruction = engine.reconstruction
+        object, probe = reconstruction.object.copy(), reconstruction.probe.copy()
+        for positionIndex in range(3):
+            engine.batchPositionUpdate(np.array([positionIndex]), objectPatchUpdate, probeUpdate)
+        batchObject, batchProbe = reconstruction.object, reconstruction.probe
+
+        reconstruction.object, reconstruction.probe = object.copy(), probe
+        if objectPatchUpdate is None:
+            objectPatchUpdate = engine.objectPatchUpdate
+        if probeUpdate is None:
+            probeUpdate = lambda objectPatch, DELTA, positionIndex: engine.probeUpdate(objectPatch, DELTA)
+        for positionIndex in range(3):
+            self.sequentialUpdate(engine, positionIndex, objectPatchUpdate, probeUpdate)
+
+        self.assertFalse(np.allclose(reconstruction.object, object))
+        np.testing.assert_allclose(batchObject, reconstruction.object, rtol=1e-5, atol=1e-5)
+        np.testing.assert_allclose(batchProbe, reconstruction.probe, rtol=1e-5, atol=1e-5)
+
+    def updates(self, engine):
+        """The object and probe updates of a single position, as the position loop of the engine uses them."""
+        if isinstance(engine, Engines.mPIE):
+
+            def probeUpdate(objectPatch, DELTA, positionIndex):
+                return engine.probeUpdate(objectPatch, DELTA, engine.probeUpdateWeight(positionIndex))
+
+            return engine.objectPatchUpdate, probeUpdate
+        return None, None
+
+    def checkBatch(self, engine, positionIndices):
+        """
+        A batch of several positions: where patches overlap, the object update is the mean of the single-position
+        updates weighted by the probe intensity (their sum for non-overlapping positions), and the probe update is
+        the mean of the single-position probe updates weighted by the object intensity of the patches. All
+        single-position updates start from the same object and probe.
+        """
+        reconstruction = engine.reconstruction
+        Np = reconstruction.Np
+        object, probe = reconstruction.object.copy(), reconstruction.probe.copy()
+        absP2 = np.sum(abs(probe) ** 2, axis=(1, 2), keepdims=True)
+        objectWeight = engine.alphaObject * absP2.max() + (1 - engine.alphaObject) * absP2
+        objectNumerator = np.zeros_like(object)
+        objectDenominator = np.zeros(object.shape[-2:])
+        coverage = np.zeros(object.shape[-2:])
+        probeNumerator, probeDenominator = 0, 0
+        updates = self.updates(engine)
+        for positionIndex in positionIndices:
+            reconstruction.object, reconstruction.probe = object.copy(), probe.copy()
+            engine.batchPositionUpdate(np.array([positionIndex]), *updates)
+            row, col = reconstruction.positions[positionIndex]
+            sy, sx = slice(row, row + Np), slice(col, col + Np)
+            objectNumerator[..., sy, sx] += objectWeight * (
+                reconstruction.object[..., sy, sx] - object[..., sy, sx]
+            )
+            objectDenominator[sy, sx] += objectWeight[0, 0, 0, 0]
+            coverage[sy, sx] += 1
+            absO2 = np.sum(abs(object[..., sy, sx]) ** 2, axis=1, keepdims=True)
+            weight = engine.alphaProbe * absO2.max() + (1 - engine.alphaProbe) * absO2
+            probeNumerator = probeNumerator + weight * (reconstruction.probe - probe)
+            probeDenominator = probeDenominator + weight
+
+        reconstruction.object, reconstruction.probe = object.copy(), probe.copy()
+        engine.batchPositionUpdate(np.asarray(positionIndices), *updates)
+        expectedObject = object + objectNumerator / np.where(coverage > 0, objectDenominator, 1)
+        np.testing.assert_allclose(reconstruction.object, expectedObject, rtol=1e-4, atol=1e-5)
+        np.testing.assert_allclose(
+            reconstruction.probe, probe + probeNumerator / probeDenominator, rtol=1e-4, atol=1e-5
+        )
+        return coverage
+
+    def test_ePIE(self):
+        self.checkSingleBatch(self.initialize(Engines.ePIE))
+
+    def test_mPIE(self):
+        engine = self.initialize(Engines.mPIE)
+        engine.params.weigh_probe_updates_by_intensity = True
+
+        def probeUpdate(objectPatch, DELTA, positionIndex):
+            return engine.probeUpdate(objectPatch, DELTA, engine.probeUpdateWeight(positionIndex))
+
+        self.checkSingleBatch(engine, engine.objectPatchUpdate, probeUpdate)
+        # the TV regularized object update
+        self.checkSingleBatch(engine, engine.objectPatchUpdate_TV, probeUpdate)
+
+    def test_nonOverlappingBatch(self):
+        """
+        For mutually non-overlapping positions the object update of a batch is the sum of the single-position
+        updates.
+        :return:
+        """
+        # a scan that is large enough for positions that do not overlap
+        filename = os.path.join(self.directory.name, "large.hdf5")
+        writeSimulatedData(filename, numSide=8)
+        for engine in [Engines.ePIE, Engines.mPIE]:
+            engine = self.initialize(engine, filename)
+            group = max(engine.getNonOverlappingGroups(), key=len)
+            self.assertGreater(len(group), 1)
+            coverage = self.checkBatch(engine, group)
+            self.assertEqual(coverage.max(), 1)
+
+    def test_overlappingBatch(self):
+        for engine in [Engines.ePIE, Engines.mPIE]:
+            engine = self.initialize(engine)
+            coverage = self.checkBatch(engine, np.arange(5))
+            self.assertGreater(coverage.max(), 1)
+
+    def test_convergence(self):
+        """
+        The reconstruction error goes down with batches of several positions.
+        :return:
+        """
+        experimentalData, reconstruction, params, monitor, engine = PtyLab.easyInitialize(
+            self.filename, engine=Engines.mPIE, dummyMonitor=True
+        )
+        params.batchSize = 4
+        engine.numIterations = 5
+        engine.reconstruct()
+        self.assertEqual(len(reconstruction.error), 5)
+        self.assertLess(reconstruction.error[-1], 0.8 * reconstruction.error[0])
+
+    def test_unsupportedEngine(self):
+        """
+        Engines without a batched update warn that params.batchSize is ignored.
+        :return:
+        """
+        experimentalData, reconstruction, params, monitor, engine = PtyLab.easyInitialize(
+            self.filename, engine=Engines.pcPIE, dummyMonitor=True
+        )
+        params.batchSize = 4
+        with self.assertWarnsRegex(UserWarning, "pcPIE has no batched update"):
+            engine._checkMISC()
+        engine = Engines.mPIE(reconstruction, experimentalData, params, monitor)
+        with warnings.catch_warnings():
+            warnings.filterwarnings("error", "mPIE has no batched update")
+            engine._checkMISC()
+
+    def test_intensityScaling(self):
+        """
+        The fluctuation constraint stores one scaling per frame, for single positions and for batches.
+        :return:
+        """
+        engine = self.initialize(Engines.mPIE)
+        engine.params.intensityConstraint = "fluctuation"
+        engine._checkMISC()
+        reconstruction = engine.reconstruction
+        updates = self.updates(engine)
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", DeprecationWarning)
+            for positionIndex in [0, 1]:
+                engine.batchPositionUpdate(np.array([positionIndex]), *updates)
+            engine.batchPositionUpdate(np.array([2, 3, 4]), *updates)
+        self.assertEqual(engine.params.intensityScaling.shape, (engine.experimentalData.numFrames,))
+        self.assertTrue(np.all(engine.params.intensityScaling[:5] != 1))
+        np.testing.assert_array_equal(engine.params.intensityScaling[5:], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
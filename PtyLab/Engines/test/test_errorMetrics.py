@@ -0,0 +1,90 @@
+import os
+import tempfile
+import unittest
+from unittest import TestCase
+import numpy as np
+import PtyLab
+from PtyLab import Engines
+from PtyLab.Engines.test.simulatedData import writeSimulatedData
+
+
+class TestErrorMetrics(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        filename = os.path.join(self.directory.name, "simulated.hdf5")
+        writeSimulatedData(filename)
+        (
+            self.experimentalData,
+            self.reconstruction,
+            self.params,
+            monitor,
+            self.engine,
+        ) = PtyLab.easyInitialize(filename, engine=Engines.mPIE, dummyMonitor=True)
+        self.params.residualReservoirSize = 3
+        self.engine._prepareReconstruction()
+        rng = np.random.default_rng(1)
+        self.numFrames = self.experimentalData.numFrames
+        Nd = self.reconstruction.Nd
+        self.Imeasured = rng.random((self.numFrames, Nd, Nd)).astype(np.float32)
+        self.Iestimated = rng.random((self.numFrames, Nd, Nd)).astype(np.float32)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def accumulate(self, batchSize=1):
+        """Run getRMSD over all frames (in batches) and getErrorMetrics, as the position loop does."""
+        for start in range(0, self.numFrames, batchSize):
+            positionIndices = np.arange(start, min(start + batchSize, self.numFrames))
+            if batchSize == 1:
+                positionIndices = positionIndices[0]
+            self.reconstruction.Imeasured = self.Imeasured[positionIndices]
+            self.reconstruction.Iestimated = self.Iestimated[positionIndices]
+            self.engine.getRMSD(positionIndices)
+        self.engine.getErrorMetrics()
+
+    def checkErrors(self, mask):
+        """
+        errorAtPos and the error metric match the ones of the (numFrames, Nd, Nd) detector error stack.
+        """
+        detectorError = np.abs(self.Imeasured - self.Iestimated)
+        errorAtPos = np.sum(detectorError * mask, axis=(-1, -2)) / (
+            self.experimentalData.energyAtPos + 1e-20
+        )
+        np.testing.assert_allclose(self.reconstruction.errorAtPos, errorAtPos, rtol=1e-5)
+        np.testing.assert_allclose(self.reconstruction.error[-1], np.sum(errorAtPos), rtol=1e-5)
+
+    def test_errorAtPos(self):
+        for batchSize in [1, 5]:
+            self.reconstruction.errorAtPos[:] = 0
+            self.accumulate(batchSize)
+            self.checkErrors(1)
+        # the residual maps of the reservoir positions
+        reservoir = self.reconstruction.residualReservoir
+        self.assertEqual(len(reservoir.maps), 3)
+        for positionIndex, residualMap in reservoir.maps.items():
+            np.testing.assert_allclose(
+                residualMap, np.abs(self.Imeasured - self.Iestimated)[positionIndex], rtol=1e-6
+            )
+
+    def test_FourierMask(self):
+        self.params.FourierMaskSwitch = True
+        self.experimentalData.W = (np.random.rand(*self.Imeasured.shape[-2:]) > 0.3).astype(np.float32)
+        self.accumulate()
+        self.checkErrors(self.experimentalData.W)
+
+    def test_CPSC(self):
+        """
+        With CPSC the mask is defined on the downsampled detector, every mask pixel covers f x f estimated pixels.
+        :return:
+        """
+        self.params.FourierMaskSwitch = True
+        self.params.CPSCswitch = True
+        f = 4
+        Nd = self.Imeasured.shape[-1]
+        self.experimentalData.W = (np.random.rand(Nd // f, Nd // f) > 0.3).astype(np.float32)
+        self.accumulate(batchSize=5)
+        self.checkErrors(np.kron(self.experimentalData.W, np.ones((f, f))))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+import os
+import tempfile
+import unittest
+from unittest import TestCase
+import numpy as np
+import PtyLab
+from PtyLab import Engines
+from PtyLab.Engines.test.simulatedData import writeSimulatedData
+
+
+def directGradient(O, Opatch, sy, sx, radius):
+    """
+    Position gradient of one position with a shift loop (3x3 neighbourhood) or the cropped cross-correlation
+    (larger radius), as it was computed before the batched version.
+    """
+    if radius < 2:
+        rowShifts = np.array([-1, -1, -1, 0, 0, 0, 1, 1, 1])
+        colShifts = np.array([-1, 0, 1, -1, 0, 1, -1, 0, 1])
+        cc = np.zeros(len(rowShifts))
+        for shift in range(len(rowShifts)):
+            shiftedImage = np.roll(Opatch, (rowShifts[shift], colShifts[shift]), axis=(-2, -1))
+            cc[shift] = abs(np.sum(shiftedImage.conj() * O[..., sy, sx]))
+        betaGrad, r = 1000, 3
+    else:
+        rowShifts, colShifts = [s.flatten() for s in np.mgrid[-radius : radius + 1, -radius : radius + 1]]
+        FT_O = np.fft.fft2(O[..., sy, sx] - O[..., sy, sx].mean())
+        FT_Op = np.fft.fft2(Opatch - O.mean())
+        xcor = abs(np.fft.fftshift(np.fft.ifft2(FT_O * FT_Op.conj())))
+        N = xcor.shape[-1]
+        crop = slice(N // 2 - radius, N // 2 + radius + 1)
+        cc = xcor[..., crop, crop].flatten()
+        betaGrad, r = 5, 10
+    normFactor = np.sum(abs(Opatch) ** 2)
+    grad_y = betaGrad * np.sum((cc - cc.mean()) / normFactor * rowShifts)
+    grad_x = betaGrad * np.sum((cc - cc.mean()) / normFactor * colShifts)
+    return np.clip([grad_y, grad_x], -r, r)
+
+
+class TestPositionCorrection(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        filename = os.path.join(self.directory.name, "simulated.hdf5")
+        writeSimulatedData(filename)
+        (
+            self.experimentalData,
+            self.reconstruction,
+            self.params,
+            monitor,
+            self.engine,
+        ) = PtyLab.easyInitialize(filename, engine=Engines.mPIE, dummyMonitor=True)
+        self.params.positionCorrectionSwitch = True
+        self.engine._initializePCParameters()
+        self.engine.daleth = 1
+        self.engine.beth = 0
+        # past the first iteration, where the position correction starts
+        self.reconstruction.error = [1.0, 1.0, 1.0]
+
+        rng = np.random.default_rng(1)
+        shape = self.reconstruction.object.shape
+        self.reconstruction.object = rng.random(shape) + 1j * rng.random(shape)
+        self.positionIndices = np.arange(4)
+        Np = self.reconstruction.Np
+        self.patches = np.stack(
+            [
+                self.reconstruction.object[..., row : row + Np, col : col + Np]
+                for row, col in self.reconstruction.positions[self.positionIndices]
+            ]
+        )
+        # the update of the object at these positions
+        self.reconstruction.object = self.reconstruction.object + 0.05 * rng.random(shape)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def checkGradients(self, radius):
+        self.params.positionCorrectionSwitch_radius = radius
+        Np = self.reconstruction.Np
+        expected = [
+            directGradient(
+                self.reconstruction.object,
+                patch,
+                slice(row, row + Np),
+                slice(col, col + Np),
+                radius,
+            )
+            for patch, (row, col) in zip(
+                self.patches, self.reconstruction.positions[self.positionIndices]
+            )
+        ]
+        np.testing.assert_allclose(
+            self.engine.positionCorrectionBatch(self.patches, self.positionIndices),
+            expected,
+            atol=1e-9,
+        )
+        # one position at a time
+        np.testing.assert_allclose(
+            self.engine.positionCorrection(self.patches[0], 0, None, None), expected[0], atol=1e-9
+        )
+
+    def test_neighbourhood(self):
+        """
+        The batched 3x3 neighbourhood gradient equals the shift loop.
+        :return:
+        """
+        self.checkGradients(1)
+
+    def test_crossCorrelation(self):
+        """
+        The batched gradient over a larger radius equals the cropped cross-correlation.
+        :return:
+        """
+        self.checkGradients(4)
+
+    def test_largeRadius(self):
+        """
+        Radii beyond the patch are reduced to the largest shift that does not alias.
+        :return:
+        """
+        self.params.positionCorrectionSwitch_radius = self.reconstruction.Np
+        radius = (self.reconstruction.Np - 1) // 2
+        gradients = self.engine.positionCorrectionBatch(self.patches, self.positionIndices)
+        self.params.positionCorrectionSwitch_radius = radius
+        np.testing.assert_allclose(
+            gradients, self.engine.positionCorrectionBatch(self.patches, self.positionIndices)
+        )
+        self.checkGradients(radius)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -44,6 +44,18 @@ class TestBaseEngine(TestCase):
         assert type(self.ePIE_engine.reconstruction.object) is cp.ndarray
 
 
+    def test_getPositionBatches(self):
+        """
+        The mini-batches should cover every position exactly once, in the current position order.
+        """
+        self.ePIE_engine.params.batchSize = 7
+        self.ePIE_engine.setPositionOrder()
+        batches = self.ePIE_engine.getPositionBatches()
+        assert all(len(batch) <= 7 for batch in batches)
+        np.testing.assert_array_equal(
+            np.concatenate(batches), self.ePIE_engine.positionIndices
+        )
+
     def test_position_correction(self):
         import time
         rowShifts = np.array([-2, -2, -2, -2, -2, -1, -1, -1, -1, -1, 0, 0, 0, 0, 0, 1, 1, 1, 1, 1, 2, 2, 2, 2, 2])
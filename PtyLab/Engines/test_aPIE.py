@@ -0,0 +1,113 @@
+from unittest import TestCase
+import os
+import tempfile
+import unittest
+import numpy as np
+
+import PtyLab
+from PtyLab import Engines
+from PtyLab.Engines.aPIE import detectorResamplingMap, T_inv
+from PtyLab.Engines.test.simulatedData import writeSimulatedData
+
+
+class TestDetectorResamplingMap(TestCase):
+    def test_matches_interpolation(self):
+        """
+        The cached map gives the linear interpolation of every row at the transformed coordinates, and zero
+        outside of the detector.
+        :return:
+        """
+        Nd, dxd, zo, theta = 64, 10e-6, 5e-3, 30.0
+        xd = np.linspace(-Nd / 2, Nd / 2, Nd) * dxd
+        frames = np.random.rand(3, Nd, Nd)
+        i0, i1, w0, w1 = detectorResamplingMap(theta, zo, Nd, dxd)
+        resampled = frames[..., i0] * w0 + frames[..., i1] * w1
+
+        xq = np.sort(T_inv(xd, xd[0], zo, theta))
+        for frame, frame_resampled in zip(frames, resampled):
+            for row, row_resampled in zip(frame, frame_resampled):
+                np.testing.assert_allclose(
+                    row_resampled, np.interp(xq, xd, row, left=0, right=0), atol=1e-12
+                )
+        self.assertIs(detectorResamplingMap(theta, zo, Nd, dxd)[0], i0)
+
+
+class TestCandidates(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        filename = os.path.join(self.directory.name, "simulated.hdf5")
+        writeSimulatedData(filename)
+        experimentalData, reconstruction, params, monitor, _ = PtyLab.easyInitialize(
+            filename, engine=Engines.mPIE, dummyMonitor=True
+        )
+        reconstruction.theta = 30.0
+        self.engine = Engines.aPIE(reconstruction, experimentalData, params, monitor)
+        self.engine._prepareReconstruction()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_candidateState(self):
+        """
+        The sweeps of the candidates do not change the engine, and only the state of the winner is kept.
+        :return:
+        """
+        engine = self.engine
+        reconstruction = engine.reconstruction
+        engine.params.intensityScaling = np.ones(engine.experimentalData.numFrames)
+        object, error = reconstruction.object.copy(), list(reconstruction.error)
+        ptychogram = engine.experimentalData.ptychogram
+        untransformed = np.asarray(engine.ptychogramUntransformed)
+
+        candidates = [engine._makeCandidate() for _ in range(2)]
+        for candidate, theta in zip(candidates, [30.0, 30.5]):
+            candidate.setPositionOrder()
+            candidate._candidateSweep(theta, untransformed, 0)
+            candidate.params.intensityScaling[:] = theta
+        np.testing.assert_array_equal(reconstruction.object, object)
+        self.assertEqual(reconstruction.error, error)
+        np.testing.assert_array_equal(engine.params.intensityScaling, 1)
+        self.assertIs(engine.experimentalData.ptychogram, ptychogram)
+        self.assertIsNot(candidates[0].reconstruction.esw, candidates[1].reconstruction.esw)
+
+        engine._applyCandidate(candidates[1])
+        self.assertIs(reconstruction.object, candidates[1].reconstruction.object)
+        self.assertEqual(reconstruction.error, candidates[1].reconstruction.error)
+        np.testing.assert_array_equal(engine.params.intensityScaling, 30.5)
+        self.assertIs(engine.experimentalData.ptychogram, candidates[1].experimentalData.ptychogram)
+
+    def test_constraintState(self):
+        """
+        The changes of applyConstraints in the winning candidate (z, corrected positions, position correction
+        momentum) are kept, the ones of the other candidates are not.
+        :return:
+        """
+        engine = self.engine
+        reconstruction = engine.reconstruction
+        engine.D = np.zeros((engine.experimentalData.numFrames, 2))
+        zo, encoder = reconstruction.zo, reconstruction.encoder_corrected.copy()
+        positions = reconstruction.positions.copy()
+
+        candidates = [engine._makeCandidate() for _ in range(2)]
+        for factor, candidate in zip([1.1, 1.2], candidates):
+            candidate.reconstruction.zo = factor * zo
+            candidate.reconstruction.encoder_corrected = factor * encoder
+            candidate.reconstruction.zMomentum = factor
+            candidate.D += factor
+        self.assertEqual(reconstruction.zo, zo)
+        np.testing.assert_array_equal(reconstruction.encoder_corrected, encoder)
+        np.testing.assert_array_equal(reconstruction.positions, positions)
+        np.testing.assert_array_equal(engine.D, 0)
+
+        engine._applyCandidate(candidates[1])
+        self.assertEqual(reconstruction.zo, 1.2 * zo)
+        self.assertEqual(reconstruction.zMomentum, 1.2)
+        np.testing.assert_array_equal(reconstruction.encoder_corrected, 1.2 * encoder)
+        np.testing.assert_array_equal(
+            reconstruction.positions, candidates[1].reconstruction.positions
+        )
+        np.testing.assert_array_equal(engine.D, 1.2)
+
+
+if __name__ == "__main__":
+    unittest.main()
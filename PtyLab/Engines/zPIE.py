@@ -20,6 +20,7 @@ from PtyLab.Params.Params import Params
 from PtyLab.utils.gpuUtils import getArrayModule, asNumpyArray
 from PtyLab.Monitor.Monitor import Monitor
 from PtyLab.Operators.Operators import aspw
+from PtyLab.Regularizers import FocusStack
 import logging
 import sys
 
@@ -69,6 +70,7 @@ class zPIE(BaseEngine):
                         dz,
                         reconstruction.wavelength,
                         reconstruction.Lo,
+                        precision=self.params.precision,
                     )[0]
                     for dz in z
                 ]
@@ -111,7 +113,6 @@ class zPIE(BaseEngine):
         for loop in self.pbar:
             # set position order
             self.setPositionOrder()
-            imProps = []
 
             # get positions
             if loop == 1:
@@ -122,60 +123,43 @@ class zPIE(BaseEngine):
                 dz = np.linspace(-1, 1, 11) * d * self.DoF
                 self.dz = dz
 
-                merit = []
-                # todo, mixed states implementation, check if more need to be put on GPU to speed up
-                for k in np.arange(len(dz)):
-                    imProp = None
-                    if self.focusObject:
-                        roi = slice(
-                            self.reconstruction.No // 2 - n // 2,
-                            self.reconstruction.No // 2 + n // 2,
-                        )
-                        imProp, _ = aspw(
-                            u=xp.squeeze(self.reconstruction.object[..., roi, roi]),
-                            z=dz[k],
-                            wavelength=self.reconstruction.wavelength,
-                            L=self.reconstruction.dxo * n,
-                            bandlimit=False,
-                        )
+                # the field is Fourier transformed once and all planes are evaluated with one kernel stack
+                if self.focusObject:
+                    roi = slice(
+                        self.reconstruction.No // 2 - n // 2,
+                        self.reconstruction.No // 2 + n // 2,
+                    )
+                    focusStack = FocusStack(
+                        xp.squeeze(self.reconstruction.object[..., roi, roi]),
+                        self.reconstruction.dxo,
+                        self.reconstruction.wavelength,
+                        bandlimit=False,
+                        precision=self.params.precision,
+                    )
+                else:
+                    if self.reconstruction.nlambda == 1:
+                        wavelength = self.reconstruction.wavelength
                     else:
-                        if self.reconstruction.nlambda == 1:
-                            imProp, _ = aspw(
-                                u=xp.squeeze(self.reconstruction.probe[..., :, :]),
-                                z=dz[k],
-                                wavelength=self.reconstruction.wavelength,
-                                L=self.reconstruction.Lp,
-                            )
-                        else:
-                            nlambda = self.reconstruction.nlambda // 2
-                            imProp, _ = aspw(
-                                xp.squeeze(
-                                    self.reconstruction.probe[nlambda, ..., :, :]
-                                ),
-                                dz[k],
-                                self.reconstruction.spectralDensity[nlambda],
-                                self.reconstruction.Lp,
-                            )
-                    imProps.append(imProp.get())
-                    # TV approach
-                    aleph = 1e-2
-                    gradx = xp.roll(imProp, -1, axis=-1) - xp.roll(imProp, 1, axis=-1)
-                    grady = xp.roll(imProp, -1, axis=-2) - xp.roll(imProp, 1, axis=-2)
-                    merit.append(
-                        xp.sum(xp.sqrt(abs(gradx) ** 2 + abs(grady) ** 2 + aleph))
+                        wavelength = self.reconstruction.spectralDensity[
+                            self.reconstruction.nlambda // 2
+                        ]
+                    focusStack = FocusStack(
+                        xp.squeeze(
+                            self.reconstruction.probe[self.reconstruction.nlambda // 2]
+                        ),
+                        self.reconstruction.dxp,
+                        wavelength,
+                        bandlimit=True,
+                        precision=self.params.precision,
                     )
-                    # take a tiny break, we may overask the GPU
-                    # yield 0, 0
-
-                merit = xp.array(merit)
+                # TV approach
+                merit = focusStack.merit(
+                    dz, metric="TV", aleph=1e-2, average_by_power=False
+                )
                 if not hasattr(self.reconstruction, "TV_history"):
                     self.reconstruction.TV_history = []
 
-                self.reconstruction.TV_history.append(
-                    float(merit[len(merit) // 2].get())
-                )
-                if xp is not np:
-                    merit = merit.get()
+                self.reconstruction.TV_history.append(float(merit[len(merit) // 2]))
                 feedback = np.sum(dz * merit) / np.sum(
                     merit
                 )  # at optimal z, feedback term becomes 0
@@ -207,6 +191,7 @@ class zPIE(BaseEngine):
                     * self.reconstruction.zo
                     / self.reconstruction.Ld
                 )
+                self.reconstruction.coordinateGrids.invalidate()
                 # reset propagatorType
                 # self.reconstruction.quadraticPhase = xp.array(np.exp(1.j * np.pi / (self.reconstruction.wavelength * self.reconstruction.zo)
                 #                                                      * (self.reconstruction.Xp ** 2 + self.reconstruction.Yp ** 2)))
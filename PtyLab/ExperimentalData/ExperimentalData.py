@@ -12,10 +12,12 @@ import logging
 
 # import tables
 from PtyLab.io import readHdf5
+from PtyLab.io.lazyPtychogram import LazyPtychogram
 
 # from PtyLab.io import readExample
 from PtyLab.utils.visualisation import show3Dslider
 from PtyLab.utils.visualisation import setColorMap
+from PtyLab.utils.coordinateGrids import CoordinateGrids
 from PtyLab.utils.gpuUtils import (
     getArrayModule,
     transfer_fields_to_gpu,
@@ -36,6 +38,8 @@ class ExperimentalData:
         self.operationMode = (
             operationMode  # operationMode: 'CPM' or 'FPM', default is CPM is not given
         )
+        # memoised Xd and Yd grids
+        self.coordinateGrids = CoordinateGrids()
         self._setFields()
         if filename is not None:
             self.loadData(filename)
@@ -69,6 +73,8 @@ class ExperimentalData:
                 "spectralDensity",  # CPM parameters: different wavelengths required for polychromatic ptychography
                 "theta",  # CPM parameters: reflection tilt angle, required for
                 "emptyBeam",  # image of the probe
+                "energyAtPos",  # stored frame statistics, see io.chunkedPtychogram
+                "maxProbePower",
             ]
 
         elif self.operationMode == "FPM":
@@ -84,11 +90,20 @@ class ExperimentalData:
                 # entrance pupil diameter, defined in lens-based microscopes as the aperture diameter, reqquired for FPM
                 # 'entrancePupilDiameter'
                 "NA",  # numerical aperture of the microscope
+                "energyAtPos",  # stored frame statistics, see io.chunkedPtychogram
+                "maxProbePower",
             ]
         else:
             raise ValueError('operationMode is not properly set, choose "CPM" or "FPM"')
 
-    def loadData(self, filename=None):
+    def loadData(
+        self,
+        filename=None,
+        lazy=False,
+        frameIndices=None,
+        frameCacheBytes=2**30,
+        ptychogramStorage=None,
+    ):
         """
         Load data specified in filename.
         :type filename: str or Path
@@ -99,6 +114,16 @@ class ExperimentalData:
         :param python_order: bool
                 Weather to change the input order of the files to match python convention.
                  Only in very special cases should this be false.
+        :param lazy: bool
+                Keep the ptychogram in the file and read the frames when they are used (see io.lazyPtychogram),
+                for datasets that do not fit in memory.
+        :param frameIndices: array of int
+                Only load these frames (and encoder positions).
+        :param frameCacheBytes: int
+                Memory budget of the frame cache of a lazy ptychogram in bytes.
+        :param ptychogramStorage: str
+                Store the ptychogram as 'uint16', 'uint32', 'float32' or 'auto', see setPtychogramStorage. None keeps
+                the dtype of the file, the engine narrows it to its precision (see BaseEngine._setPrecision).
         :return:
         """
         import os
@@ -118,7 +143,12 @@ class ExperimentalData:
         # 2. load dictionary. Only the values specified by 'requiredFields'
         # in readHdf.py file were loaded
         measurementDict = readHdf5.loadInputData(
-            self.filename, self.requiredFields, self.optionalFields
+            self.filename,
+            self.requiredFields,
+            self.optionalFields,
+            lazy=lazy,
+            frameIndices=frameIndices,
+            frameCacheBytes=frameCacheBytes,
         )
         # 3. 'requiredFields' will be the attributes that must be set
         attributesToSet = measurementDict.keys()
@@ -131,17 +161,84 @@ class ExperimentalData:
                 setattr(self, attribute, measurementDict[a])
             self.logger.debug("Setting %s", a)
 
-        self._setData()
+        # frame statistics stored in the file (see io.chunkedPtychogram) are only valid for the frames as loaded
+        self._setData(
+            useStoredStatistics=measurementDict.get("energyAtPos") is not None
+            and measurementDict.get("maxProbePower") is not None
+        )
         # last step, just to be sure that it's the last thing we do: set orientation
         # this has to be last as it can actually change the data in self.ptychogram
         # depending on the orientation
         self.setOrientation(readHdf5.getOrientation(self.filename))
+        if ptychogramStorage is not None:
+            self.setPtychogramStorage(ptychogramStorage)
+
+    def setPtychogramStorage(self, storage="auto"):
+        """
+        Store the ptychogram in a compact dtype. Photon counts fit in 'uint16' or 'uint32' (a half or a quarter of
+        float64), other data in 'float32'. 'auto' chooses the smallest of these that holds the data without loss.
+        Integer frames are converted to float32 when the engines read them.
+        :raise ValueError: if the data does not fit in the requested integer dtype
+        """
+        allowed = ["auto", "uint16", "uint32", "float32"]
+        if storage not in allowed:
+            raise ValueError(f"Unknown ptychogram storage {storage}, choose one of {allowed}")
+        if storage == "float32":
+            dtype = np.dtype(np.float32)
+        else:
+            counts = self._countsDtype()
+            if storage == "auto":
+                dtype = np.dtype(np.float32) if counts is None else counts
+                if self.ptychogram.dtype.itemsize <= dtype.itemsize:
+                    # already as compact
+                    return
+            elif counts is None or counts.itemsize > np.dtype(storage).itemsize:
+                raise ValueError(
+                    f"The ptychogram does not hold photon counts that fit in {storage}"
+                )
+            else:
+                dtype = np.dtype(storage)
+        if dtype == self.ptychogram.dtype:
+            return
+        self.logger.info("Storing the ptychogram as %s", dtype)
+        if isinstance(self.ptychogram, LazyPtychogram):
+            self.ptychogram = self.ptychogram.transformed(
+                lambda stack: stack.astype(dtype)
+            )
+        else:
+            self.ptychogram = self.ptychogram.astype(dtype)
+
+    def _countsDtype(self):
+        """uint16 or uint32 if the ptychogram holds non-negative integers that fit, otherwise None."""
+        if self.ptychogram.dtype.kind == "c":
+            return None
+        frameStatistics = [
+            lambda stack: np.array([np.all(frame == np.round(frame)) for frame in stack]),
+            lambda stack: np.min(stack, (-1, -2)),
+            lambda stack: np.max(stack, (-1, -2)),
+        ]
+        if isinstance(self.ptychogram, LazyPtychogram):
+            integer, minimum, maximum = self.ptychogram.frameReduce(*frameStatistics)
+        else:
+            # the integer check goes frame by frame, to avoid a rounded copy of the whole stack
+            integer, minimum, maximum = [
+                function(self.ptychogram) for function in frameStatistics
+            ]
+        if not np.all(integer) or np.min(minimum) < 0:
+            return None
+        for dtype in [np.uint16, np.uint32]:
+            if np.max(maximum) <= np.iinfo(dtype).max:
+                return np.dtype(dtype)
+        return None
 
     def reduce_positions(self, start, end):
         """
         Reduce the number of positions for the reconstruction
         """
-        self.ptychogram = self.ptychogram[start: end]
+        if isinstance(self.ptychogram, LazyPtychogram):
+            self.ptychogram = self.ptychogram.subset(slice(start, end))
+        else:
+            self.ptychogram = self.ptychogram[start: end]
         self.encoder = self.encoder[start: end]
 
     def cropCenter(self, size):
@@ -156,7 +253,11 @@ class ExperimentalData:
 
         startx += 1
 
-        self.ptychogram = self.ptychogram[..., startx: startx + size, startx: startx + size]
+        crop = (Ellipsis, slice(startx, startx + size), slice(startx, startx + size))
+        if isinstance(self.ptychogram, LazyPtychogram):
+            self.ptychogram = self.ptychogram.transformed(lambda stack: stack[crop])
+        else:
+            self.ptychogram = self.ptychogram[crop]
         # self._setData()
 
     def setOrientation(self, orientation, force_contiguous=True):
@@ -201,23 +302,48 @@ class ExperimentalData:
             # this almost always makes sense. It makes it easier to read chunks
             self.ptychogram = np.ascontiguousarray(self.ptychogram)
 
-    def _setData(self):
-
+    def _setData(self, useStoredStatistics=False):
+        """
+        Set the detector coordinates and the frame statistics energyAtPos and maxProbePower.
+        :param useStoredStatistics: keep the frame statistics that were just read from the file instead of computing
+                                    them. Only valid as long as the frames have not been changed since
+        """
         # Set the detector coordinates
         self.Nd = self.ptychogram.shape[-1]
         # Detector coordinates 1D
         self.xd = np.linspace(-self.Nd / 2, self.Nd / 2, int(self.Nd)) * self.dxd
-        # Detector coordinates 2D
-        self.Xd, self.Yd = np.meshgrid(self.xd, self.xd)
+        # Detector coordinates 2D are built lazily, see Xd and Yd
         # Detector size in SI units
         self.Ld = self.Nd * self.dxd
 
         # number of Frames
         self.numFrames = self.ptychogram.shape[0]
-        # probe energy at each position
-        self.energyAtPos = np.sum(abs(self.ptychogram), (-1, -2))
+        if useStoredStatistics and len(self.energyAtPos) == self.numFrames:
+            return
+        if isinstance(self.ptychogram, LazyPtychogram):
+            # one pass over the file
+            self.energyAtPos, frameSums = self.ptychogram.frameReduce(
+                lambda stack: np.sum(abs(stack), (-1, -2)),
+                lambda stack: np.sum(stack, (-1, -2)),
+            )
+        else:
+            frameSums = np.sum(self.ptychogram, (-1, -2))
+            # probe energy at each position
+            self.energyAtPos = np.sum(abs(self.ptychogram), (-1, -2))
         # maximum probe power
-        self.maxProbePower = np.sqrt(np.max(np.sum(self.ptychogram, (-1, -2))))
+        self.maxProbePower = np.sqrt(np.max(frameSums))
+
+    @property
+    def Xd(self):
+        """Detector coordinates 2D (cached, read-only, single precision)"""
+        Xd, Yd = self.coordinateGrids.get(self.Nd, self.dxd)
+        return Xd
+
+    @property
+    def Yd(self):
+        """Detector coordinates 2D (cached, read-only, single precision)"""
+        Xd, Yd = self.coordinateGrids.get(self.Nd, self.dxd)
+        return Yd
 
     def showPtychogram(self):
         """
@@ -233,11 +359,22 @@ class ExperimentalData:
 
     def _move_data_to_cpu(self):
         """Move all required data to the CPU"""
-        transfer_fields_to_cpu(self, self.fields_to_transfer, self.logger)
+        transfer_fields_to_cpu(self, self._fields_to_move(gpu=False), self.logger)
 
     def _move_data_to_gpu(self):
         """Move all required fata to the GPU"""
-        transfer_fields_to_gpu(self, self.fields_to_transfer, self.logger)
+        transfer_fields_to_gpu(self, self._fields_to_move(gpu=True), self.logger)
+
+    def _fields_to_move(self, gpu):
+        """fields_to_transfer, without a lazy ptychogram: that one returns the frames on the GPU when they are read"""
+        lazy = [
+            field
+            for field in self.fields_to_transfer
+            if isinstance(getattr(self, field, None), LazyPtychogram)
+        ]
+        for field in lazy:
+            getattr(self, field).gpu = gpu
+        return [field for field in self.fields_to_transfer if field not in lazy]
 
 
     def relative_intensity(self, index):
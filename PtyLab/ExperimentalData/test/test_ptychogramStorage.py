@@ -0,0 +1,47 @@
+import unittest
+from unittest import TestCase
+import numpy as np
+from PtyLab.ExperimentalData.ExperimentalData import ExperimentalData
+from PtyLab.io.lazyPtychogram import LazyPtychogram
+
+
+class TestPtychogramStorage(TestCase):
+    def setUp(self):
+        self.experimentalData = ExperimentalData(operationMode="CPM")
+        self.counts = np.random.poisson(50, (5, 8, 8)).astype(np.float64)
+
+    def test_auto(self):
+        """
+        Photon counts are stored in the smallest unsigned integer that holds them, other data as float32.
+        :return:
+        """
+        self.experimentalData.ptychogram = self.counts.copy()
+        self.experimentalData.setPtychogramStorage("auto")
+        self.assertEqual(self.experimentalData.ptychogram.dtype, np.uint16)
+        np.testing.assert_array_equal(self.experimentalData.ptychogram, self.counts)
+
+        self.experimentalData.ptychogram = self.counts * 1e5
+        self.experimentalData.setPtychogramStorage("auto")
+        self.assertEqual(self.experimentalData.ptychogram.dtype, np.uint32)
+
+        self.experimentalData.ptychogram = self.counts + 0.5
+        self.experimentalData.setPtychogramStorage("auto")
+        self.assertEqual(self.experimentalData.ptychogram.dtype, np.float32)
+
+    def test_explicit(self):
+        """
+        Data that does not fit in the requested integer dtype is refused, a lazy ptychogram is cast when read.
+        :return:
+        """
+        self.experimentalData.ptychogram = self.counts - 100
+        with self.assertRaises(ValueError):
+            self.experimentalData.setPtychogramStorage("uint16")
+
+        self.experimentalData.ptychogram = LazyPtychogram(self.counts)
+        self.experimentalData.setPtychogramStorage("uint16")
+        self.assertEqual(self.experimentalData.ptychogram.dtype, np.uint16)
+        np.testing.assert_array_equal(self.experimentalData.ptychogram[2], self.counts[2])
+
+
+if __name__ == "__main__":
+    unittest.main()
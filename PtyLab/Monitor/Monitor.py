@@ -262,6 +262,18 @@ class DummyMonitor(object):
     def writeEngineName(self, *args, **kwargs):
         pass
 
+    def update_encoder(self, *args, **kwargs):
+        pass
+
+    def updateBeamWidth(self, *args, **kwargs):
+        pass
+
+    def update_overlap(self, *args, **kwargs):
+        pass
+
+    def update_focusing_metric(self, *args, **kwargs):
+        pass
+
 
 class NapariMonitor(DummyMonitor):
     def initializeVisualisation(self):
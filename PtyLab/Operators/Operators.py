@@ -3,7 +3,6 @@ try: # pre 3.10
     from collections import Callable
 except ImportError:
     from collections.abc import Callable
-from functools import lru_cache
 
 try:
     import cupy as cp
@@ -11,14 +10,48 @@ except ImportError:
     print("cupy not avialable")
 import numpy as np
 
+from PtyLab.Operators import _kernel_cache
+from PtyLab.Operators._kernel_cache import kernel_cache
 from PtyLab.Operators._propagation_kernels import __make_quad_phase
 from PtyLab.utils.utils import circ, fft2c, ifft2c
-from PtyLab.utils.gpuUtils import getArrayModule, isGpuArray
+from PtyLab.utils.gpuUtils import asNumpyArray, getArrayModule, isGpuArray
+from PtyLab.utils.instrumentation import instrumentation
+from PtyLab.utils.precision import getPrecision
 from PtyLab import Params, Reconstruction
 
-# how many kernels are kept in memory for every type of propagator? Higher can be faster but comes
-# at the expense of (GPU) memory.
-cache_size = 5
+# The kernels of every type of propagator are kept in a byte-budgeted LRU cache, see _kernel_cache. A larger
+# budget (params.kernelCacheBudgets) can be faster but comes at the expense of (GPU) memory.
+# The kernels are computed in double precision and stored in the complex dtype of params.precision (utils.precision),
+# the precision is part of the cache key so engines with different precisions do not share kernels.
+
+
+def _multiply_inplace(field, kernel):
+    """field * kernel, done in-place when the kernel broadcasts onto field. Only use for temporary fields."""
+    if np.broadcast_shapes(field.shape, kernel.shape) == field.shape:
+        field *= kernel
+        return field
+    return field * kernel
+
+
+def _convolve(fields, kernel, overwrite=False):
+    """
+    ifft2(fft2(fields) * kernel) with the plain (uncentred) FFTs. The kernel has to be stored in the FFT layout
+    (ifftshifted), the result then equals ifft2c(fft2c(fields) * fftshift(kernel)).
+    """
+    result = fft2c(fields, fftshiftSwitch=True, overwrite=overwrite)
+    result = _multiply_inplace(result, kernel)
+    return ifft2c(result, fftshiftSwitch=True, overwrite=True)
+
+
+def __forward_and_inverse_kernel(transfer_function):
+    """
+    Store a centred transfer function in the layout used by _convolve: ifftshifted, and conjugated for
+    the inverse propagation.
+    :return: (forward, inverse)
+    """
+    xp = getArrayModule(transfer_function)
+    forward = xp.fft.ifftshift(transfer_function, axes=(-2, -1))
+    return forward, forward.conj()
 
 
 def propagate_fraunhofer(
@@ -102,9 +135,10 @@ def propagate_fresnel(fields, params: Params, reconstruction: Reconstruction, z=
         fields.shape[-1],
         reconstruction.dxp,
         on_gpu=on_gpu,
+        precision=params.precision,
     )
 
-    eswUpdate = fft2c(fields * quadratic_phase, params.fftshiftSwitch)
+    eswUpdate = fft2c(fields * quadratic_phase, params.fftshiftSwitch, overwrite=True)
     # for legacy reasons, as far as I can see there's no reason to do this
     # esw = reconstruction.esw * quadratic_phase
     return reconstruction.esw, eswUpdate
@@ -142,6 +176,7 @@ def propagate_fresnel_inv(
         reconstruction.Np,
         reconstruction.dxp,
         on_gpu=isGpuArray(fields),
+        precision=params.precision,
     ).conj()
 
     eswUpdate = ifft2c(fields, params.fftshiftSwitch) * quadratic_phase
@@ -185,6 +220,7 @@ def propagate_ASP(
     if z is None:
         z = reconstruction.zo
     xp = getArrayModule(fields)
+    # the cached kernels are already ifftshifted (and conjugated for the inverse)
     transfer_function = __make_transferfunction_ASP(
         params.fftshiftSwitch,
         reconstruction.nosm,
@@ -195,12 +231,13 @@ def propagate_ASP(
         reconstruction.Lp,
         reconstruction.nlambda,
         isGpuArray(fields),
-    )
+        params.precision,
+    )[int(inverse)]
     if fftflag:
-        transfer_function = xp.fft.ifftshift(transfer_function, axes=(-2,-1))
-    if inverse:
-        transfer_function = transfer_function.conj()
-    result = ifft2c(fft2c(fields, fftshiftSwitch=fftflag) * transfer_function, fftshiftSwitch=fftflag)
+        result = _convolve(fields, transfer_function)
+    else:
+        result = fft2c(fields) * xp.fft.fftshift(transfer_function, axes=(-2, -1))
+        result = ifft2c(result, overwrite=True)
     return reconstruction.esw, result
 
 
@@ -246,6 +283,7 @@ def propagate_twoStepPolychrome(
     """
     if z is None:
         z = reconstruction.zo
+    # (forward, inverse) tuples, the transfer functions are stored ifftshifted
     transfer_function, quadratic_phase = __make_cache_twoStepPolychrome(
         params.fftshiftSwitch,
         reconstruction.nlambda,
@@ -259,15 +297,18 @@ def propagate_twoStepPolychrome(
         reconstruction.Lp,
         reconstruction.dxp,
         params.gpuSwitch,
+        params.precision,
     )
     if inverse:
-        result = ifft2c(
-            fft2c(fields * quadratic_phase.conj()) * transfer_function.conj()
+        result = _convolve(
+            fields * quadratic_phase[1], transfer_function[1], overwrite=True
         )
         return reconstruction.esw, result
     else:
-        result = ifft2c(fft2c(fields) * transfer_function) * quadratic_phase
-        result = fft2c(result, params.fftshiftSwitch)
+        result = _multiply_inplace(
+            _convolve(fields, transfer_function[0]), quadratic_phase[0]
+        )
+        result = fft2c(result, params.fftshiftSwitch, overwrite=True)
         return reconstruction.esw, result
 
 
@@ -317,7 +358,7 @@ def propagate_scaledASP(
     """
     if z is None:
         z = reconstruction.zo
-    Q1, Q2 = __make_transferfunction_scaledASP(
+    Q1, Q2, Q1_inv, Q2_inv = __make_transferfunction_scaledASP(
         params.propagatorType,
         params.fftshiftSwitch,
         reconstruction.nlambda,
@@ -329,11 +370,16 @@ def propagate_scaledASP(
         reconstruction.dxo,
         reconstruction.dxd,
         params.gpuSwitch,
+        params.precision,
     )
     if inverse:
-        Q1, Q2 = Q1.conj(), Q2.conj()
-        return reconstruction.esw, ifft2c(fft2c(fields) * Q2) * Q1
-    return reconstruction.esw, ifft2c(fft2c(fields * Q1) * Q2)
+        Q1, Q2 = Q1_inv, Q2_inv
+        result = _multiply_inplace(fft2c(fields), Q2)
+        return reconstruction.esw, _multiply_inplace(
+            ifft2c(result, overwrite=True), Q1
+        )
+    result = _multiply_inplace(fft2c(fields * Q1, overwrite=True), Q2)
+    return reconstruction.esw, ifft2c(result, overwrite=True)
 
 
 def propagate_scaledASP_inv(
@@ -390,7 +436,7 @@ def propagate_scaledPolychromeASP(
     """
     if z is None:
         z = reconstruction.zo
-    Q1, Q2 = __make_transferfunction_scaledPolychromeASP(
+    Q1, Q2, Q1_inv, Q2_inv = __make_transferfunction_scaledPolychromeASP(
         params.fftshiftSwitch,
         reconstruction.nlambda,
         reconstruction.nosm,
@@ -401,11 +447,16 @@ def propagate_scaledPolychromeASP(
         reconstruction.dxo,
         reconstruction.dxp,
         params.gpuSwitch,
+        params.precision,
     )
     if inverse:
-        Q1, Q2 = Q1.conj(), Q2.conj()
-        return reconstruction.esw, ifft2c(fft2c(fields) * Q1) * Q2
-    return reconstruction.esw, ifft2c(fft2c(fields * Q1) * Q2)
+        Q1, Q2 = Q1_inv, Q2_inv
+        result = _multiply_inplace(fft2c(fields), Q1)
+        return reconstruction.esw, _multiply_inplace(
+            ifft2c(result, overwrite=True), Q2
+        )
+    result = _multiply_inplace(fft2c(fields * Q1, overwrite=True), Q2)
+    return reconstruction.esw, ifft2c(result, overwrite=True)
 
 
 def propagate_scaledPolychromeASP_inv(
@@ -469,6 +520,7 @@ def propagate_polychromeASP(
      """
     if z is None:
         z = reconstruction.zo
+    # the cached kernels are already ifftshifted (and conjugated for the inverse)
     transfer_function = __make_transferfunction_polychrome_ASP(
         params.propagatorType,
         params.fftshiftSwitch,
@@ -481,11 +533,9 @@ def propagate_polychromeASP(
         reconstruction.nlambda,
         tuple(reconstruction.spectralDensity),
         params.gpuSwitch,
-    )
-
-    if inverse:
-        transfer_function = transfer_function.conj()
-    result = ifft2c(fft2c(fields) * transfer_function)
+        params.precision,
+    )[int(inverse)]
+    result = _convolve(fields, transfer_function)
     return reconstruction.esw, result
 
 
@@ -511,7 +561,7 @@ def propagate_identity(
 
     """
     transfer_function = __make_quad_phase(
-        1e-3, 532e-9, reconstruction.Np, reconstruction.dxp, isGpuArray(fields)
+        1e-3, 532e-9, reconstruction.Np, reconstruction.dxp, isGpuArray(fields), params.precision
     )
     transfer_function = transfer_function * 0 + 1
     return reconstruction.esw, fields * transfer_function
@@ -554,6 +604,8 @@ def detector2object(fields, params: Params, reconstruction: Reconstruction):
     method: Callable[np.ndarray, Params, Reconstruction] = reverse_lookup_dictionary[
         params.propagatorType.lower()
     ]
+    if instrumentation.enabled:
+        instrumentation.count(f"detector2object.{params.propagatorType}")
     return method(fields, params, reconstruction)
 
 
@@ -565,10 +617,12 @@ def object2detector(fields, params: Params, reconstruction: Reconstruction):
     ]
     if fields is None:
         fields = reconstruction.esw
+    if instrumentation.enabled:
+        instrumentation.count(f"object2detector.{params.propagatorType}")
     return method(fields, params, reconstruction)
 
 
-def aspw(u, z, wavelength, L, bandlimit=True, is_FT=True):
+def aspw(u, z, wavelength, L, bandlimit=True, is_FT=True, precision="single"):
     """
     Angular spectrum plane wave propagation function.
     following: Matsushima et al., "Band-Limited Angular Spectrum Method for Numerical Simulation of Free-Space
@@ -589,6 +643,8 @@ def aspw(u, z, wavelength, L, bandlimit=True, is_FT=True):
         Wether or not to band limit the sample
     is_FT: bool
         If the field has already been fourier transformed.
+    precision: str
+        'single' or 'double', the dtype of the transfer function (see utils.precision)
 
     Returns
     -------
@@ -603,17 +659,101 @@ def aspw(u, z, wavelength, L, bandlimit=True, is_FT=True):
         float(L),
         on_gpu=isGpuArray(u),
         bandlimit=bandlimit,
+        precision=precision,
     )
     if is_FT:
         U = u
     else:
         U = fft2c(u)
-    u_prop = ifft2c(U * phase_exp)
+    u_prop = ifft2c(U * phase_exp, overwrite=True)
     return u_prop, phase_exp
 
 
-@lru_cache(cache_size)
-def __aspw_transfer_function(z, wavelength, N, L, on_gpu=False, bandlimit=True):
+class AngularSpectrumPropagator(object):
+    """
+    Band-limited angular spectrum propagation (see aspw) at a fixed wavelength and sampling, for any distance z.
+
+    Everything that does not depend on z (the kz map, the evanescent-wave mask and the radial spatial frequency used
+    by the band limit) is computed once, so the transfer function of a new distance only costs one complex
+    exponential. Use get_asp_propagator to get a cached instance.
+
+    Parameters
+    ----------
+    wavelength: float
+        wavelength in meter
+    N: int
+        Number of pixels per side
+    L: float
+        Physical size
+    on_gpu: bool
+        If true, cupy arrays are returned
+    bandlimit: bool
+        If the evanescent waves should be removed.
+    precision: str
+        'single' or 'double', the dtype of the transfer functions (see utils.precision)
+    """
+
+    def __init__(self, wavelength, N, L, on_gpu=False, bandlimit=True, precision="single"):
+        xp = cp if on_gpu else np
+        self.xp = xp
+        self.dtype = getPrecision(precision).complex
+        self.wavelength = wavelength
+        self.N = N
+        self.L = L
+        X = xp.arange(-N / 2, N / 2) / L
+        Fx, Fy = xp.meshgrid(X, X)
+        # squared radial frequency, for the band limit of Matsushima et al.
+        self.fr2 = Fx**2 + Fy**2
+        exponent = 1 - (Fx * wavelength) ** 2 - (Fy * wavelength) ** 2
+        # take out stuff that cannot exist
+        self.mask = exponent > 0
+        if not bandlimit:
+            self.mask = xp.ones_like(self.mask)
+        # put the out of range values to 0 so the square root can be taken
+        self.kz = 2 * np.pi / wavelength * xp.sqrt(xp.clip(exponent, 0, xp.inf))
+
+    @property
+    def nbytes(self):
+        return self.fr2.nbytes + self.mask.nbytes + self.kz.nbytes
+
+    def transfer_function(self, z):
+        """
+        Transfer function(s) for distance z.
+        :param z: float, or an array of distances, which are evaluated in one go
+        :return: (N, N) array for a scalar z, (len(z), N, N) array otherwise, in the precision of the propagator
+        """
+        xp = self.xp
+        z = xp.asarray(z, dtype=np.float64)
+        zz = z[..., None, None]
+        f_max2 = self.L**2 / (self.wavelength**2 * (self.L**2 + 4 * zz**2))
+        # note: see the paper above if you are not sure what this bandlimit has to do here
+        W = self.mask & (self.fr2 < f_max2)
+        # exp(i kz z), for negative z this is the conjugate of the forward transfer function
+        return (W * complexexp(self.kz * zz)).astype(self.dtype)
+
+    def propagate(self, U, z, is_FT=True):
+        """
+        Propagate U over distance(s) z.
+        :param U: field, (..., N, N)
+        :param z: float, or an array of distances. In that case the planes are stacked along a new first axis.
+        :param is_FT: If the field has already been fourier transformed.
+        :return: propagated field(s)
+        """
+        if not is_FT:
+            U = fft2c(U)
+        return ifft2c(U * self.transfer_function(z), overwrite=True)
+
+
+@kernel_cache("aspPropagator")
+def get_asp_propagator(wavelength, N, L, on_gpu=False, bandlimit=True, precision="single"):
+    """Cached AngularSpectrumPropagator, one per wavelength, sampling and precision."""
+    return AngularSpectrumPropagator(
+        float(wavelength), int(N), float(L), on_gpu=on_gpu, bandlimit=bandlimit, precision=precision
+    )
+
+
+@kernel_cache("aspw")
+def __aspw_transfer_function(z, wavelength, N, L, on_gpu=False, bandlimit=True, precision="single"):
     """
     Angular spectrum optical transfer function. You likely don't need to use this directly.
 
@@ -635,37 +775,51 @@ def __aspw_transfer_function(z, wavelength, N, L, on_gpu=False, bandlimit=True):
         If true, a cupy array is returned
     bandlimit: bool
         If the transfer function should be band-limited.
+    precision: str
+        'single' or 'double', the dtype of the transfer function
 
     Returns
     -------
 
     """
-    if on_gpu:
-        xp = cp
-    else:
-        xp = np
+    return get_asp_propagator(wavelength, N, L, on_gpu, bandlimit, precision).transfer_function(z)
 
-    a_z = abs(z)
-    k = 2 * np.pi / wavelength
-    X = xp.arange(-N / 2, N / 2) / L
-    Fx, Fy = xp.meshgrid(X, X)
-    f_max = L / (wavelength * xp.sqrt(L**2 + 4 * a_z**2))
-    # note: see the paper above if you are not sure what this bandlimit has to do here
-    # W = rect(Fx/(2*f_max)) .* rect(Fy/(2*f_max));
-    W = xp.array(circ(Fx, Fy, 2 * f_max))
-    # note: accounts for circular symmetry of transfer function and imposes bandlimit to avoid sampling issues
-    exponent = 1 - (Fx * wavelength) ** 2 - (Fy * wavelength) ** 2
-    # take out stuff that cannot exist
-    mask = exponent > 0
-    if not bandlimit:
-        mask = 0 * mask + 1
-    # put the out of range values to 0 so the square root can be taken
-    exponent = xp.clip(exponent, 0, xp.inf)
-    H = xp.array(mask * complexexp(k * a_z * xp.sqrt(exponent)))
-    if z < 0:
-        H = H.conj()
-    phase_exp = H * W
-    return phase_exp
+
+def __aspw_transfer_function_stack(z, wavelength, N, L, on_gpu=False, precision="single"):
+    """
+    Band-limited angular spectrum transfer functions (see __aspw_transfer_function) of several wavelengths, stacked.
+    They come from the cached AngularSpectrumPropagator of every wavelength.
+
+    Parameters
+    ----------
+    z: float or np.ndarray
+        distance, either one for all wavelengths or one per wavelength
+    wavelength: float or np.ndarray
+        wavelength(s) in meter
+    N: int
+        Number of pixels per side
+    L: int
+        Physical size
+    on_gpu: bool
+        If true, a cupy array is returned
+    precision: str
+        'single' or 'double', the dtype of the transfer functions
+
+    Returns
+    -------
+    array of shape (nlambda, 1, 1, 1, N, N), which broadcasts over the object and probe modes.
+    """
+    xp = cp if on_gpu else np
+    wavelength = np.atleast_1d(asNumpyArray(wavelength))
+    z = np.broadcast_to(asNumpyArray(z), wavelength.shape)
+    # one cached propagator (kz map, masks) per wavelength, only the exponentials are computed here
+    H = xp.stack(
+        [
+            get_asp_propagator(w, N, L, on_gpu, True, precision).transfer_function(zw)
+            for w, zw in zip(wavelength, z)
+        ]
+    )
+    return H[:, None, None, None]
 
 
 def complexexp(angle):
@@ -822,13 +976,16 @@ def fresnelPropagator(u, z, wavelength, L):
     return u_out, dq, Q1, Q2
 
 
-def clear_cache(logger: logging.Logger = None):
+def clear_cache(logger: logging.Logger = None, name: str = None):
     """Clear the cache of all cached functions in this module. Use if GPU memory is not available.
 
     IF logger is available, print some information about the methods being cleared.
 
+    :param name: only clear the kernel cache with this name (e.g. 'ASP', see kernel_cache_stats), default: all
+
     Returns nothing"""
     list_of_methods = [
+        get_asp_propagator,
         __aspw_transfer_function,
         __make_quad_phase,
         __make_transferfunction_ASP,
@@ -837,16 +994,31 @@ def clear_cache(logger: logging.Logger = None):
         __make_transferfunction_polychrome_ASP,
         __make_transferfunction_scaledPolychromeASP,
     ]
+    if name is not None and name not in [method.cache.name for method in list_of_methods]:
+        raise KeyError(f"Unknown kernel cache {name}")
     for method in list_of_methods:
+        if name is not None and method.cache.name != name:
+            continue
         if logger is not None:
             logger.debug(method.cache_info())
-            logger.info("clearing cache for %s", method)
+            logger.info("clearing cache for %s", method.__name__)
         method.cache_clear()
 
 
-@lru_cache(cache_size)
+def kernel_cache_stats():
+    """Hits, misses, evictions, bytes held and budget of the kernel cache of every propagator, as a list of dicts."""
+    return _kernel_cache.cache_stats()
+
+
+def set_kernel_cache_budget(name: str, nbytes: int):
+    """Set the memory budget (in bytes) of the kernel cache of one propagator, e.g. set_kernel_cache_budget('ASP', 2**30).
+    Kernels are evicted (least recently used first) until the cache fits."""
+    _kernel_cache.set_budget(name, nbytes)
+
+
+@kernel_cache("ASP")
 def __make_transferfunction_ASP(
-    fftshiftSwitch, nosm, npsm, Np, zo, wavelength, Lp, nlambda, on_gpu
+    fftshiftSwitch, nosm, npsm, Np, zo, wavelength, Lp, nlambda, on_gpu, precision="single"
 ):
     if fftshiftSwitch:
         raise ValueError("ASP propagatorType works only with fftshiftSwitch = False!")
@@ -855,28 +1027,11 @@ def __make_transferfunction_ASP(
             "For multi-wavelength, polychromeASP needs to be used instead of ASP"
         )
 
-    dummy = np.ones((1, nosm, npsm, 1, Np, Np), dtype="complex64")
-    _transferFunction = np.array(
-        [
-            [
-                [
-                    [
-                        __aspw_transfer_function(zo, wavelength, Np, Lp)
-                        for nslice in range(1)
-                    ]
-                    for npsm in range(npsm)
-                ]
-                for nosm in range(nosm)
-            ]
-            for nlambda in range(nlambda)
-        ],
-        dtype=np.complex64,
+    # shape (1, 1, 1, 1, Np, Np), broadcast over the modes
+    _transferFunction = __aspw_transfer_function_stack(
+        zo, wavelength, Np, Lp, on_gpu, precision
     )
-
-    if on_gpu:
-        return cp.array(_transferFunction)
-    else:
-        return _transferFunction
+    return __forward_and_inverse_kernel(_transferFunction)
 
 
 def aspw_cached(u, z, wavelength, L):
@@ -888,11 +1043,11 @@ def aspw_cached(u, z, wavelength, L):
     #                                               z, wavelength, L, 1, isGpuArray(u))
     # transferFunction = transferFunction[0,0,0,0]
     U = fft2c(u)
-    u_prime = ifft2c(U * transferFunction)
+    u_prime = ifft2c(U * transferFunction, overwrite=True)
     return u_prime
 
 
-@lru_cache(cache_size)
+@kernel_cache("polychromeASP")
 def __make_transferfunction_polychrome_ASP(
     propagatorType,
     fftshiftSwitch,
@@ -905,35 +1060,19 @@ def __make_transferfunction_polychrome_ASP(
     nlambda,
     spectralDensity_as_tuple,
     gpuSwitch,
+    precision="single",
 ) -> np.ndarray:
     spectralDensity = np.array(spectralDensity_as_tuple)
     if fftshiftSwitch:
         raise ValueError("ASP propagatorType works only with fftshiftSwitch = False!")
-    dummy = np.ones((nlambda, nosm, npsm, 1, Np, Np), dtype="complex64")
-    transferFunction = np.array(
-        [
-            [
-                [
-                    [
-                        __aspw_transfer_function(
-                            zo, spectralDensity[nlambda], Np, Lp, False,
-                        )
-                        for nslice in range(1)
-                    ]
-                    for npsm in range(npsm)
-                ]
-                for nosm in range(nosm)
-            ]
-            for nlambda in range(nlambda)
-        ]
+    # shape (nlambda, 1, 1, 1, Np, Np), broadcast over the modes
+    transferFunction = __aspw_transfer_function_stack(
+        zo, spectralDensity[:nlambda], Np, Lp, gpuSwitch, precision
     )
-    if gpuSwitch:
-        return cp.array(transferFunction, dtype=cp.complex64)
-    else:
-        return transferFunction
+    return __forward_and_inverse_kernel(transferFunction)
 
 
-@lru_cache(cache_size)
+@kernel_cache("scaledASP")
 def __make_transferfunction_scaledASP(
     propagatorType,
     fftshiftSwitch,
@@ -946,6 +1085,7 @@ def __make_transferfunction_scaledASP(
     dxo,
     dxd,
     gpuSwitch,
+    precision="single",
 ):
     if fftshiftSwitch:
         raise ValueError(
@@ -955,21 +1095,20 @@ def __make_transferfunction_scaledASP(
         raise ValueError(
             "For multi-wavelength, scaledPolychromeASP needs to be used instead of scaledASP"
         )
-    dummy = np.ones((1, nosm, npsm, 1, Np, Np), dtype="complex64")
-    _Q1 = np.ones_like(dummy)
-    _Q2 = np.ones_like(dummy)
-    for nosm in range(nosm):
-        for npsm in range(npsm):
-            _, _Q1[0, nosm, npsm, 0, ...], _Q2[0, nosm, npsm, 0, ...] = scaledASP(
-                dummy[0, nosm, npsm, 0, :, :], zo, wavelength, dxo, dxd
-            )
+    # shape (1, 1, 1, 1, Np, Np), broadcast over the modes
+    dtype = getPrecision(precision).complex
+    dummy = np.ones((Np, Np), dtype=dtype)
+    _, _Q1, _Q2 = scaledASP(dummy, zo, wavelength, dxo, dxd)
+    _Q1 = np.asarray(_Q1, dtype=dtype)[None, None, None, None]
+    _Q2 = np.asarray(_Q2, dtype=dtype)[None, None, None, None]
 
     if gpuSwitch:
-        return cp.array(_Q1, dtype=np.complex64), cp.array(_Q2, dtype=np.complex64)
-    return _Q1, _Q2
+        _Q1, _Q2 = cp.array(_Q1, dtype=dtype), cp.array(_Q2, dtype=dtype)
+    # the kernels of the inverse propagation are stored as well, so they are not conjugated on every call
+    return _Q1, _Q2, _Q1.conj(), _Q2.conj()
 
 
-@lru_cache(cache_size)
+@kernel_cache("scaledPolychromeASP")
 def __make_transferfunction_scaledPolychromeASP(
     fftshiftSwitch,
     nlambda,
@@ -981,6 +1120,7 @@ def __make_transferfunction_scaledPolychromeASP(
     dxo,
     dxd,
     on_gpu,
+    precision="single",
 ):
     spectralDensity = np.array(spectralDensity_as_tuple)
     if fftshiftSwitch:
@@ -991,11 +1131,11 @@ def __make_transferfunction_scaledPolychromeASP(
         xp = cp
     else:
         xp = np
-    dummy = xp.ones((nlambda, nosm, npsm, 1, Np, Np), dtype="complex64")
-    Q1 = xp.ones_like(dummy)
-    Q2 = xp.ones_like(dummy)
+    # shape (nlambda, 1, 1, 1, Np, Np), broadcast over the modes
+    Q1 = xp.ones((nlambda, 1, 1, 1, Np, Np), dtype=getPrecision(precision).complex)
+    Q2 = xp.ones_like(Q1)
     for nlambda in range(nlambda):
-        Q1_candidate, Q2_candidate = __make_transferfunction_scaledASP(
+        Q1_candidate, Q2_candidate, _, _ = __make_transferfunction_scaledASP(
             None,
             fftshiftSwitch,
             1,
@@ -1007,12 +1147,14 @@ def __make_transferfunction_scaledPolychromeASP(
             dxo,
             dxd,
             gpuSwitch=on_gpu,
+            precision=precision,
         )
         Q1[nlambda], Q2[nlambda] = Q1_candidate[0], Q2_candidate[0]
-    return Q1, Q2
+    # the kernels of the inverse propagation are stored as well, so they are not conjugated on every call
+    return Q1, Q2, Q1.conj(), Q2.conj()
 
 
-@lru_cache(cache_size)
+@kernel_cache("twoStepPolychrome")
 def __make_cache_twoStepPolychrome(
     fftshiftSwitch,
     nlambda,
@@ -1024,6 +1166,7 @@ def __make_cache_twoStepPolychrome(
     Lp,
     dxp,
     on_gpu,
+    precision="single",
 ):
     if on_gpu:
         xp = cp
@@ -1034,31 +1177,16 @@ def __make_cache_twoStepPolychrome(
         raise ValueError(
             "twoStepPolychrome propagatorType works only with fftshiftSwitch = False!"
         )
-    transferFunction = xp.array(
-        [
-            [
-                [
-                    [
-                        __aspw_transfer_function(
-                            z=zo * (1 - spectralDensity[0] / spectralDensity[nlambda]),
-                            wavelength=spectralDensity[nlambda],
-                            N=Np,
-                            L=Lp,
-                            on_gpu=on_gpu,
-                        )
-                        for nslice in range(1)
-                    ]
-                    for npsm in range(npsm)
-                ]
-                for nosm in range(nosm)
-            ]
-            for nlambda in range(nlambda)
-        ]
+    # shape (nlambda, 1, 1, 1, Np, Np), broadcast over the modes
+    wavelengths = spectralDensity[:nlambda]
+    transferFunction = __aspw_transfer_function_stack(
+        zo * (1 - spectralDensity[0] / wavelengths), wavelengths, Np, Lp, on_gpu, precision
+    )
+    quadraticPhase = __make_quad_phase(zo, spectralDensity[0], Np, dxp, on_gpu, precision)
+    return (
+        __forward_and_inverse_kernel(transferFunction),
+        (quadraticPhase, quadraticPhase.conj()),
     )
-    if on_gpu:
-        transferFunction = cp.array(transferFunction)
-    quadraticPhase = __make_quad_phase(zo, spectralDensity[0], Np, dxp, on_gpu)
-    return transferFunction, quadraticPhase
 
 
 forward_lookup_dictionary = {
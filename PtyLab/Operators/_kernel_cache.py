@@ -0,0 +1,149 @@
+"""
+Memory-aware cache for propagation kernels.
+
+Every cached kernel factory has its own byte budget. When a new kernel does not fit, the least recently used kernels
+are evicted until it does. This replaces the entry-count based functools.lru_cache, which ignored the size of the
+kernels: it kept a few large kernels too many in GPU memory, and thrashed when z changes continuously (zPIE,
+TV autofocus) even though many small kernels would have fit.
+
+Budgets can be changed per cache with set_budget (BaseEngine does that from params.kernelCacheBudgets), and
+cache_stats reports the hits, misses, evictions and bytes held by every cache.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+# default budget of every kernel cache, in bytes
+default_budget = 512 * 2**20
+
+logger = logging.getLogger("KernelCache")
+
+# name -> KernelCache, for all the caches that have been made
+_caches = OrderedDict()
+
+
+def _nbytes(value):
+    """Size in bytes of an array, or of the arrays in a (nested) tuple."""
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(v) for v in value)
+    return getattr(value, "nbytes", 0)
+
+
+class KernelCache(object):
+    """
+    Byte-budgeted LRU cache around one kernel factory. Use the kernel_cache decorator to make one.
+    The cached values are shared, so they must not be modified in-place by the callers.
+    """
+
+    def __init__(self, name, budget=default_budget):
+        self.name = name
+        self.budget = int(budget)
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+
+    def __call__(self, function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            key = args
+            if kwargs:
+                key += (_kwargs_marker,) + tuple(sorted(kwargs.items()))
+            with self._lock:
+                if key in self._entries:
+                    self.hits += 1
+                    self._entries.move_to_end(key)
+                    return self._entries[key][0]
+                self.misses += 1
+            value = function(*args, **kwargs)
+            self._store(key, value)
+            return value
+
+        wrapper.cache = self
+        wrapper.cache_info = self.info
+        wrapper.cache_clear = self.clear
+        return wrapper
+
+    def _store(self, key, value):
+        nbytes = _nbytes(value)
+        with self._lock:
+            if key in self._entries:
+                return
+            if nbytes > self.budget:
+                logger.debug(
+                    "%s: kernel of %d bytes exceeds the budget, not cached", self.name, nbytes
+                )
+                return
+            self._entries[key] = (value, nbytes)
+            self.bytes += nbytes
+            self._evict()
+
+    def _evict(self):
+        """Drop the least recently used kernels until the budget is met."""
+        while self.bytes > self.budget and self._entries:
+            _, (_, nbytes) = self._entries.popitem(last=False)
+            self.bytes -= nbytes
+            self.evictions += 1
+
+    def set_budget(self, budget):
+        with self._lock:
+            self.budget = int(budget)
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def info(self):
+        """Statistics of this cache, as a dictionary."""
+        with self._lock:
+            return dict(
+                name=self.name,
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                entries=len(self._entries),
+                bytes=self.bytes,
+                budget=self.budget,
+            )
+
+
+_kwargs_marker = object()
+
+
+def kernel_cache(name, budget=default_budget):
+    """
+    Decorator that caches the kernels returned by a function in a byte-budgeted LRU cache.
+    :param name: name of the cache, as used by set_budget, cache_stats and clear
+    :param budget: budget in bytes
+    """
+    cache = KernelCache(name, budget)
+    _caches[name] = cache
+    return cache
+
+
+def set_budget(name, budget):
+    """Set the budget (in bytes) of the cache called name."""
+    if name not in _caches:
+        raise KeyError(f"Unknown kernel cache {name}, choose one of {list(_caches)}")
+    _caches[name].set_budget(budget)
+
+
+def cache_stats():
+    """Statistics of all the kernel caches, as a list of dictionaries."""
+    return [cache.info() for cache in _caches.values()]
+
+
+def clear(name=None):
+    """Clear the cache called name, or all the caches if name is None."""
+    if name is None:
+        for cache in _caches.values():
+            cache.clear()
+    else:
+        if name not in _caches:
+            raise KeyError(f"Unknown kernel cache {name}, choose one of {list(_caches)}")
+        _caches[name].clear()
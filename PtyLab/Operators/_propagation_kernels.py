@@ -1,17 +1,15 @@
-from functools import lru_cache
-
 try:
     import cupy as cp
 except ImportError:
     print("Cupy unavailable")
 import numpy as np
 
-# from PtyLab.Operators.Operators import cache_size
-cache_size = 30
+from PtyLab.Operators._kernel_cache import kernel_cache
+from PtyLab.utils.precision import getPrecision
 
 
-@lru_cache(maxsize=cache_size)
-def __make_quad_phase(zo, wavelength, Np, dxp, on_gpu):
+@kernel_cache("quad_phase")
+def __make_quad_phase(zo, wavelength, Np, dxp, on_gpu, precision="single"):
     """
     Make a quadratic phase profile corresponding to distance zo at wavelength wl. The result is cached and can be
     called again with almost no time lost.
@@ -20,6 +18,7 @@ def __make_quad_phase(zo, wavelength, Np, dxp, on_gpu):
     :param Np:
     :param dxp:
     :param on_gpu:
+    :param precision: 'single' or 'double', the dtype of the result (see utils.precision)
     :return:
     """
     if on_gpu:
@@ -31,4 +30,4 @@ def __make_quad_phase(zo, wavelength, Np, dxp, on_gpu):
     Xp, Yp = xp.meshgrid(x_p, x_p)
 
     quadraticPhase = xp.exp(1.0j * xp.pi / (wavelength * zo) * (Xp**2 + Yp**2))
-    return quadraticPhase
+    return quadraticPhase.astype(getPrecision(precision).complex)
@@ -0,0 +1,41 @@
+from unittest import TestCase
+import numpy as np
+import unittest
+from PtyLab.Operators._kernel_cache import KernelCache
+
+
+class TestKernelCache(TestCase):
+    def test_budget(self):
+        """
+        Kernels are evicted least recently used first when the budget is exceeded, and the statistics are kept.
+        :return:
+        """
+        kernel = np.zeros((16, 16), np.complex64)  # 2 kB
+        cache = KernelCache("test", budget=3 * kernel.nbytes)
+        calls = []
+
+        @cache
+        def make_kernel(z):
+            calls.append(z)
+            return kernel.copy(), kernel.copy()
+
+        make_kernel(1)
+        make_kernel(1)
+        self.assertEqual(calls, [1])
+        self.assertEqual(cache.info()["bytes"], 2 * kernel.nbytes)
+
+        # does not fit next to the first one
+        make_kernel(2)
+        make_kernel(2)
+        make_kernel(1)
+        self.assertEqual(calls, [1, 2, 1])
+        info = make_kernel.cache_info()
+        self.assertEqual((info["hits"], info["misses"], info["evictions"]), (2, 3, 2))
+
+        make_kernel.cache_clear()
+        self.assertEqual(cache.info()["entries"], 0)
+        self.assertEqual(cache.info()["bytes"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,12 @@
 from unittest import TestCase
-from PtyLab.Operators.Operators import aspw, scaledASP, scaledASPinv, fresnelPropagator
+from PtyLab.Operators import Operators
+from PtyLab.Operators.Operators import (
+    aspw,
+    scaledASP,
+    scaledASPinv,
+    fresnelPropagator,
+    get_asp_propagator,
+)
 import numpy as np
 from PtyLab.utils.utils import circ
 from numpy.testing import assert_almost_equal
@@ -18,18 +25,45 @@ class TestOperators(TestCase):
         self.L = self.dx * N
 
     def test_aspw(self):
-        E_1, _ = aspw(self.E_in, 0, self.wavelength, self.L)
-        E_2, _ = aspw(E_1, self.z, self.wavelength, self.L)
-        E_3, _ = aspw(E_2, -self.z, self.wavelength, self.L)
-        assert_almost_equal(self.E_in, E_1)
-        assert_almost_equal(abs(E_1), abs(E_3))
+        # circ gives a boolean mask, and aspw takes a field in real space with is_FT=False
+        E_in = self.E_in.astype(np.complex64)
+        E_1, _ = aspw(E_in, 0, self.wavelength, self.L, is_FT=False)
+        E_2, _ = aspw(E_1, self.z, self.wavelength, self.L, is_FT=False)
+        E_3, _ = aspw(E_2, -self.z, self.wavelength, self.L, is_FT=False)
+        # the kernels are single precision
+        assert_almost_equal(E_in, E_1, decimal=5)
+        assert_almost_equal(abs(E_1), abs(E_3), decimal=5)
+
+    def test_asp_propagator(self):
+        propagator = get_asp_propagator(self.wavelength, self.E_in.shape[-1], self.L)
+        zs = np.array([-self.z, 0, self.z])
+        E_stack = propagator.propagate(self.E_in, zs, is_FT=False)
+        self.assertEqual(E_stack.shape, (3,) + self.E_in.shape)
+        for z, E in zip(zs, E_stack):
+            E_ref, _ = aspw(self.E_in, z, self.wavelength, self.L, is_FT=False)
+            assert_almost_equal(E, E_ref)
+
+    def test_aspw_transfer_function_stack(self):
+        """
+        The kernels of several wavelengths, computed at once, are the ones of AngularSpectrumPropagator.
+        """
+        transfer_function_stack = getattr(Operators, "__aspw_transfer_function_stack")
+        wavelengths = np.array([500e-9, 600e-9, 700e-9])
+        zs = np.array([self.z, -self.z, 0])
+        N = self.E_in.shape[-1]
+        H = transfer_function_stack(zs, wavelengths, N, self.L)
+        self.assertEqual(H.shape, (3, 1, 1, 1, N, N))
+        for wavelength, z, H_wavelength in zip(wavelengths, zs, H[:, 0, 0, 0]):
+            np.testing.assert_array_equal(
+                H_wavelength, get_asp_propagator(wavelength, N, self.L).transfer_function(z)
+            )
 
     def test_scaledASP(self):
         E_1, _, _ = scaledASP(self.E_in, self.z, self.wavelength, self.dx, self.dx)
         E_2, _, _ = scaledASP(E_1, -self.z, self.wavelength, self.dx, self.dx)
         assert_almost_equal(abs(E_2), abs(self.E_in))
 
-    @unittest.skip()
+    @unittest.skip("not implemented")
     def test_fresnelPropagator(self):
         E_out = fresnelPropagator(self.E_in, 0, self.wavelength, self.L)
         assert_almost_equal(self.E_in, E_out)
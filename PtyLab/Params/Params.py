@@ -34,6 +34,34 @@ class Params(object):
 
         self.intensityConstraint = "standard"  # standard or sigmoid
         self.propagatorType = "Fraunhofer"  # 'Fresnel' 'ASP'
+        # FFT backend for CPU reconstructions: 'numpy', 'scipy' or 'pyfftw'. None uses the
+        # PTYLAB_FFT_BACKEND environment variable (default numpy)
+        self.fftBackend = None
+        self.fftWorkers = None  # number of FFT threads for the scipy and pyfftw backends, None uses all cores
+        # memory budget (bytes) of the propagation kernel cache per propagator, e.g. {'ASP': 2**30}. Caches that
+        # are not listed keep their default budget, see Operators.kernel_cache_stats for the names and usage
+        self.kernelCacheBudgets = {}
+        # hot-path counters and gauges (see utils.instrumentation). None leaves the PTYLAB_INSTRUMENTATION default
+        self.instrumentation = None
+        # time the stages of the engines (patch extraction, propagation, updates, constraints, ...), see
+        # engine.profiler.summary() and engine.profiler.saveTrace(filename)
+        self.profiling = False
+        # sample the memory use at the end of every stage and log the peak and the largest arrays after every
+        # iteration, see utils.memoryTracker
+        self.memoryTracking = False
+        # frames of a lazy ptychogram (ExperimentalData.loadData(..., lazy=True)) that are read ahead of the
+        # position loop, and the number of threads that read them. 0 reads every frame when it is needed
+        self.prefetchFrames = 8
+        self.prefetchWorkers = 2
+        # keep sqrt(ptychogram) as a float32 table for the 'standard' and 'interferometric' intensity constraints,
+        # which saves a square root per pixel and position at the memory of a float32 ptychogram
+        self.amplitudeTable = False
+        # 'single' keeps all the fields and kernels in complex64 / float32, 'double' (complex128 / float64) is
+        # meant to validate results, see utils.precision
+        self.precision = "single"
+        # check after every iteration that no field was upcast beyond the precision: 'warn' (and cast it back),
+        # 'raise' or None
+        self.precisionCheck = "warn"
         self.momentumAcceleration = False  # default False, it is turned on in the individual Engines that use momentum
         self.adaptiveMomentumAcceleration = False  # default False, it is turned on in the individual Engines that use momentum
 
@@ -41,9 +69,21 @@ class Params(object):
         self.gpuSwitch = False
         # This only makes sense on a GPU, not there yet
         self.saveMemory = False
+        # number of positions for which the full detector residual map is kept (reconstruction.residualReservoir),
+        # only the per-frame error is needed for the error metric
+        self.residualReservoirSize = 0
         self.probeUpdateStart = 1
         self.objectUpdateStart = 1
         self.positionOrder = "random"  # 'random' or 'sequential' or 'NA'
+        # number of positions that are propagated together as one stacked (batched) FFT.
+        # 1 is the usual sequential PIE update, larger values apply the mean of the updates of the engine at the
+        # positions of a batch, see BaseEngine.batchPositionUpdate. Only ePIE and mPIE have a batched update, the
+        # other Engines warn and update the positions one by one
+        self.batchSize = 1
+        # only put mutually non-overlapping positions in a batch (graph colouring of the patch overlap), so that the
+        # object updates of a batch do not interfere. The probe is still updated once per batch, from the probe at the
+        # start of the batch, so the result differs from the sequential update
+        self.batchNonOverlapping = False
 
         ## Swtiches used in applyConstraints method:
         self.orthogonalizationSwitch = False
@@ -119,6 +159,11 @@ class Params(object):
         self.TV_autofocus_max_z = None
         # number of planes to examine
         self.TV_autofocus_nplanes = 11
+        # how to find the focus: 'sweep' (TV_autofocus_nplanes planes and a momentum step), or a search for the
+        # optimum around the previous one with 'golden' (golden-section) or 'brent' (parabolic refinement)
+        self.TV_autofocus_search = "sweep"
+        # the 'golden' and 'brent' searches stop when the focus is known to within this many depths of focus
+        self.TV_autofocus_tolerance_dof = 0.5
 
         # map a change in positions to a change in z. Experimental, do not use
         self.map_position_to_z_change = False
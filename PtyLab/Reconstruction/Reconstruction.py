@@ -6,7 +6,7 @@ import logging
 import h5py
 
 # logging.basicConfig(level=logging.DEBUG)
-from PtyLab.Regularizers import metric_at, TV
+from PtyLab.Regularizers import FocusStack, TV
 
 from PtyLab.utils.initializationFunctions import initialProbeOrObject
 from PtyLab.utils.gpuUtils import (
@@ -16,6 +16,9 @@ from PtyLab.utils.gpuUtils import (
 )
 from PtyLab import Params
 from PtyLab.utils.gpuUtils import asNumpyArray
+from PtyLab.utils.coordinateGrids import CoordinateGrids
+from PtyLab.utils.precision import getPrecision
+from PtyLab.utils.focusSearch import focusSearchMethods
 
 
 def calculate_pixel_positions(encoder_corrected, dxo, No, Np, asint):
@@ -64,15 +67,21 @@ class Reconstruction(object):
     def __init__(self, data: ExperimentalData, params: Params):
 
         self.zMomentum = 0
+        # half width of the focus search bracket, see _TV_autofocus_search
+        self.zBracket = None
         self.wavelength = None
         self._zo = None
         self.dxd = None
         self.theta = None
 
-        # positions including possible misalignment correction
+        # positions including possible misalignment correction, see the encoder_corrected property
+        self._positions = None
+        self._positions_key = None
         self.encoder_corrected = None
 
         self.logger = logging.getLogger("Reconstruction")
+        # memoised Xp, Yp, Xd, Yd, Xo and Yo grids
+        self.coordinateGrids = CoordinateGrids()
         self.data = data
         self.params = params
         self.copyAttributesFromExperiment(data)
@@ -87,7 +96,7 @@ class Reconstruction(object):
             "objectBuffer",
             "probeMomentum",
             "objectMomentum",
-            "detectorError",
+            "errorAtPos",
             "background",
             "purityProbe",
             "purityObject",
@@ -116,7 +125,7 @@ class Reconstruction(object):
         elif self.data.operationMode == "FPM":
             listOfReconstructionProperties = self.listOfReconstructionPropertiesFPM
         for key in listOfReconstructionProperties:
-            self.logger.error("Copying attribute %s", key)
+            self.logger.debug("Copying attribute %s", key)
             # setattr(self, key, copy(np.array(getattr(data, key))))
             setattr(self, key, copy(getattr(data, key)))
 
@@ -135,6 +144,20 @@ class Reconstruction(object):
         """Reset the position corrections."""
         self.encoder_corrected = self.data.encoder.copy()
 
+    @property
+    def encoder_corrected(self):
+        """Scan positions in SI units, including possible misalignment correction.
+
+        Assigning a new array invalidates the cached pixel positions. If you change it in-place,
+        call invalidatePositions() (or use updatePositions) afterwards.
+        """
+        return self._encoder_corrected
+
+    @encoder_corrected.setter
+    def encoder_corrected(self, new_value):
+        self._encoder_corrected = new_value
+        self.invalidatePositions()
+
     @property
     def zo(self):
         """Distance from sample to detector. Also updates all derived qualities."""
@@ -143,6 +166,8 @@ class Reconstruction(object):
     @zo.setter
     def zo(self, new_value):
         self._zo = new_value
+        # the pixel sizes change, drop the grids of the old sampling
+        self.coordinateGrids.invalidate()
         if self.data.operationMode == "CPM":
             self.logger.debug(f"Changing sample-detector distance to {new_value}")
             self.dxp = self.wavelength * self._zo / self.Ld
@@ -365,7 +390,10 @@ class Reconstruction(object):
             # Load the object from an existing reconstruction
             self.initialGuessObject = self.loadResults(self.initialProbe_filename, datatype='object')
         else:
-            self.initialGuessObject = initialProbeOrObject(self.shape_O, self.initialObject, self, self.logger).astype(np.complex64)
+            self.initialGuessObject = initialProbeOrObject(self.shape_O, self.initialObject, self, self.logger)
+        self.initialGuessObject = self.initialGuessObject.astype(
+            getPrecision(self.params.precision).complex
+        )
 
         # self.initialGuessObject *= 1e-2
 
@@ -401,7 +429,10 @@ class Reconstruction(object):
                 self.initialProbe = "circ"
             self.initialGuessProbe = initialProbeOrObject(
                 self.shape_P, self.initialProbe, self
-            ).astype(np.complex64)
+            )
+        self.initialGuessProbe = self.initialGuessProbe.astype(
+            getPrecision(self.params.precision).complex
+        )
 
     # initialize momentum, called in specific engines with momentum accelaration
     def initializeObjectMomentum(self):
@@ -563,18 +594,18 @@ class Reconstruction(object):
     @property
     def xd(self):
         """Detector coordinates 1D"""
-        return np.linspace(-self.Nd / 2, self.Nd / 2, np.int(self.Nd)) * self.dxd
+        return np.linspace(-self.Nd / 2, self.Nd / 2, int(self.Nd)) * self.dxd
 
     @property
     def Xd(self):
-        """Detector coordinates 2D"""
-        Xd, Yd = np.meshgrid(self.xd, self.xd)
+        """Detector coordinates 2D (cached, read-only, single precision)"""
+        Xd, Yd = self.coordinateGrids.get(self.Nd, self.dxd)
         return Xd
 
     @property
     def Yd(self):
-        """Detector coordinates 2D"""
-        Xd, Yd = np.meshgrid(self.xd, self.xd)
+        """Detector coordinates 2D (cached, read-only, single precision)"""
+        Xd, Yd = self.coordinateGrids.get(self.Nd, self.dxd)
         return Yd
 
     @property
@@ -607,14 +638,14 @@ class Reconstruction(object):
 
     @property
     def Xp(self):
-        """Probe coordinates 2D"""
-        Xp, Yp = np.meshgrid(self.xp, self.xp)
+        """Probe coordinates 2D (cached, read-only, single precision)"""
+        Xp, Yp = self.coordinateGrids.get(self.Np, self.dxp)
         return Xp
 
     @property
     def Yp(self):
-        """Probe coordinates 2D"""
-        Xp, Yp = np.meshgrid(self.xp, self.xp)
+        """Probe coordinates 2D (cached, read-only, single precision)"""
+        Xp, Yp = self.coordinateGrids.get(self.Np, self.dxp)
         return Yp
 
     # Object coordinates
@@ -633,7 +664,7 @@ class Reconstruction(object):
     def xo(self):
         """object coordinates 1D"""
         try:
-            return np.linspace(-self.No / 2, self.No / 2, np.int(self.No)) * self.dxo
+            return np.linspace(-self.No / 2, self.No / 2, int(self.No)) * self.dxo
         except AttributeError as e:
             raise AttributeError(
                 e, 'object pixel number "No" and/or pixel size "dxo" not defined yet'
@@ -641,14 +672,14 @@ class Reconstruction(object):
 
     @property
     def Xo(self):
-        """Object coordinates 2D"""
-        Xo, Yo = np.meshgrid(self.xo, self.xo)
+        """Object coordinates 2D (cached, read-only, single precision)"""
+        Xo, Yo = self.coordinateGrids.get(self.No, self.dxo)
         return Xo
 
     @property
     def Yo(self):
-        """Object coordinates 2D"""
-        Xo, Yo = np.meshgrid(self.xo, self.xo)
+        """Object coordinates 2D (cached, read-only, single precision)"""
+        Xo, Yo = self.coordinateGrids.get(self.No, self.dxo)
         return Yo
 
     # scan positions in pixel
@@ -665,15 +696,62 @@ class Reconstruction(object):
         operation mode is 'FPM'. That implies that the second intensity
         in the spectrogram is updates a patch which has pixel coordinates
         [3,4] in the high-resolution Fourier transform
+
+        The table is cached and read-only. It is recomputed only when encoder_corrected is assigned, or when
+        one of dxo, No, Np, zled or wavelength changes.
+        """
+        key = self._positionsKey()
+        if self._positions is None or self._positions_key != key:
+            positions = self._computePositions(self.encoder_corrected)
+            positions.flags.writeable = False
+            self._positions = positions
+            self._positions_key = key
+        return self._positions
+
+    def invalidatePositions(self):
+        """Force a recomputation of the cached pixel positions at the next access."""
+        self._positions = None
+        self._positions_key = None
+
+    def updatePositions(self, positionIndices, new_encoder):
+        """
+        Change the corrected encoder positions of a subset of the scan positions. Only the corresponding rows of
+        the cached pixel positions are recomputed.
+        :param positionIndices: indices of the positions to change
+        :param new_encoder: new encoder_corrected values of these positions, shape (len(positionIndices), 2)
         """
+        positions = self.positions
+        self._encoder_corrected[positionIndices] = new_encoder
+        positions.flags.writeable = True
+        positions[positionIndices] = self._computePositions(
+            self._encoder_corrected[positionIndices]
+        )
+        positions.flags.writeable = False
+
+    def _positionsKey(self):
+        """Everything, apart from encoder_corrected, that the pixel positions depend on."""
+        return tuple(
+            None if value is None else np.asarray(value).tolist()
+            for value in (
+                self.data.operationMode,
+                self.dxo,
+                getattr(self, "No", None),
+                self.Np,
+                getattr(self, "zled", None),
+                self.wavelength,
+            )
+        )
+
+    def _computePositions(self, encoder):
+        """Convert (a subset of) the corrected encoder positions to pixel positions. See positions."""
         if self.data.operationMode == "FPM":
             conv = -(1 / self.wavelength) * self.dxo * self.Np
             positions = np.round(
                 conv
-                * self.encoder_corrected
+                * encoder
                 / np.sqrt(
-                    self.encoder_corrected[:, 0] ** 2
-                    + self.encoder_corrected[:, 1] ** 2
+                    encoder[:, 0] ** 2
+                    + encoder[:, 1] ** 2
                     + self.zled**2
                 )[..., None]
             )
@@ -686,7 +764,7 @@ class Reconstruction(object):
             return positions.astype(int)
         else:
             return calculate_pixel_positions(
-                self.encoder_corrected, self.dxo, self.No, self.Np, asint=True
+                encoder, self.dxo, self.No, self.Np, asint=True
             )
 
     # system property list
@@ -781,10 +859,6 @@ class Reconstruction(object):
                 "Both TV_autofocus and L2reg are turned on. This usually leads to poor performance. Consider disabling l2reg if the probe collapses to focal points"
             )
 
-        d = params.TV_autofocus_range_dof
-        nplanes = params.TV_autofocus_nplanes
-        dz = np.linspace(-1, 1, nplanes) * d * self.DoF
-
         if params.TV_autofocus_what == "object":
             field = self.object[self.nlambda // 2, 0, 0, self.nslice // 2, :, :]
         elif params.TV_autofocus_what == "probe":
@@ -809,45 +883,96 @@ class Reconstruction(object):
         else:
             sy, sx = ss, ss
 
-        merit, OEs = metric_at(
-            field,
-            dz,
-            self.dxo,  # same as dxp
-            self.wavelength,
-            (sy, sx),
-            intensity_only=self.params.TV_autofocus_intensityonly,
-            metric=self.params.TV_autofocus_metric,
-            return_propagated=True,
-        )
-        # from here on we are looking at 11 data points, work on CPU
-        # as it's much more convenient and faster
-        feedback = np.sum(dz * merit) / np.sum(merit)
-
-        scores = np.vstack([self.zo + dz, merit])
-
-        self.zMomentum *= params.TV_autofocus_friction
-        self.zMomentum += params.TV_autofocus_stepsize * feedback
-        # now, clip it to the bounds
-        delta_z = self.zo - np.clip(
-            self.zo + self.zMomentum,
-            self.params.TV_autofocus_min_z,
-            self.params.TV_autofocus_max_z,
+        # only the region of interest is propagated, and it is Fourier transformed once for all the planes
+        # dxo is the same as dxp
+        focusStack = FocusStack(field[sy, sx], self.dxo, self.wavelength, precision=params.precision)
+        merit_kwargs = dict(
+            metric=params.TV_autofocus_metric,
+            intensity_only=params.TV_autofocus_intensityonly,
         )
+
+        if params.TV_autofocus_search == "sweep":
+            d = params.TV_autofocus_range_dof
+            nplanes = params.TV_autofocus_nplanes
+            dz = np.linspace(-1, 1, nplanes) * d * self.DoF
+            merit, OEs = focusStack.merit(dz, return_propagated=True, **merit_kwargs)
+            # from here on we are looking at 11 data points, work on CPU
+            # as it's much more convenient and faster
+            feedback = np.sum(dz * merit) / np.sum(merit)
+
+            scores = np.vstack([self.zo + dz, merit])
+
+            self.zMomentum *= params.TV_autofocus_friction
+            self.zMomentum += params.TV_autofocus_stepsize * feedback
+            # now, clip it to the bounds
+            delta_z = self.zo - np.clip(
+                self.zo + self.zMomentum,
+                self.params.TV_autofocus_min_z,
+                self.params.TV_autofocus_max_z,
+            )
+            indices = [nplanes // 2, np.argmax(merit)]
+            OEs = OEs[indices]
+            centre_merit = merit[nplanes // 2]
+        elif params.TV_autofocus_search in focusSearchMethods:
+            delta_z, scores = self._TV_autofocus_search(focusStack, params)
+            # the current and the new focal plane, for display
+            merit, OEs = focusStack.merit(
+                [0, -delta_z], return_propagated=True, **merit_kwargs
+            )
+            centre_merit = merit[0]
+        else:
+            raise ValueError(
+                f"Unknown TV_autofocus_search {params.TV_autofocus_search}, choose 'sweep' or one of {list(focusSearchMethods)}"
+            )
         self.zo -= delta_z
         end_time = time.time()
         self.logger.info(
             f"TV autofocus took {end_time-start_time} seconds, and moved focus by {-delta_z*1e6} micron"
         )
-        indices = [nplanes//2, np.argmax(merit)]
-        OEs = OEs[indices]
         phexp = OEs.sum((-2,-1), keepdims=True).conj()
         phexp = phexp / abs(phexp)
         OEs *= phexp
-        return merit[nplanes//2] / asNumpyArray(abs(self.object[..., sy, sx]).mean()), np.hstack(OEs), (scores, self.zo)
+        return centre_merit / asNumpyArray(abs(self.object[..., sy, sx]).mean()), np.hstack(OEs), (scores, self.zo)
+
+    def _TV_autofocus_search(self, focusStack, params: Params):
+        """
+        Search the focus with a golden-section or Brent search, in a bracket around the current zo (which is the
+        optimum of the previous search). The bracket starts at +- TV_autofocus_range_dof depths of focus and shrinks
+        with the steps that were taken, and the search stops once the bracket is smaller than
+        TV_autofocus_tolerance_dof depths of focus.
+
+        :return: (zo - new zo, (evaluated z, merit) sorted by z)
+        """
+        tolerance = params.TV_autofocus_tolerance_dof * self.DoF
+        half_width = params.TV_autofocus_range_dof * self.DoF
+        if self.zBracket is not None:
+            half_width = min(half_width, self.zBracket)
+        lower, upper = self.zo - half_width, self.zo + half_width
+        if params.TV_autofocus_min_z is not None:
+            lower = max(lower, params.TV_autofocus_min_z)
+        if params.TV_autofocus_max_z is not None:
+            upper = min(upper, params.TV_autofocus_max_z)
+
+        search = focusSearchMethods[params.TV_autofocus_search]
+        merit = lambda z: focusStack.merit(
+            [z - self.zo],
+            metric=params.TV_autofocus_metric,
+            intensity_only=params.TV_autofocus_intensityonly,
+        )[0]
+        z_best, zs, merits = search(merit, lower, upper, tolerance)
+        self.logger.debug(
+            f"{params.TV_autofocus_search} focus search evaluated {len(zs)} planes in [{lower}, {upper}]"
+        )
+
+        # next time, search around the new focus in a bracket that is a few steps wide
+        self.zBracket = max(4 * abs(z_best - self.zo), 2 * tolerance)
+        order = np.argsort(zs)
+        return self.zo - z_best, np.vstack([zs[order], merits[order]])
 
     def reset_TV_autofocus(self):
         """Reset the settings of TV autofocus. Can be useful to reset the memory effect if the steps are getting really large."""
         self.zMomentum = 0
+        self.zBracket = None
 
     @property
     def TV(self):
@@ -1,12 +1,12 @@
 import numpy as np
 from typing import List, Union, Tuple
 
-from PtyLab.Operators.Operators import aspw
+from PtyLab.Operators.Operators import aspw, get_asp_propagator
 from PtyLab.utils.gpuUtils import getArrayModule, isGpuArray, asNumpyArray
 from PtyLab.utils.utils import fft2c
 
 
-def std(field, aleph=1e-2):
+def std(field, aleph=1e-2, axis=None):
     """
     Return the standard deviation of a field.
 
@@ -15,6 +15,8 @@ def std(field, aleph=1e-2):
     field: np.ndarray
     aleph: float
         Ignored
+    axis: tuple
+        Axes to take the standard deviation over, default all.
 
     Returns
     -------
@@ -22,6 +24,8 @@ def std(field, aleph=1e-2):
 
     """
     xp = getArrayModule(field)
+    if axis is not None:
+        return xp.std(field, axis=axis)
     return asNumpyArray(xp.std(field))
 
 
@@ -45,7 +49,7 @@ def min_std(*args, **kwargs):
     return -std(*args, **kwargs)
 
 
-def TV(field, aleph=1e-3):
+def TV(field, aleph=1e-3, axis=None):
     """
     Calculate Total Variation of a field.
 
@@ -55,6 +59,9 @@ def TV(field, aleph=1e-3):
         Optical field to process
     aleph: float
         Tiny constant to avoid dividing by zero
+    axis: tuple
+        Axes to sum over, default all. If given, an array with the TV of every remaining index is returned, which
+        is used to evaluate a stack of planes in one go.
 
     Returns
     -------
@@ -65,14 +72,136 @@ def TV(field, aleph=1e-3):
     xp = getArrayModule(field)
 
     grad_x = xp.roll(field, -1, axis=-1) - xp.roll(field, 1, axis=-1)
-    grad_y = xp.roll(field, -1, axis=-2) - xp.roll(field, 1, axis=-1)
+    grad_y = xp.roll(field, -1, axis=-2) - xp.roll(field, 1, axis=-2)
     value = xp.sum(
-        xp.sqrt(abs(grad_x * grad_x.conj()) + abs(grad_y * grad_y.conj()) + aleph)
+        xp.sqrt(abs(grad_x * grad_x.conj()) + abs(grad_y * grad_y.conj()) + aleph),
+        axis=axis,
     )
+    if axis is not None:
+        return value
     value = float(asNumpyArray(value))
     return value
 
 
+# metrics that can be evaluated on a whole stack of planes at once (see FocusStack)
+possible_metrics = {"TV": TV, "STD": std, "MIN_STD": min_std}
+
+
+class FocusStack(object):
+    """
+    Propagate one field to many planes and evaluate a focus metric on every plane.
+
+    The field is Fourier transformed once. The planes are then made by multiplying its spectrum with a stack of
+    angular spectrum transfer functions (see Operators.AngularSpectrumPropagator), in chunks of planes that fit
+    max_bytes, and the metrics 'TV', 'STD' and 'MIN_STD' are evaluated on a whole chunk at once.
+
+    Parameters
+    ----------
+    field: np.ndarray
+        the field that has to be propagated, (..., N, N)
+    dx: float
+        Pixel size of the field
+    wavelength: float
+        Wavelength to be propagated at
+    is_FT: bool
+        If the field has already been fourier transformed.
+    bandlimit: bool
+        If the evanescent waves should be removed.
+    max_bytes: int
+        Memory budget for one chunk of planes.
+    precision: str
+        'single' or 'double', the dtype of the transfer functions (see utils.precision)
+    """
+
+    # rough number of complex128 arrays of the size of the field needed per plane: kernel, propagated plane and
+    # the temporaries of the metric
+    arrays_per_plane = 6
+
+    def __init__(
+        self,
+        field,
+        dx,
+        wavelength,
+        is_FT=False,
+        bandlimit=False,
+        max_bytes=2**28,
+        precision="single",
+    ):
+        self.spectrum = field if is_FT else fft2c(field)
+        N = field.shape[-1]
+        self.propagator = get_asp_propagator(
+            wavelength, N, dx * N, isGpuArray(field), bandlimit, precision
+        )
+        self.max_bytes = max_bytes
+
+    @property
+    def chunk_size(self):
+        """Number of planes that are propagated at once."""
+        bytes_per_plane = self.arrays_per_plane * 16 * self.spectrum.size
+        return max(1, int(self.max_bytes // bytes_per_plane))
+
+    def chunks(self, dz):
+        """Yield (slice of dz, propagated planes) for the chunks of dz, the planes stacked along the first axis."""
+        dz = np.atleast_1d(asNumpyArray(dz))
+        for start in range(0, len(dz), self.chunk_size):
+            s = slice(start, start + self.chunk_size)
+            yield s, self.propagator.propagate(self.spectrum, dz[s], is_FT=True)
+
+    def propagate(self, dz):
+        """All the planes at once, (len(dz), ..., N, N)."""
+        xp = getArrayModule(self.spectrum)
+        return xp.concatenate([planes for _, planes in self.chunks(dz)])
+
+    def merit(
+        self,
+        dz,
+        metric=TV,
+        aleph=None,
+        ss=(slice(None, None), slice(None, None)),
+        intensity_only=False,
+        average_by_power=True,
+        return_propagated=False,
+    ):
+        """
+        Value of a metric function over a range of distances given by dz. See metric_at for the arguments.
+
+        Returns
+        -------
+        scores (np.ndarray, one per plane) and, if return_propagated, the (processed) planes as a numpy array.
+        """
+        if not callable(metric):
+            try:
+                metric = possible_metrics[metric.upper()]
+            except KeyError:
+                raise KeyError(
+                    f"Could not map {metric} to a metric. Allowed keywords are: {[k for k in possible_metrics.keys()]}"
+                )
+        kwargs = {} if aleph is None else {"aleph": aleph}
+        sy, sx = ss
+        scores = np.zeros(len(np.atleast_1d(dz)))
+        propagated = []
+        for s, planes in self.chunks(dz):
+            planes = planes[..., sy, sx]
+            xp = getArrayModule(planes)
+            axes = tuple(range(1, planes.ndim))
+            if intensity_only:
+                planes = abs(planes) ** 2
+            if average_by_power and not intensity_only:
+                planes = planes / abs(planes**2).mean(axis=axes, keepdims=True)
+            elif average_by_power and intensity_only:
+                planes = planes / planes.mean(axis=axes, keepdims=True)
+
+            if metric in possible_metrics.values():
+                scores[s] = asNumpyArray(metric(planes, axis=axes, **kwargs))
+            else:
+                scores[s] = [metric(plane, **kwargs) for plane in planes]
+            if return_propagated:
+                propagated.append(asNumpyArray(planes))
+        if return_propagated:
+            return scores, np.concatenate(propagated)
+        return scores
+
+
 def metric_at(
     object_estimate,
     dz,
@@ -86,7 +215,8 @@ def metric_at(
         savemem=True,
 ) -> Union[Tuple[np.ndarray, np.ndarray], np.ndarray]:
     """
-    Return the value of a metric function over a range of distances given by dz.
+    Return the value of a metric function over a range of distances given by dz. The planes are propagated and
+    evaluated in batches, see FocusStack.
 
     Note on savemem:
         When savemem == False, the entire field is propagated and only afterwards a slice is extracted.
@@ -122,58 +252,24 @@ def metric_at(
     -------
 
     """
-    possible_metrics = {"TV": TV, "STD": std, "MIN_STD": min_std}
-    if not isinstance(type(metric), type(callable)):
-        try:
-            metric = possible_metrics[metric.upper()]
-        except KeyError:
-            raise KeyError(
-                f"Could not map {metric} to a metric. Allowed keywords are: {[k for k in possible_metrics.keys()]}"
-            )
-
     if savemem:
-        # SY and sx are extracting after propagation, sy1 and sx1 are extracting before
-        sy, sx = slice(None, None), slice(None, None)
-        sy1, sx1 = ss
+        # only propagate the region of interest
+        field = object_estimate[..., ss[0], ss[1]]
+        ss = (slice(None, None), slice(None, None))
     else:
-        sy, sx = ss
-        sy1, sx1 = slice(None, None), slice(None, None)
-
-    xp = getArrayModule(object_estimate)
-    if isGpuArray(dz):
-        dz = dz.get()
+        field = object_estimate
 
-    OE_ff = fft2c(object_estimate[...,sy1,sx1])
-    if intensity_only:
-        op = lambda x: abs(x).real ** 2
-    else:
-        op = lambda x: x
-
-    scores = []
-    OEs = []
-    for z in dz:
-        OE = op(
-            aspw(
-                xp.squeeze(OE_ff),
-                z=float(z),
-                wavelength=float(wavelength),
-                L=dx * object_estimate.shape[-1],
-                bandlimit=False,
-                is_FT=True,
-            )[0][sy, sx]
-        )  # [...,sy,sx])
-        if average_by_power and not intensity_only:
-            OE = OE / abs(OE**2).mean()
-        elif average_by_power and intensity_only:
-            OE = OE / OE.mean()
-
-        score = metric(OE)
-        OEs.append(asNumpyArray(OE))
-        scores.append(score)
-    if return_propagated:
-        return np.array(scores), np.array(OEs)
-    else:
-        return np.array(scores)
+    stack = FocusStack(
+        getArrayModule(field).squeeze(field), dx, wavelength, bandlimit=False
+    )
+    return stack.merit(
+        dz,
+        metric=metric,
+        ss=ss,
+        intensity_only=intensity_only,
+        average_by_power=average_by_power,
+        return_propagated=return_propagated,
+    )
 
 
 def divergence(f):
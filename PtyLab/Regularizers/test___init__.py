@@ -3,7 +3,8 @@ from unittest import TestCase
 import numpy as np
 from numpy.testing import assert_allclose
 
-from PtyLab.Regularizers import divergence, grad_TV
+from PtyLab.Regularizers import divergence, grad_TV, FocusStack, TV
+from PtyLab.Operators.Operators import aspw
 
 
 class Test(TestCase):
@@ -44,3 +45,16 @@ class Test(TestCase):
         print(t1 - t0)
         assert_allclose(TV_update, TV_update_2)
 
+    def test_focus_stack(self):
+        field = self.object[0, 0, 0, 0, :64, :64]
+        dx, wavelength = 1e-6, 600e-9
+        dz = np.linspace(-1, 1, 5) * 20e-6
+        # a tiny budget, so that the planes are evaluated in several chunks
+        stack = FocusStack(field, dx, wavelength, max_bytes=1)
+        merit, planes = stack.merit(
+            dz, metric="TV", average_by_power=False, return_propagated=True
+        )
+        for z, score, plane in zip(dz, merit, planes):
+            plane_ref, _ = aspw(field, z, wavelength, dx * 64, bandlimit=False, is_FT=False)
+            assert_allclose(plane, plane_ref, atol=1e-12)
+            assert_allclose(score, TV(plane_ref))
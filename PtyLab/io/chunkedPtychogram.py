@@ -0,0 +1,160 @@
+"""
+Chunked, compressed layout of the ptychogram in an HDF5 file.
+
+convertToChunked rewrites an input file such that every frame of the ptychogram is one chunk, stored with the
+shuffle filter and a lossless codec (deflate at a low level by default, which decodes fast), optionally quantised to
+uint16 with the scale stored as an attribute. The frame statistics energyAtPos and maxProbePower are stored as
+datasets next to it, so that loading the file does not need a pass over all the frames.
+
+ChunkedFrameReader reads such a dataset frame by frame: the compressed chunks are read directly from the file and
+decompressed on a thread pool (zlib releases the GIL), which is what LazyPtychogram uses for these files.
+"""
+import logging
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import h5py
+import numpy as np
+
+logger = logging.getLogger("chunkedPtychogram")
+
+# attribute of the ptychogram dataset that marks the layout
+layoutAttribute = "layout"
+layoutName = "frameChunks"
+# datasets that are rewritten by convertToChunked
+_frameStatistics = ["energyAtPos", "maxProbePower"]
+
+
+def isChunked(dataset):
+    """True if dataset (h5py) was written by convertToChunked."""
+    return dataset.attrs.get(layoutAttribute) in (layoutName, layoutName.encode())
+
+
+def convertToChunked(
+    inputFilename,
+    outputFilename,
+    quantize=False,
+    compression="gzip",
+    compressionLevel=1,
+    blockBytes=2**28,
+):
+    """
+    Copy inputFilename to outputFilename with the ptychogram in the chunked layout.
+    :param quantize: store the ptychogram as uint16, with scale = max / 65535 as attribute. Negative values are
+                     clipped to 0
+    :param compression: 'gzip' (decompressed in parallel by ChunkedFrameReader) or 'lzf'
+    :param compressionLevel: gzip level, low levels are faster to compress and decompress
+    :param blockBytes: memory used to convert a block of frames at once
+    """
+    with h5py.File(str(inputFilename), "r") as source, h5py.File(
+        str(outputFilename), "w"
+    ) as target:
+        for name in source:
+            if name not in ["ptychogram"] + _frameStatistics:
+                source.copy(source[name], target, name)
+        ptychogram = source["ptychogram"]
+        numFrames, frameShape = ptychogram.shape[0], ptychogram.shape[1:]
+        step = max(blockBytes // max(ptychogram[0].nbytes, 1), 1)
+        blocks = [slice(start, start + step) for start in range(0, numFrames, step)]
+
+        scale = None
+        dtype = ptychogram.dtype
+        if quantize:
+            minimum, maximum = 0.0, 0.0
+            for block in blocks:
+                frames = ptychogram[block]
+                minimum = min(minimum, float(np.min(frames)))
+                maximum = max(maximum, float(np.max(frames)))
+            if minimum < 0:
+                logger.warning("Negative values are clipped to 0 by the uint16 quantisation")
+            scale = maximum / np.iinfo(np.uint16).max if maximum > 0 else 1.0
+            dtype = np.uint16
+
+        dataset = target.create_dataset(
+            "ptychogram",
+            shape=ptychogram.shape,
+            dtype=dtype,
+            chunks=(1,) + frameShape,
+            shuffle=True,
+            compression=compression,
+            compression_opts=compressionLevel if compression == "gzip" else None,
+        )
+        dataset.attrs[layoutAttribute] = layoutName
+        if scale is not None:
+            dataset.attrs["scale"] = scale
+
+        energyAtPos = np.empty(numFrames)
+        frameSums = np.empty(numFrames)
+        for block in blocks:
+            frames = ptychogram[block]
+            if scale is not None:
+                frames = np.round(np.clip(frames, 0, None) / scale).astype(np.uint16)
+                dataset[block] = frames
+                # statistics of the data as it will be read
+                frames = frames * np.float32(scale)
+            else:
+                dataset[block] = frames
+            energyAtPos[block] = np.sum(abs(frames), (-1, -2))
+            frameSums[block] = np.sum(frames, (-1, -2))
+        target.create_dataset("energyAtPos", data=energyAtPos)
+        target.create_dataset("maxProbePower", data=np.sqrt(np.max(frameSums)))
+
+
+def _unshuffle(data, itemsize):
+    """Undo the HDF5 shuffle filter: the bytes are stored grouped by their position in the element."""
+    data = np.frombuffer(data, dtype=np.uint8)
+    return data.reshape(itemsize, -1).T.tobytes()
+
+
+class ChunkedFrameReader(object):
+    """
+    Frames of a dataset written by convertToChunked, indexed like the dataset (frames along the first axis).
+    :param dataset: h5py dataset
+    :param workers: number of decompression threads, None uses all cores
+    """
+
+    def __init__(self, dataset, workers=None):
+        self.dataset = dataset
+        self.shape = dataset.shape
+        self.scale = dataset.attrs.get("scale")
+        self.dtype = np.dtype(np.float32) if self.scale is not None else dataset.dtype
+        createPlist = dataset.id.get_create_plist()
+        self.filters = [createPlist.get_filter(i)[0] for i in range(createPlist.get_nfilters())]
+        # chunks that only use shuffle and deflate are decoded here, in parallel. Others are read by h5py
+        self.direct = dataset.chunks == (1,) + self.shape[1:] and set(self.filters) <= {
+            h5py.h5z.FILTER_SHUFFLE,
+            h5py.h5z.FILTER_DEFLATE,
+        }
+        self._pool = ThreadPoolExecutor(
+            max_workers=workers or os.cpu_count(), thread_name_prefix="ChunkedFrameReader"
+        )
+
+    def _decode(self, filterMask, data):
+        for i in reversed(range(len(self.filters))):
+            if filterMask & (1 << i):
+                # the filter was skipped for this chunk
+                continue
+            if self.filters[i] == h5py.h5z.FILTER_DEFLATE:
+                data = zlib.decompress(data)
+            else:
+                data = _unshuffle(data, self.dataset.dtype.itemsize)
+        return np.frombuffer(data, dtype=self.dataset.dtype).reshape(self.shape[1:])
+
+    def frame(self, index):
+        if self.direct:
+            frame = self._decode(*self.dataset.id.read_direct_chunk((index,) + (0,) * (len(self.shape) - 1)))
+        else:
+            frame = self.dataset[index]
+        if self.scale is not None:
+            return frame * np.float32(self.scale)
+        return np.array(frame)
+
+    def __getitem__(self, key):
+        indices = np.arange(self.shape[0])[key]
+        if np.ndim(indices) == 0:
+            return self.frame(int(indices))
+        frames = list(self._pool.map(self.frame, [int(index) for index in indices]))
+        if not frames:
+            return np.empty((0,) + self.shape[1:], dtype=self.dtype)
+        return np.stack(frames)
@@ -0,0 +1,77 @@
+"""
+Background reading of the frames of a LazyPtychogram in the order in which the position loop visits them.
+
+The engine starts the prefetcher with the position order of the iteration (setPositionOrder, getPositionBatches).
+A bounded thread pool then reads (decompresses, converts and shifts, see LazyPtychogram.transforms) the next frames,
+while the engine works on the current one. intensityProjection takes the measured intensities from get.
+"""
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from PtyLab.utils.gpuUtils import asCupyArray
+
+
+class FramePrefetcher(object):
+    """
+    :param ptychogram: LazyPtychogram
+    :param depth: number of frames that are read ahead
+    :param workers: number of reading threads
+    """
+
+    def __init__(self, ptychogram, depth=8, workers=2):
+        self.ptychogram = ptychogram
+        self.depth = depth
+        self._pool = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="FramePrefetcher"
+        )
+        # positionIndex -> future of the frame, in the order of the position loop
+        self._pending = OrderedDict()
+        self._order = iter(())
+
+    def start(self, order):
+        """Drop the frames that are read ahead, and start reading the frames of order (position indices)."""
+        self.cancel()
+        self._order = iter([int(index) for index in np.ravel(order)])
+        self._fill()
+
+    def cancel(self):
+        for future in self._pending.values():
+            future.cancel()
+        self._pending.clear()
+        self._order = iter(())
+
+    def _fill(self):
+        while len(self._pending) < self.depth:
+            index = next(self._order, None)
+            if index is None:
+                return
+            if index not in self._pending:
+                self._pending[index] = self._pool.submit(self.ptychogram.frames, [index])
+
+    def _frame(self, index):
+        if index in self._pending:
+            # positions before index were skipped by the loop, they are not needed anymore
+            while True:
+                pendingIndex, future = self._pending.popitem(last=False)
+                if pendingIndex == index:
+                    break
+                future.cancel()
+            frame = future.result()[0]
+        else:
+            frame = self.ptychogram.frames([index])[0]
+        self._fill()
+        return frame
+
+    def get(self, positionIndex):
+        """The frame(s) positionIndex (an index or an array of indices), as ptychogram[positionIndex] would."""
+        if np.ndim(positionIndex) == 0:
+            frames = self._frame(int(positionIndex))
+        else:
+            frames = np.stack([self._frame(int(index)) for index in np.ravel(positionIndex)])
+        return asCupyArray(frames) if self.ptychogram.gpu else frames
+
+    def close(self):
+        self.cancel()
+        self._pool.shutdown(wait=False)
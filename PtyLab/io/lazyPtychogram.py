@@ -0,0 +1,286 @@
+"""
+Lazy ptychogram: the frames of a (large) ptychogram are read from an open HDF5 dataset (or a memmap) when they are
+indexed, and kept in an LRU cache with a budget in bytes.
+
+LazyPtychogram behaves like the (numFrames, Nd, Nd) array that the engines expect: ptychogram[positionIndex] and
+ptychogram[positionIndices] return numpy (or, on the GPU, cupy) arrays, and shape, len and dtype are available.
+The whole-stack operations that PtyLab applies to the ptychogram (orientation flips and transposes, fftshift and
+ifftshift over the detector axes, sums and means) are supported through the numpy array function protocol, and are
+applied to every frame as it is read instead of making a copy of the whole stack. Any other numpy function raises a
+TypeError; np.asarray(ptychogram) reads all the frames.
+"""
+import threading
+from collections import OrderedDict
+from functools import partial
+
+import h5py
+import numpy as np
+
+from PtyLab.io.chunkedPtychogram import ChunkedFrameReader, isChunked
+from PtyLab.utils.gpuUtils import asCupyArray
+
+# frames read at once when streaming over the whole ptychogram
+streamBytes = 2**27
+_frameAxes = [(-1, -2), (-2, -1), (1, 2), (2, 1)]
+
+
+class LazyPtychogram(object):
+    """
+    :param source: (numFrames, Ny, Nx) h5py dataset or memmap
+    :param frameIndices: frames of source that make up this ptychogram (default all), in this order
+    :param cacheBytes: budget of the frame cache in bytes
+    :param transforms: functions that are applied to every stack of frames read from source
+    """
+
+    def __init__(self, source, frameIndices=None, cacheBytes=2**30, transforms=()):
+        self.source = source
+        if frameIndices is None:
+            frameIndices = np.arange(source.shape[0])
+        self.frameIndices = np.asarray(frameIndices, dtype=np.int64)
+        self.cacheBytes = cacheBytes
+        self.transforms = tuple(transforms)
+        # return the frames as cupy arrays, see ExperimentalData._move_data_to_gpu
+        self.gpu = False
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.RLock()
+        # shape and dtype of the transformed frames
+        empty = self._transform(np.empty((0,) + source.shape[1:], dtype=source.dtype))
+        self.frameShape = empty.shape[1:]
+        self.dtype = empty.dtype
+
+    @classmethod
+    def fromHdf5(cls, filename, node="ptychogram", frameIndices=None, cacheBytes=2**30, workers=None):
+        """
+        Open filename (read-only) and use the dataset called node. Datasets in the chunked layout (see
+        io.chunkedPtychogram) are decompressed on workers threads.
+        """
+        archive = h5py.File(str(filename), "r")
+        source = archive[node]
+        if isChunked(source):
+            source = ChunkedFrameReader(source, workers)
+        ptychogram = cls(source, frameIndices, cacheBytes)
+        # keep the file open as long as the ptychogram exists
+        ptychogram.archive = archive
+        return ptychogram
+
+    # array interface
+
+    @property
+    def shape(self):
+        return (len(self.frameIndices),) + tuple(self.frameShape)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def nbytes(self):
+        """Bytes held in memory (by the frame cache), not the size of the whole ptychogram."""
+        return self._bytes
+
+    def __len__(self):
+        return len(self.frameIndices)
+
+    def __repr__(self):
+        return (
+            f"LazyPtychogram(shape={self.shape}, dtype={self.dtype}, "
+            f"cache={self._bytes / 2**20:.1f}/{self.cacheBytes / 2**20:.1f} MB)"
+        )
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            if not key or key[0] is Ellipsis:
+                return np.asarray(self)[key]
+            frames = self[key[0]]
+            rest = key[1:] if np.ndim(frames) == 2 else (slice(None),) + key[1:]
+            return frames[rest]
+        if isinstance(key, (int, np.integer)):
+            if not -len(self) <= key < len(self):
+                raise IndexError(f"index {key} is out of bounds for {len(self)} frames")
+            frames = self.frames([int(key) % len(self)])[0]
+        else:
+            frames = self.frames(np.arange(len(self))[key].reshape(-1))
+        return asCupyArray(frames) if self.gpu else frames
+
+    def __array__(self, dtype=None):
+        out = np.empty(self.shape, dtype=self.dtype if dtype is None else dtype)
+        for start, stack in self._stream():
+            out[start : start + len(stack)] = stack
+        return out
+
+    def __abs__(self):
+        return self.transformed(np.abs)
+
+    def __array_function__(self, func, types, args, kwargs):
+        if func not in _handledFunctions:
+            return NotImplemented
+        return _handledFunctions[func](*args, **kwargs)
+
+    def sum(self, axis=None):
+        return self._reduce(axis, mean=False)
+
+    def mean(self, axis=None):
+        return self._reduce(axis, mean=True)
+
+    # lazy views
+
+    def transformed(self, function):
+        """The same frames, with function applied to every stack of frames that is read (e.g. np.fliplr)."""
+        return self._view(self.frameIndices, self.transforms + (function,))
+
+    def subset(self, key):
+        """The frames selected by key (an index array, mask or slice), without reading them."""
+        return self._view(self.frameIndices[key], self.transforms)
+
+    def _view(self, frameIndices, transforms):
+        view = type(self)(self.source, frameIndices, self.cacheBytes, transforms)
+        view.gpu = self.gpu
+        if hasattr(self, "archive"):
+            view.archive = self.archive
+        return view
+
+    # reading
+
+    def _transform(self, stack):
+        for function in self.transforms:
+            stack = function(stack)
+        return stack
+
+    def _read(self, indices):
+        """Read frames indices of this ptychogram from source, in the given order."""
+        fileIndices = self.frameIndices[indices]
+        unique, inverse = np.unique(fileIndices, return_inverse=True)
+        if unique[-1] - unique[0] + 1 == len(unique):
+            # contiguous frames are read as one slice
+            stack = self.source[unique[0] : unique[-1] + 1]
+        else:
+            # h5py needs increasing indices
+            stack = self.source[unique]
+        return self._transform(np.asarray(stack)[inverse])
+
+    def frames(self, indices):
+        """
+        Frames indices as a numpy array (also when the ptychogram is on the GPU), from the cache where possible.
+        Can be called from several threads, the frames that are not cached are read in parallel.
+        """
+        with self._lock:
+            frames = [self._cache.get(index) for index in indices]
+            missing = [i for i, frame in enumerate(frames) if frame is None]
+            self.hits += len(indices) - len(missing)
+            self.misses += len(missing)
+            for index in indices:
+                if index in self._cache:
+                    self._cache.move_to_end(index)
+        if missing:
+            stack = self._read([indices[i] for i in missing])
+            with self._lock:
+                for i, frame in zip(missing, stack):
+                    frames[i] = np.ascontiguousarray(frame)
+                    self._store(indices[i], frames[i])
+        return np.stack(frames)
+
+    def _store(self, index, frame):
+        if frame.nbytes > self.cacheBytes or index in self._cache:
+            return
+        self._cache[index] = frame
+        self._bytes += frame.nbytes
+        while self._bytes > self.cacheBytes:
+            _, evicted = self._cache.popitem(last=False)
+            self._bytes -= evicted.nbytes
+
+    def clearCache(self):
+        with self._lock:
+            self._cache.clear()
+            self._bytes = 0
+
+    def _stream(self):
+        """Yield (first index, stack of frames) over the whole ptychogram, without filling the cache."""
+        frameBytes = max(int(np.prod(self.frameShape)) * self.dtype.itemsize, 1)
+        step = max(streamBytes // frameBytes, 1)
+        for start in range(0, len(self), step):
+            yield start, self._read(np.arange(start, min(start + step, len(self))))
+
+    def frameReduce(self, *functions):
+        """
+        Apply every function to each stack of frames in one pass over the ptychogram, e.g.
+        frameReduce(lambda stack: np.sum(stack, (-1, -2))).
+        :return: one array per function, the results concatenated along the frame axis
+        """
+        results = [[] for _ in functions]
+        for _, stack in self._stream():
+            for result, function in zip(results, functions):
+                result.append(function(stack))
+        return [np.concatenate(result) for result in results]
+
+    def _reduce(self, axis, mean):
+        if axis is None or axis == 0:
+            total = 0
+            for _, stack in self._stream():
+                total = total + stack.sum(axis=axis)
+            return total / (len(self) if axis == 0 else self.size) if mean else total
+        if tuple(axis) in _frameAxes:
+            reduction = np.mean if mean else np.sum
+            return self.frameReduce(partial(reduction, axis=(-1, -2)))[0]
+        raise TypeError(f"LazyPtychogram can not be reduced over axis {axis}")
+
+
+_handledFunctions = {}
+
+
+def _implements(numpyFunction):
+    def decorator(function):
+        _handledFunctions[numpyFunction] = function
+        return function
+
+    return decorator
+
+
+@_implements(np.fliplr)
+def _fliplr(ptychogram):
+    return ptychogram.transformed(np.fliplr)
+
+
+@_implements(np.flipud)
+def _flipud(ptychogram):
+    # flips the frame order of a 3D stack
+    return ptychogram.subset(slice(None, None, -1))
+
+
+@_implements(np.transpose)
+def _transpose(ptychogram, axes=None):
+    if axes is None or tuple(axes) != (0, 2, 1):
+        raise TypeError("LazyPtychogram can only be transposed with axes (0, 2, 1)")
+    return ptychogram.transformed(partial(np.transpose, axes=(0, 2, 1)))
+
+
+@_implements(np.ascontiguousarray)
+def _ascontiguousarray(ptychogram, dtype=None):
+    # frames are contiguous when they are read
+    return ptychogram
+
+
+def _shift(function, ptychogram, axes=None):
+    if axes is None or tuple(axes) not in _frameAxes:
+        raise TypeError(f"LazyPtychogram can only be shifted over the detector axes, not {axes}")
+    return ptychogram.transformed(partial(function, axes=(-1, -2)))
+
+
+_implements(np.fft.fftshift)(partial(_shift, np.fft.fftshift))
+_implements(np.fft.ifftshift)(partial(_shift, np.fft.ifftshift))
+
+
+@_implements(np.sum)
+def _sum(ptychogram, axis=None):
+    return ptychogram.sum(axis)
+
+
+@_implements(np.mean)
+def _mean(ptychogram, axis=None):
+    return ptychogram.mean(axis)
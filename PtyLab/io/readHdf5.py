@@ -4,6 +4,8 @@ import numpy as np
 import logging
 from scipy.io import loadmat
 import h5py
+from PtyLab.io.lazyPtychogram import LazyPtychogram
+from PtyLab.io.chunkedPtychogram import isChunked
 
 logger = logging.getLogger("readHdf5")
 
@@ -23,13 +25,23 @@ def scalify(l):
         return l
 
 
-def loadInputData(filename: Path, requiredFields, optionalFields):
+def loadInputData(
+    filename: Path,
+    requiredFields,
+    optionalFields,
+    lazy=False,
+    frameIndices=None,
+    frameCacheBytes=2**30,
+):
     """
     Load all values from an hdf5 file into a dictionary, but only with the required fields
     :param filename: the .hdf5 file that has to be loaded. If it's a .mat file it will attempt to load it
     :param python_order:
             Weather to read in the files in a way that is common in python, aka for a list of images the first index
              is the image and not the pixel.
+    :param lazy: return the ptychogram as a LazyPtychogram, that reads the frames when they are used
+    :param frameIndices: only load these frames (and encoder positions)
+    :param frameCacheBytes: size of the frame cache of the LazyPtychogram in bytes
     :return:
     """
     filename = Path(filename)
@@ -46,11 +58,19 @@ def loadInputData(filename: Path, requiredFields, optionalFields):
 
     # start h5 loading, but check data fields first (defined above)
     dataset = dict()
+    # ptychograms in the chunked layout (see io.chunkedPtychogram) are read frame by frame, also when not lazy
+    with h5py.File(str(filename), "r") as archive:
+        readFrames = lazy or frameIndices is not None or (
+            "ptychogram" in archive and isChunked(archive["ptychogram"])
+        )
     try:
         with tables.open_file(str(filename), mode="r") as hdf5File:
 
             # load the required fields
             for key in requiredFields:
+                if key == "ptychogram" and readFrames:
+                    # read by LazyPtychogram below
+                    continue
                 value = hdf5File.root[key].read()
                 dataset[key] = scalify(value)
 
@@ -74,6 +94,17 @@ def loadInputData(filename: Path, requiredFields, optionalFields):
             dataset['encoder'] -= dataset['encoder'].mean(axis=0, keepdims=True)
             print(dataset['encoder'].shape, dataset['encoder'].mean(axis=0))
             # dataset['encoder'] *= -1
+    if "ptychogram" in requiredFields and readFrames:
+        ptychogram = LazyPtychogram.fromHdf5(
+            filename, "ptychogram", frameIndices, frameCacheBytes
+        )
+        dataset["ptychogram"] = ptychogram if lazy else np.asarray(ptychogram)
+    if frameIndices is not None:
+        dataset["encoder"] = dataset["encoder"][frameIndices]
+        if dataset.get("energyAtPos") is not None:
+            dataset["energyAtPos"] = dataset["energyAtPos"][frameIndices]
+        # the stored value is the maximum over all the frames
+        dataset["maxProbePower"] = None
     # dirty hack for now
 
     # upsample
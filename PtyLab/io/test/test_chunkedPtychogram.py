@@ -0,0 +1,86 @@
+import os
+import tempfile
+import unittest
+from unittest import TestCase
+import h5py
+import numpy as np
+from PtyLab.ExperimentalData.ExperimentalData import ExperimentalData
+from PtyLab.io.chunkedPtychogram import ChunkedFrameReader, convertToChunked, isChunked
+from PtyLab.io.lazyPtychogram import LazyPtychogram
+
+
+class TestChunkedPtychogram(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.input = os.path.join(self.directory.name, "input.hdf5")
+        self.output = os.path.join(self.directory.name, "output.hdf5")
+        self.ptychogram = (100 * np.random.rand(9, 16, 12)).astype(np.float32)
+        with h5py.File(self.input, "w") as archive:
+            archive.create_dataset("ptychogram", data=self.ptychogram)
+            archive.create_dataset("wavelength", data=632.8e-9)
+            archive.create_dataset("encoder", data=np.random.rand(9, 2) * 1e-4)
+            archive.create_dataset("dxd", data=10e-6)
+            archive.create_dataset("zo", data=0.05)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_lossless(self):
+        """
+        The chunked ptychogram is decompressed in parallel to the original, and the frame statistics are stored.
+        :return:
+        """
+        convertToChunked(self.input, self.output)
+        with h5py.File(self.output, "r") as archive:
+            self.assertTrue(isChunked(archive["ptychogram"]))
+            self.assertEqual(archive["ptychogram"].chunks, (1, 16, 12))
+            self.assertEqual(archive["wavelength"][()], 632.8e-9)
+            np.testing.assert_allclose(
+                archive["energyAtPos"][()], np.sum(self.ptychogram, (-1, -2)), rtol=1e-6
+            )
+            reader = ChunkedFrameReader(archive["ptychogram"], workers=3)
+            self.assertTrue(reader.direct)
+            np.testing.assert_array_equal(reader[[0, 4, 8]], self.ptychogram[[0, 4, 8]])
+            np.testing.assert_array_equal(reader[2:5], self.ptychogram[2:5])
+
+        ptychogram = LazyPtychogram.fromHdf5(self.output)
+        np.testing.assert_array_equal(np.asarray(ptychogram), self.ptychogram)
+
+    def test_quantize(self):
+        """
+        uint16 quantisation is within half a quantisation step of the original.
+        :return:
+        """
+        convertToChunked(self.input, self.output, quantize=True)
+        with h5py.File(self.output, "r") as archive:
+            self.assertEqual(archive["ptychogram"].dtype, np.uint16)
+            scale = archive["ptychogram"].attrs["scale"]
+            frames = ChunkedFrameReader(archive["ptychogram"])[:]
+        self.assertEqual(frames.dtype, np.float32)
+        np.testing.assert_allclose(frames, self.ptychogram, atol=0.51 * scale)
+
+    def test_frameStatistics(self):
+        """
+        The stored frame statistics are used when the file is loaded, and recomputed once the frames change.
+        :return:
+        """
+        convertToChunked(self.input, self.output)
+        experimentalData = ExperimentalData(self.output)
+        np.testing.assert_allclose(
+            experimentalData.energyAtPos, np.sum(self.ptychogram, (-1, -2)), rtol=1e-6
+        )
+        experimentalData.reduce_positions(2, 6)
+        experimentalData._setData()
+        self.assertEqual(experimentalData.energyAtPos.shape[0], experimentalData.numFrames)
+        np.testing.assert_allclose(
+            experimentalData.energyAtPos, np.sum(self.ptychogram[2:6], (-1, -2)), rtol=1e-6
+        )
+        np.testing.assert_allclose(
+            experimentalData.maxProbePower,
+            np.sqrt(np.max(np.sum(self.ptychogram[2:6], (-1, -2)))),
+            rtol=1e-6,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
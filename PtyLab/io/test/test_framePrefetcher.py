@@ -0,0 +1,31 @@
+import unittest
+from unittest import TestCase
+import numpy as np
+from PtyLab.io.framePrefetcher import FramePrefetcher
+from PtyLab.io.lazyPtychogram import LazyPtychogram
+
+
+class TestFramePrefetcher(TestCase):
+    def test_get(self):
+        """
+        Frames come out as ptychogram[positionIndex], also when the loop skips positions or asks for a batch.
+        :return:
+        """
+        data = np.random.rand(20, 4, 4)
+        ptychogram = LazyPtychogram(data, cacheBytes=0)
+        prefetcher = FramePrefetcher(ptychogram, depth=3, workers=2)
+        order = np.random.permutation(20)
+        prefetcher.start(order)
+        for index in order[:5]:
+            np.testing.assert_array_equal(prefetcher.get(index), data[index])
+        # skip a few positions
+        np.testing.assert_array_equal(prefetcher.get(order[9]), data[order[9]])
+        np.testing.assert_array_equal(prefetcher.get(order[10:13]), data[order[10:13]])
+        # not in the order
+        prefetcher.start(order[:2])
+        np.testing.assert_array_equal(prefetcher.get(order[5]), data[order[5]])
+        prefetcher.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import tempfile
+import unittest
+from unittest import TestCase
+import h5py
+import numpy as np
+from PtyLab.io.lazyPtychogram import LazyPtychogram
+
+
+class TestLazyPtychogram(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "ptychogram.hdf5")
+        self.ptychogram = np.random.rand(12, 8, 6).astype(np.float32)
+        with h5py.File(self.filename, "w") as archive:
+            archive.create_dataset("ptychogram", data=self.ptychogram)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_indexing(self):
+        """
+        Frames are read in the order of frameIndices, and kept in a cache that does not exceed its budget.
+        :return:
+        """
+        frameIndices = [7, 2, 2, 10, 0]
+        frameBytes = self.ptychogram[0].nbytes
+        ptychogram = LazyPtychogram.fromHdf5(
+            self.filename, frameIndices=frameIndices, cacheBytes=2 * frameBytes
+        )
+        reference = self.ptychogram[frameIndices]
+        self.assertEqual(ptychogram.shape, reference.shape)
+        np.testing.assert_array_equal(ptychogram[3], reference[3])
+        np.testing.assert_array_equal(ptychogram[-1], reference[-1])
+        np.testing.assert_array_equal(ptychogram[[4, 0, 1]], reference[[4, 0, 1]])
+        np.testing.assert_array_equal(ptychogram[1:4, 2:5], reference[1:4, 2:5])
+        np.testing.assert_array_equal(np.asarray(ptychogram), reference)
+        self.assertLessEqual(ptychogram.nbytes, 2 * frameBytes)
+
+        ptychogram[2]
+        hits = ptychogram.hits
+        ptychogram[2]
+        self.assertEqual(ptychogram.hits, hits + 1)
+        with self.assertRaises(IndexError):
+            ptychogram[5]
+
+    def test_array_functions(self):
+        """
+        Orientation, fftshift and reductions give the same result as on the loaded array.
+        :return:
+        """
+        ptychogram = LazyPtychogram.fromHdf5(self.filename)
+        reference = self.ptychogram
+        for function in [
+            np.fliplr,
+            np.flipud,
+            lambda a: np.transpose(a, (0, 2, 1)),
+            lambda a: np.fft.ifftshift(a, axes=(-1, -2)),
+        ]:
+            ptychogram, reference = function(ptychogram), function(reference)
+            self.assertIsInstance(ptychogram, LazyPtychogram)
+            np.testing.assert_array_equal(ptychogram[[1, 5]], reference[[1, 5]])
+
+        np.testing.assert_allclose(np.sum(ptychogram, (-1, -2)), np.sum(reference, (-1, -2)), rtol=1e-6)
+        np.testing.assert_allclose(np.mean(ptychogram, 0), np.mean(reference, 0), rtol=1e-6)
+        np.testing.assert_array_equal(ptychogram.subset(slice(2, 4))[0], reference[2])
+        with self.assertRaises(TypeError):
+            np.fft.fftshift(ptychogram)
+
+
+if __name__ == "__main__":
+    unittest.main()
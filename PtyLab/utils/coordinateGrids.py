@@ -0,0 +1,40 @@
+import numpy as np
+
+
+class CoordinateGrids(object):
+    """
+    Memoised 2D coordinate grids (as used for the Xp, Yp, Xd, Yd, Xo and Yo properties).
+
+    The grids are built lazily, stored in single precision and keyed on (N, pixel size), so repeated
+    property access does not allocate a new N x N meshgrid every time. The returned arrays are read-only,
+    as they are shared between all the callers. Call invalidate() when the pixel sizes change (e.g. zPIE
+    changing dxp), otherwise the grids of the old sampling are kept until then.
+    """
+
+    def __init__(self, dtype=np.float32):
+        self.dtype = dtype
+        self._grids = {}
+
+    @staticmethod
+    def coordinates(N, dx):
+        """1D coordinates, same convention as the x* properties."""
+        return np.linspace(-N / 2, N / 2, int(N)) * dx
+
+    def get(self, N, dx):
+        """
+        :param N: number of pixels
+        :param dx: pixel size
+        :return: X, Y meshgrid of the 1D coordinates
+        """
+        key = (int(N), float(dx))
+        if key not in self._grids:
+            x = self.coordinates(N, dx).astype(self.dtype)
+            X, Y = np.meshgrid(x, x)
+            X.flags.writeable = False
+            Y.flags.writeable = False
+            self._grids[key] = (X, Y)
+        return self._grids[key]
+
+    def invalidate(self):
+        """Drop all the cached grids."""
+        self._grids.clear()
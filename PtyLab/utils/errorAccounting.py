@@ -0,0 +1,35 @@
+import numpy as np
+from PtyLab.utils.gpuUtils import asNumpyArray
+
+
+class ResidualReservoir(object):
+    """
+    Bounded store of full detector residual maps |Imeasured - Iestimated|, for diagnostics.
+
+    The error metric itself only needs one scalar per frame (see BaseEngine.getRMSD), so the residual maps are not
+    kept for every frame. Instead, a random subset of at most `size` positions is drawn once, and the most recent
+    residual map of these positions is kept (on the CPU, in single precision).
+    """
+
+    def __init__(self, size, numFrames):
+        size = int(min(max(size, 0), numFrames))
+        # own generator, so that drawing the subset does not change the global random position order
+        self.positionIndices = np.sort(
+            np.random.default_rng().choice(numFrames, size=size, replace=False)
+        )
+        self._selected = set(self.positionIndices.tolist())
+        self.maps = {}
+
+    def push(self, positionIndex, residual):
+        """
+        Store the residual map(s) of the positions that are part of the reservoir.
+        :param positionIndex: index of the scan position, or an array of indices for a batch
+        :param residual: residual map(s), shape (Nd, Nd) or (len(positionIndex), Nd, Nd)
+        """
+        if not self._selected:
+            return
+        positionIndices = np.atleast_1d(positionIndex)
+        residual = residual.reshape((-1,) + residual.shape[-2:])
+        for index, residualMap in zip(positionIndices.tolist(), residual):
+            if index in self._selected:
+                self.maps[index] = asNumpyArray(residualMap).astype(np.float32)
@@ -0,0 +1,179 @@
+"""
+Pluggable FFT backends for fft2c / ifft2c on the CPU.
+
+GPU (cupy) arrays always use cupy's FFT, the backend only applies to numpy arrays. The backend is selected with
+setFFTBackend (BaseEngine does that from params.fftBackend and params.fftWorkers), or with the environment variable
+PTYLAB_FFT_BACKEND ('numpy', 'scipy' or 'pyfftw'). Additional backends can be added with registerFFTBackend.
+
+All backends compute the orthonormal 2D transform over the last two axes, and keep the precision of complex input
+(a complex64 field gives a complex64 transform).
+"""
+import logging
+import os
+import threading
+import numpy as np
+
+try:
+    import scipy.fft as scipy_fft
+except ImportError:
+    scipy_fft = None
+
+try:
+    import pyfftw
+except ImportError:
+    pyfftw = None
+
+logger = logging.getLogger("fftBackends")
+
+
+def _complexDtype(field):
+    """complex dtype that keeps the precision of field, complex128 for anything that is not complex64"""
+    return np.complex64 if field.dtype == np.complex64 else np.complex128
+
+
+class NumpyFFTBackend(object):
+    """numpy.fft, single-threaded, no plan reuse. Always available."""
+
+    name = "numpy"
+
+    def __init__(self, workers=None):
+        # numpy does not support threads, workers is ignored
+        self.workers = 1
+
+    # transforming the last axis last gives a C-contiguous result, which makes everything that follows faster.
+    # numpy.fft always computes in double precision, the result is cast back so complex64 fields stay complex64
+    def fft2(self, field, overwrite=False):
+        return np.fft.fft2(field, norm="ortho", axes=(-1, -2)).astype(
+            _complexDtype(field), copy=False
+        )
+
+    def ifft2(self, field, overwrite=False):
+        return np.fft.ifft2(field, norm="ortho", axes=(-1, -2)).astype(
+            _complexDtype(field), copy=False
+        )
+
+
+class ScipyFFTBackend(object):
+    """scipy.fft, multithreaded with workers threads (None: all cores)."""
+
+    name = "scipy"
+
+    def __init__(self, workers=None):
+        if scipy_fft is None:
+            raise ImportError("scipy.fft is not available")
+        self.workers = os.cpu_count() if workers is None else workers
+
+    def fft2(self, field, overwrite=False):
+        return scipy_fft.fft2(
+            field, norm="ortho", workers=self.workers, overwrite_x=overwrite
+        )
+
+    def ifft2(self, field, overwrite=False):
+        return scipy_fft.ifft2(
+            field, norm="ortho", workers=self.workers, overwrite_x=overwrite
+        )
+
+
+class PyFFTWBackend(object):
+    """
+    pyFFTW, multithreaded. One FFTW plan (with SIMD aligned input and output buffers) is made per shape, dtype and
+    direction, and reused for every later transform of the same kind.
+    """
+
+    name = "pyfftw"
+
+    def __init__(self, workers=None, planner_effort="FFTW_MEASURE"):
+        if pyfftw is None:
+            raise ImportError("pyfftw is not installed, use pip install pyfftw")
+        self.workers = os.cpu_count() if workers is None else workers
+        self.planner_effort = planner_effort
+        self._plans = {}
+        # the plans reuse their buffers, so one transform at a time (e.g. with concurrent aPIE candidate sweeps)
+        self._lock = threading.Lock()
+        # keep the wisdom of the plans we made around
+        pyfftw.interfaces.cache.enable()
+
+    def _plan(self, field, direction):
+        key = (field.shape, field.dtype.str, direction)
+        plan = self._plans.get(key)
+        if plan is None:
+            logger.debug("Planning %s FFT of shape %s", direction, field.shape)
+            builder = (
+                pyfftw.builders.fft2 if direction == "forward" else pyfftw.builders.ifft2
+            )
+            plan = builder(
+                pyfftw.empty_aligned(field.shape, dtype=field.dtype),
+                axes=(-2, -1),
+                norm="ortho",
+                threads=self.workers,
+                planner_effort=self.planner_effort,
+                overwrite_input=True,
+                avoid_copy=False,
+            )
+            self._plans[key] = plan
+        return plan
+
+    def _execute(self, field, direction):
+        with self._lock:
+            plan = self._plan(field, direction)
+            # the plan copies the field into its aligned input buffer, the output buffer is reused by the next call
+            return plan(field).copy()
+
+    def fft2(self, field, overwrite=False):
+        return self._execute(field, "forward")
+
+    def ifft2(self, field, overwrite=False):
+        return self._execute(field, "backward")
+
+
+_registry = {
+    "numpy": NumpyFFTBackend,
+    "scipy": ScipyFFTBackend,
+    "pyfftw": PyFFTWBackend,
+}
+_backend = None
+_backendName = None
+
+
+def registerFFTBackend(name, backendClass):
+    """
+    Add a backend. backendClass(workers=...) has to provide fft2(field, overwrite) and ifft2(field, overwrite).
+    """
+    _registry[name] = backendClass
+
+
+def availableFFTBackends():
+    """Names of the registered backends."""
+    return list(_registry)
+
+
+def setFFTBackend(name=None, workers=None):
+    """
+    Select the FFT backend used by fft2c and ifft2c for numpy arrays.
+    :param name: 'numpy', 'scipy', 'pyfftw' or a registered name. None: PTYLAB_FFT_BACKEND or 'numpy'
+    :param workers: number of threads, None uses all cores
+    :return: the backend
+    """
+    global _backend, _backendName
+    if name is None:
+        name = os.environ.get("PTYLAB_FFT_BACKEND", "numpy")
+    if name not in _registry:
+        raise ValueError(
+            f"Unknown FFT backend {name}, choose one of {availableFFTBackends()}"
+        )
+    if (
+        _backend is None
+        or _backendName != name
+        or (workers is not None and _backend.workers != workers)
+    ):
+        _backend = _registry[name](workers=workers)
+        _backendName = name
+        logger.info("Using the %s FFT backend (%s workers)", name, _backend.workers)
+    return _backend
+
+
+def getFFTBackend():
+    """The current backend, initialized from PTYLAB_FFT_BACKEND at first use."""
+    if _backend is None:
+        setFFTBackend()
+    return _backend
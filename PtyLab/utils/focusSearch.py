@@ -0,0 +1,62 @@
+"""
+One-dimensional searches for the maximum of a focus metric, used by Reconstruction.TV_autofocus.
+
+Every function takes a merit function f(z) and an interval [lower, upper], and stops once the interval that contains
+the optimum is smaller than tol. They return the best z and the (z, merit) pairs of all evaluated planes.
+"""
+import numpy as np
+from scipy.optimize import minimize_scalar
+
+invphi = (np.sqrt(5) - 1) / 2  # 1 / golden ratio
+
+
+def goldenSectionSearch(f, lower, upper, tol):
+    """
+    Golden-section search for the maximum of a unimodal function f on [lower, upper].
+    :return: best z, evaluated z, evaluated merits
+    """
+    zs, merits = [], []
+
+    def evaluate(z):
+        zs.append(z)
+        merits.append(float(f(z)))
+        return merits[-1]
+
+    a, b = lower, upper
+    c = b - invphi * (b - a)
+    d = a + invphi * (b - a)
+    fc, fd = evaluate(c), evaluate(d)
+    while abs(b - a) > tol:
+        if fc > fd:
+            b, d, fd = d, c, fc
+            c = b - invphi * (b - a)
+            fc = evaluate(c)
+        else:
+            a, c, fc = c, d, fd
+            d = a + invphi * (b - a)
+            fd = evaluate(d)
+    best = zs[int(np.argmax(merits))]
+    return best, np.array(zs), np.array(merits)
+
+
+def brentSearch(f, lower, upper, tol):
+    """
+    Brent's method (parabolic interpolation with golden-section steps as fallback) for the maximum of f on
+    [lower, upper]. Usually needs fewer evaluations than goldenSectionSearch for smooth merit functions.
+    :return: best z, evaluated z, evaluated merits
+    """
+    zs, merits = [], []
+
+    def evaluate(z):
+        zs.append(float(z))
+        merits.append(float(f(float(z))))
+        return -merits[-1]
+
+    minimize_scalar(
+        evaluate, bounds=(lower, upper), method="bounded", options={"xatol": tol}
+    )
+    best = zs[int(np.argmax(merits))]
+    return best, np.array(zs), np.array(merits)
+
+
+focusSearchMethods = {"golden": goldenSectionSearch, "brent": brentSearch}
@@ -52,7 +52,10 @@ def asNumpyArray(ary) -> np.ndarray:
 
 def asCupyArray(field: np.ndarray, dtype="auto"):
     if dtype == "auto":
-        if np.isrealobj(field):
+        if getattr(field, "dtype", None) is not None and field.dtype.kind == "u":
+            # photon counts stay compact, see ExperimentalData.setPtychogramStorage
+            dtype = field.dtype
+        elif np.isrealobj(field):
             dtype = np.float32
         elif np.iscomplexobj(field):
             dtype = np.complex64
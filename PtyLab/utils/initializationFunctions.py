@@ -1,12 +1,15 @@
 import logging
 import numpy as np
 from PtyLab.utils.utils import circ, fft2c, ifft2c
+from PtyLab.utils.precision import getPrecision
 from matplotlib import pyplot as plt
 from scipy.ndimage import gaussian_filter
 from skimage.transform import rescale
 
 
-def initialProbeOrObject(shape, type_of_init, data, logger: logging.Logger = None):
+def initialProbeOrObject(
+    shape, type_of_init, data, logger: logging.Logger = None, dtype=None
+):
     """
     Initialization objects are created for the reconstruction. Currently
     implemented:
@@ -17,6 +20,7 @@ def initialProbeOrObject(shape, type_of_init, data, logger: logging.Logger = Non
     Random noise is added to the arrays to enforce linear independence required
     for orthogonalization of modes
 
+    :param dtype: complex dtype of the result, None uses the default precision (see utils.precision)
     :return:
     """
     if type(type_of_init) is np.ndarray:  # it has already been run
@@ -29,9 +33,11 @@ def initialProbeOrObject(shape, type_of_init, data, logger: logging.Logger = Non
 
     if type_of_init not in ["circ", "rand", "gaussian", "ones", "upsampled"]:
         raise NotImplementedError()
+    if dtype is None:
+        dtype = getPrecision().complex
 
     if type_of_init == "ones":
-        return np.ones(shape) + 0.001 * np.random.rand(*shape)
+        return (np.ones(shape) + 0.001 * np.random.rand(*shape)).astype(dtype)
 
     if type_of_init == "circ":
         try:
@@ -45,9 +51,10 @@ def initialProbeOrObject(shape, type_of_init, data, logger: logging.Logger = Non
             pupil = ndimage.gaussian_filter(
                 pupil.astype(np.float64), 0.05 * data.Xp.shape[-1]
             )
-            return np.ones(shape, dtype=np.complex64) * pupil + 0.001 * np.random.rand(
-                *shape
-            )
+            return (
+                np.ones(shape, dtype=np.complex64) * pupil
+                + 0.001 * np.random.rand(*shape)
+            ).astype(dtype)
 
         except AttributeError as e:
             raise AttributeError(
@@ -60,4 +67,4 @@ def initialProbeOrObject(shape, type_of_init, data, logger: logging.Logger = Non
         upsampled = np.pad(
             low_res, pad_size, mode="constant", constant_values=0
         )  # * data.No / data.Np
-        return np.ones(shape) * upsampled
+        return (np.ones(shape) * upsampled).astype(dtype)
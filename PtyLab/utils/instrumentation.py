@@ -0,0 +1,62 @@
+"""
+Instrumentation of the hot paths (engine inner loops, propagators and projections).
+
+Counters and gauges are only recorded when instrumentation is enabled (params.instrumentation, or the environment
+variable PTYLAB_INSTRUMENTATION=1). Call sites guard them with `if instrumentation.enabled:`, so a normal run
+pays one attribute lookup and nothing else.
+
+Debug messages go through debug(logger, message, *args): the arguments can be callables, which are only
+evaluated when the logger actually emits DEBUG messages. This avoids reductions (and GPU synchronisations) that
+only exist to build a message nobody reads.
+"""
+import logging
+import os
+from collections import defaultdict
+
+
+class Instrumentation(object):
+    """Counters (summed) and gauges (last value) of the hot paths."""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.counters = defaultdict(int)
+        self.gauges = {}
+
+    def count(self, name, n=1):
+        """Add n to the counter called name."""
+        if self.enabled:
+            self.counters[name] += n
+
+    def gauge(self, name, value):
+        """Set the gauge called name. value can be a callable, which is only evaluated when enabled."""
+        if self.enabled:
+            self.gauges[name] = value() if callable(value) else value
+
+    def reset(self):
+        self.counters.clear()
+        self.gauges.clear()
+
+    def snapshot(self):
+        """Copy of the current counters and gauges."""
+        return dict(counters=dict(self.counters), gauges=dict(self.gauges))
+
+
+instrumentation = Instrumentation(
+    enabled=os.environ.get("PTYLAB_INSTRUMENTATION", "0") not in ("", "0")
+)
+
+
+def enableInstrumentation(enabled=True):
+    """Turn the counters and gauges on or off."""
+    instrumentation.enabled = bool(enabled)
+
+
+def debug(logger, message, *args):
+    """
+    logger.debug(message, *args), where the callables in args are only evaluated if the message is emitted.
+    :param logger: logging.Logger
+    :param message: %-style format string
+    :param args: values or callables without arguments
+    """
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(message, *[arg() if callable(arg) else arg for arg in args])
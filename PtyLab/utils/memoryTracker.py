@@ -0,0 +1,142 @@
+"""
+Memory accounting of a reconstruction.
+
+The MemoryTracker samples the resident memory of the process (and the cupy memory pool on the GPU) at the end of
+every stage timed by the StageProfiler, and after every iteration lists the arrays held by the reconstruction, the
+experimental data, the engine and the propagation kernel caches. It is turned on with params.memoryTracking, and
+reports the peak, the stage at which it occurred and the largest arrays in the log (and in engine.profiler.memory).
+"""
+import logging
+import os
+import threading
+
+from PtyLab.Operators import _kernel_cache
+
+try:
+    import cupy as cp
+except ImportError:
+    cp = None
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+
+def currentRSS():
+    """Resident memory of this process in bytes (the peak so far where the current value is not available)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is None:
+        return 0
+    # kB on linux, bytes on mac
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if os.uname().sysname == "Darwin" else 1024 * peak
+
+
+def arrayBytes(owner, prefix, seen=None):
+    """
+    Bytes of the (numpy or cupy) arrays held by the attributes of owner, including arrays in lists, tuples and dicts.
+    Arrays that are in seen (by id) are skipped, so that shared arrays are only counted once.
+    :return: dictionary prefix.attribute -> bytes
+    """
+    seen = set() if seen is None else seen
+    sizes = {}
+    for name, value in vars(owner).items():
+        if isinstance(value, (list, tuple)):
+            items = value
+        elif isinstance(value, dict):
+            items = value.values()
+        else:
+            items = [value]
+        nbytes = 0
+        for item in items:
+            if hasattr(item, "nbytes") and hasattr(item, "shape") and id(item) not in seen:
+                seen.add(id(item))
+                nbytes += int(item.nbytes)
+        if nbytes:
+            sizes[f"{prefix}.{name}"] = nbytes
+    return sizes
+
+
+class MemoryTracker(object):
+    """
+    Peak memory per iteration and the arrays that are responsible for it.
+    :param engine: the engine to account for
+    :param top: number of arrays to report
+    :param gpu: also sample the cupy memory pool
+    """
+
+    def __init__(self, engine, top=10, gpu=False):
+        self.engine = engine
+        self.top = top
+        self.gpu = gpu and cp is not None
+        self.iterations = []
+        self.logger = logging.getLogger("MemoryTracker")
+        self._lock = threading.Lock()
+        self._resetPeak()
+
+    def _resetPeak(self):
+        self._peakRSS, self._peakStage = 0, None
+        self._peakGPU, self._peakGPUStage = 0, None
+
+    def sample(self, stage):
+        """Record the memory use at the end of stage."""
+        rss = currentRSS()
+        used = cp.get_default_memory_pool().used_bytes() if self.gpu else 0
+        with self._lock:
+            if rss > self._peakRSS:
+                self._peakRSS, self._peakStage = rss, stage
+            if used > self._peakGPU:
+                self._peakGPU, self._peakGPUStage = used, stage
+
+    def arrays(self):
+        """Bytes of every array held by the reconstruction, the experimental data, the engine and the kernel caches."""
+        seen = set()
+        sizes = {}
+        sizes.update(arrayBytes(self.engine.reconstruction, "reconstruction", seen))
+        sizes.update(arrayBytes(self.engine.experimentalData, "experimentalData", seen))
+        sizes.update(arrayBytes(self.engine, "engine", seen))
+        for cache in _kernel_cache.cache_stats():
+            if cache["bytes"]:
+                sizes[f"kernelCache.{cache['name']}"] = cache["bytes"]
+        return sizes
+
+    def endIteration(self):
+        """Store and log the peak of this iteration and the largest arrays."""
+        sizes = self.arrays()
+        with self._lock:
+            record = dict(
+                peakRSS=self._peakRSS,
+                peakStage=self._peakStage,
+                arrays=sum(sizes.values()),
+                top=sorted(sizes.items(), key=lambda item: -item[1])[: self.top],
+            )
+            if self.gpu:
+                record.update(peakGPU=self._peakGPU, peakGPUStage=self._peakGPUStage)
+            self._resetPeak()
+        self.iterations.append(record)
+        self.logger.info(self.report(record))
+        return record
+
+    def peak(self):
+        """Largest resident memory (bytes) of all iterations."""
+        return max([record["peakRSS"] for record in self.iterations], default=0)
+
+    def report(self, record=None):
+        """Text report of one iteration (default the last one)."""
+        record = self.iterations[-1] if record is None else record
+        lines = [
+            f"iteration {len(self.iterations)}: peak RSS {record['peakRSS'] / 2**20:.1f} MB "
+            f"after {record['peakStage']}, arrays {record['arrays'] / 2**20:.1f} MB"
+        ]
+        if "peakGPU" in record:
+            lines.append(
+                f"peak GPU memory pool {record['peakGPU'] / 2**20:.1f} MB after {record['peakGPUStage']}"
+            )
+        for name, nbytes in record["top"]:
+            lines.append(f"    {name:<40}{nbytes / 2**20:>10.1f} MB")
+        return "\n".join(lines)
@@ -0,0 +1,136 @@
+"""
+Windows of the spectrum of the object at the scan positions, as used by the FPM position correction.
+
+The position correction correlates an Np x Np window of fft2c(object) with the spectrum of the object patch, at
+every position. ObjectSpectrum gives these windows for the current object without a full-object FFT at every
+position: the full spectrum is computed once, and the engine reports the object changes since then as Np x Np patch
+updates (update()). The contribution of a patch update to a window is a partial DFT, (Np x Np) @ update @ (Np x Np).
+
+Every window needs the partial DFTs of all the updates since the last FFT, so their cost grows with every
+position. The full spectrum is recomputed once the partial DFTs since the last FFT cost as much as an FFT. That
+spreads the cost of one FFT over several positions, and no call of windows() costs more than an FFT.
+
+Changes of the object outside the reported patches (momentum updates, constraints) are not detected; the engine
+calls reset() after them. Assigning a new object array is detected.
+"""
+import numpy as np
+
+from PtyLab.utils.gpuUtils import getArrayModule
+from PtyLab.utils.utils import fft2c
+
+
+class ObjectSpectrum(object):
+    """
+    Windows of fft2c(object)[..., row:row + Np, col:col + Np] for the current object, see windows().
+    """
+
+    # matrix products run at a much higher fraction of the peak speed than the (memory bound) FFT, relative speed
+    # per floating point operation, used to compare the cost of the partial DFTs with a full FFT
+    matmulSpeedup = 32
+
+    def __init__(self):
+        self.reset()
+        # number of full-object FFTs
+        self.ffts = 0
+        self._dftMatrices = {}
+
+    def reset(self):
+        """Forget the spectrum, the next call of windows() computes it again."""
+        # fft2c of the object as it was when the spectrum was computed, and that object
+        self.spectrum = None
+        self.object = None
+        # (row, col, update) of the patch updates since the spectrum was computed
+        self.updates = []
+        # partial DFTs (update, window pairs) computed since the spectrum was computed
+        self.spent = 0
+
+    def _dftMatrix(self, N, xp, dtype):
+        """
+        Centred, unitary DFT matrix of size N (fft2c(O) = F @ O @ F.T), whose blocks map a patch to a window.
+        """
+        key = (N, xp, np.dtype(dtype).str)
+        if key not in self._dftMatrices:
+            k = np.arange(N) - N // 2
+            # reduce the product modulo N before scaling, to keep the phase accurate for large N
+            phase = -2 * np.pi * (np.outer(k, k) % N) / N
+            self._dftMatrices[key] = xp.asarray(np.exp(1j * phase) / np.sqrt(N), dtype=dtype)
+        return self._dftMatrices[key]
+
+    def _refresh(self, object):
+        self.reset()
+        self.spectrum = fft2c(object)
+        self.object = object
+        self.ffts += 1
+
+    def fftCost(self, object, Np):
+        """The cost of a full FFT of object, in partial DFTs of Np x Np patches."""
+        No = max(object.shape[-2:])
+        return self.matmulSpeedup * No**2 * np.log2(No) / (2 * Np**3)
+
+    def update(self, object, positions, previousPatches):
+        """
+        Keep the changes of object at positions, where the object patches were previousPatches.
+        :param object: the (current) object, (..., No, No)
+        :param positions: (B, 2) row and column of the top left corner of the patches
+        :param previousPatches: the patches before the update, (B, ..., Np, Np). Overlapping patches of the same
+            call have to come from the same object (as in a batch), the overlap is counted once.
+        """
+        if self.spectrum is None or object is not self.object:
+            # the spectrum is computed from the current object anyway
+            return
+        xp = getArrayModule(object)
+        Np = previousPatches.shape[-1]
+        positions = np.asarray(positions)
+        for index, (row, col) in enumerate(positions):
+            update = object[..., row : row + Np, col : col + Np] - previousPatches[index]
+            # the overlap with the patches before it in this call is already in their updates
+            for r, c in positions[:index]:
+                rows = slice(max(r - row, 0), min(r - row + Np, Np))
+                cols = slice(max(c - col, 0), min(c - col + Np, Np))
+                if rows.start < rows.stop and cols.start < cols.stop:
+                    update[..., rows, cols] = 0
+            if xp.any(update):
+                self.updates.append((row, col, update))
+
+    def windows(self, object, positions, Np):
+        """
+        Windows of the spectrum of object.
+        :param object: the (current) object, (..., No, No), with its changes since the last call given by update()
+        :param positions: (B, 2) row and column of the top left corner of the windows
+        :param Np: size of the windows
+        :return: fft2c(object)[..., row:row + Np, col:col + Np] for every position, stacked, (B, ..., Np, Np)
+        """
+        xp = getArrayModule(object)
+        cost = len(positions) * len(self.updates)
+        if (
+            self.spectrum is None
+            or object is not self.object
+            or self.spectrum.shape != object.shape
+            or self.spent + cost > self.fftCost(object, Np)
+        ):
+            self._refresh(object)
+        else:
+            self.spent += cost
+        Frow = self._dftMatrix(object.shape[-2], xp, object.dtype)
+        Fcol = self._dftMatrix(object.shape[-1], xp, object.dtype)
+        windows = []
+        for row, col in positions:
+            window = self.spectrum[..., row : row + Np, col : col + Np]
+            for r, c, update in self.updates:
+                window = window + (
+                    Frow[row : row + Np, r : r + Np]
+                    @ update
+                    @ Fcol[col : col + Np, c : c + Np].T
+                )
+            windows.append(window)
+        return xp.stack(windows)
+
+    @staticmethod
+    def mean(object):
+        """
+        Mean of fft2c(object) over all its elements, without the FFT: the sum of the centred spectrum is the centre
+        pixel of the object times sqrt(number of pixels).
+        """
+        xp = getArrayModule(object)
+        Ny, Nx = object.shape[-2:]
+        return xp.mean(object[..., Ny // 2, Nx // 2]) / np.sqrt(Ny * Nx)
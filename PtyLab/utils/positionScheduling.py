@@ -0,0 +1,71 @@
+import numpy as np
+
+
+def getOverlapGraph(positions, Np):
+    """
+    Build the patch-overlap graph of a scan. Two Np x Np patches with top-left corners (row, col) overlap
+    when both their row and column distance are smaller than Np. The positions are binned on a grid with a
+    pitch of Np, so only the patches in the 3 x 3 neighbouring bins have to be compared.
+    :param positions: integer array of shape (numFrames, 2) with the (row, col) of every patch, e.g. reconstruction.positions
+    :param Np: size of the patches (probe) in pixels
+    :return: list with, for every position, an array of the indices of the positions it overlaps with
+    """
+    positions = np.asarray(positions, dtype=np.int64)
+    numFrames = positions.shape[0]
+    bins = positions // Np
+    cells = {}
+    for index, cell in enumerate(map(tuple, bins)):
+        cells.setdefault(cell, []).append(index)
+    cells = {cell: np.array(members) for cell, members in cells.items()}
+
+    neighbours = []
+    for index in range(numFrames):
+        row, col = bins[index]
+        candidates = [
+            cells[(row + dr, col + dc)]
+            for dr in (-1, 0, 1)
+            for dc in (-1, 0, 1)
+            if (row + dr, col + dc) in cells
+        ]
+        candidates = np.concatenate(candidates)
+        distance = np.abs(positions[candidates] - positions[index])
+        overlapping = np.all(distance < Np, axis=1) & (candidates != index)
+        neighbours.append(np.sort(candidates[overlapping]))
+    return neighbours
+
+
+def colourOverlapGraph(neighbours, order=None):
+    """
+    Greedy colouring of the overlap graph: positions with the same colour do not overlap.
+    :param neighbours: output of getOverlapGraph
+    :param order: order in which the positions are coloured. Default: largest number of neighbours first,
+        which usually gives the smallest number of colours
+    :return: integer array with the colour of every position
+    """
+    numFrames = len(neighbours)
+    if order is None:
+        degree = np.array([len(n) for n in neighbours])
+        order = np.argsort(-degree, kind="stable")
+    colours = np.full(numFrames, -1, dtype=int)
+    for index in order:
+        used = set(colours[neighbours[index]].tolist())
+        colour = 0
+        while colour in used:
+            colour += 1
+        colours[index] = colour
+    return colours
+
+
+def getNonOverlappingGroups(colours, shuffle=False):
+    """
+    Split the positions into groups of mutually non-overlapping positions, one group per colour.
+    :param colours: output of colourOverlapGraph
+    :param shuffle: randomize the order of the groups and the order of the positions within every group
+    :return: list of arrays with position indices
+    """
+    groups = [np.flatnonzero(colours == colour) for colour in np.unique(colours)]
+    if shuffle:
+        for group in groups:
+            np.random.shuffle(group)
+        groups = [groups[k] for k in np.random.permutation(len(groups))]
+    return groups
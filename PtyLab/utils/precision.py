@@ -0,0 +1,76 @@
+"""
+Floating point precision of a reconstruction.
+
+The complex arrays (object, probe, exit waves, momenta, propagation kernels) are kept in the complex dtype of the
+policy and the real ones (intensities, masks, errors) in its real dtype. 'single' (complex64 / float32) is the
+default, 'double' (complex128 / float64) is meant to validate results. Every engine keeps its own policy
+(BaseEngine.precision, from params.precision) and passes it to the propagation kernels, whose caches are keyed on it,
+so engines with different precisions can run side by side.
+
+numpy promotes silently (complex64 * float64 array is complex128), so a single float64 array in the position loop
+makes the rest of the run double precision. upcastFields finds the arrays that are wider than the policy, see
+params.precisionCheck.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+Precision = namedtuple("Precision", ["name", "complex", "real"])
+
+_policies = {
+    "single": Precision("single", np.dtype(np.complex64), np.dtype(np.float32)),
+    "double": Precision("double", np.dtype(np.complex128), np.dtype(np.float64)),
+}
+_default = "single"
+
+
+def getPrecision(name=None):
+    """The policy called name, or the default 'single' one if name is None, as (name, complex dtype, real dtype)."""
+    if name is None:
+        name = _default
+    if name not in _policies:
+        raise ValueError(f"Unknown precision {name}, choose one of {list(_policies)}")
+    return _policies[name]
+
+
+def asPrecision(array, precision=None):
+    """
+    Cast a floating point (real or complex) array to the dtype of the policy. Other arrays (integer counts, masks),
+    scalars and None are returned as they are.
+    :param precision: policy, None uses the default one
+    """
+    precision = precision or getPrecision()
+    dtype = getattr(array, "dtype", None)
+    if dtype is None or getattr(array, "ndim", 0) == 0:
+        return array
+    if dtype.kind == "c":
+        return array.astype(precision.complex, copy=False)
+    if dtype.kind == "f":
+        return array.astype(precision.real, copy=False)
+    return array
+
+
+def isUpcast(array, precision=None):
+    """True if array is a floating point array with more bytes per value than the policy allows."""
+    precision = precision or getPrecision()
+    dtype = getattr(array, "dtype", None)
+    if dtype is None:
+        return False
+    if dtype.kind == "c":
+        return dtype.itemsize > precision.complex.itemsize
+    if dtype.kind == "f":
+        return dtype.itemsize > precision.real.itemsize
+    return False
+
+
+def upcastFields(owner, names, precision=None):
+    """
+    The attributes of owner that are wider than the policy.
+    :param names: attribute names, missing attributes are skipped
+    :return: list of (name, dtype)
+    """
+    return [
+        (name, getattr(owner, name).dtype)
+        for name in names
+        if isUpcast(getattr(owner, name, None), precision)
+    ]
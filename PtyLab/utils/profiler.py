@@ -0,0 +1,259 @@
+"""
+Wall-clock profiling of the stages of a reconstruction.
+
+Every engine has a StageProfiler (engine.profiler), which is off unless params.profiling is set. When it is on, the
+stage methods of the engine (see engineStages) are wrapped with timers. Without profiling nothing is wrapped, so
+normal runs pay nothing. The time of every stage is its own time (self time): time spent in nested stages, e.g.
+object2detector inside intensityProjection, is only counted for the nested stage. The times are aggregated per
+iteration (an iteration ends with showReconstruction), and can be reported with summary() or exported as a JSON
+trace with saveTrace(). A MemoryTracker (profiler.memory, see utils.memoryTracker) is sampled at the end of every stage.
+"""
+import json
+import threading
+import time
+from functools import wraps
+from inspect import isfunction
+
+try:
+    import cupy as cp
+except ImportError:
+    cp = None
+
+# engine method -> stage name
+engineStages = {
+    "getObjectPatches": "patchExtraction",
+    "object2detector": "object2detector",
+    "intensityProjection": "projection",
+    "detector2object": "detector2object",
+    "objectPatchUpdate": "objectUpdate",
+    "objectPatchUpdate_TV": "objectUpdate",
+    "probeUpdate": "probeUpdate",
+    "objectMomentumUpdate": "momentum",
+    "probeMomentumUpdate": "momentum",
+    "batchPositionUpdate": "batchUpdate",
+    "positionCorrectionBatch": "positionCorrection",
+    "applyConstraints": "applyConstraints",
+    "getErrorMetrics": "getErrorMetrics",
+    "showReconstruction": "showReconstruction",
+}
+# the stage that ends an iteration
+iterationEnd = "showReconstruction"
+
+
+def _isTimer(method):
+    return isfunction(method) and hasattr(method, "_profiledStage")
+
+
+class _NullStage(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_nullStage = _NullStage()
+
+
+class _Stage(object):
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler._enter(self.name)
+        return self
+
+    def __exit__(self, *args):
+        self.profiler._exit()
+        return False
+
+
+class StageProfiler(object):
+    """
+    Times named stages. Use `with profiler.stage(name):` around a block, profiler.lap(name) to time the block since
+    the start of the enclosing stage (or the previous lap), and attach(engine) to time the engine methods.
+    :param enabled: if False, stage and lap do nothing
+    :param synchronize: wait for the GPU at the end of every stage, so that the time is spent where it is reported
+    :param memory: MemoryTracker that is sampled at the end of every stage and iteration, or None
+    """
+
+    def __init__(self, enabled=False, synchronize=False, memory=None):
+        self.enabled = enabled
+        self.synchronize = synchronize
+        self.memory = memory
+        self.iterations = []
+        self._current = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    # timing
+
+    def stage(self, name):
+        """Context manager that times a block as stage name."""
+        if not self.enabled:
+            return _nullStage
+        return _Stage(self, name)
+
+    def lap(self, name):
+        """Record the time since the start of the enclosing stage, or since the previous lap, as stage name."""
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        frames = self._frames()
+        if frames:
+            frame = frames[-1]
+            elapsed = now - frame[3]
+            frame[2] += elapsed
+            frame[3] = now
+        else:
+            elapsed = now - getattr(self._local, "lastMark", now)
+            self._local.lastMark = now
+        self._record(name, elapsed, elapsed)
+
+    def _frames(self):
+        frames = getattr(self._local, "frames", None)
+        if frames is None:
+            frames = self._local.frames = []
+        return frames
+
+    def _enter(self, name):
+        now = time.perf_counter()
+        # name, start, time spent in nested stages, last mark (for lap)
+        self._frames().append([name, now, 0.0, now])
+
+    def _exit(self):
+        if self.synchronize and cp is not None:
+            cp.cuda.runtime.deviceSynchronize()
+        now = time.perf_counter()
+        frames = self._frames()
+        name, start, nested, _ = frames.pop()
+        total = now - start
+        self._record(name, total, total - nested)
+        if self.memory is not None:
+            self.memory.sample(name)
+        if frames:
+            frames[-1][2] += total
+            frames[-1][3] = now
+        else:
+            self._local.lastMark = now
+
+    def _record(self, name, total, own):
+        with self._lock:
+            entry = self._current.setdefault(name, [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += total
+            entry[2] += own
+
+    def endIteration(self):
+        """Close the current iteration."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.iterations.append(self._current)
+            self._current = {}
+        if self.memory is not None:
+            self.memory.endIteration()
+
+    def merge(self, other):
+        """
+        Add the stages recorded by other, e.g. the profiler of a copy of the engine that ran in a worker thread, to
+        the current iteration.
+        """
+        with other._lock:
+            iterations = other.iterations + [other._current]
+        with self._lock:
+            for iteration in iterations:
+                for name, (calls, total, own) in iteration.items():
+                    entry = self._current.setdefault(name, [0, 0.0, 0.0])
+                    entry[0] += calls
+                    entry[1] += total
+                    entry[2] += own
+
+    def reset(self):
+        with self._lock:
+            self.iterations = []
+            self._current = {}
+
+    # engine methods
+
+    def attach(self, engine, stages=None):
+        """
+        Time the methods of engine (an instance), see engineStages. Can be undone with detach.
+        """
+        stages = engineStages if stages is None else stages
+        for method, name in stages.items():
+            original = getattr(engine, method, None)
+            if original is None or _isTimer(original):
+                continue
+            setattr(engine, method, self._wrap(original, name))
+
+    def detach(self, engine):
+        """Remove the timers added by attach."""
+        for method in list(vars(engine)):
+            if _isTimer(vars(engine)[method]):
+                delattr(engine, method)
+
+    def _wrap(self, method, name):
+        profiler = self
+
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            with profiler.stage(name):
+                result = method(*args, **kwargs)
+            if name == iterationEnd:
+                profiler.endIteration()
+            return result
+
+        wrapper._profiledStage = name
+        return wrapper
+
+    # reporting
+
+    def totals(self):
+        """stage -> (calls, total time, own time), summed over all iterations."""
+        totals = {}
+        with self._lock:
+            iterations = self.iterations + [self._current]
+        for iteration in iterations:
+            for name, (calls, total, own) in iteration.items():
+                entry = totals.setdefault(name, [0, 0.0, 0.0])
+                entry[0] += calls
+                entry[1] += total
+                entry[2] += own
+        return {name: tuple(entry) for name, entry in totals.items()}
+
+    def summary(self):
+        """Table of the stages, sorted by their own time."""
+        totals = self.totals()
+        numIterations = max(len(self.iterations), 1)
+        ownTime = sum(own for _, _, own in totals.values()) or 1.0
+        lines = [
+            f"{'stage':<40}{'calls':>10}{'self [s]':>12}{'total [s]':>12}{'per iter [ms]':>15}{'share':>8}"
+        ]
+        for name, (calls, total, own) in sorted(
+            totals.items(), key=lambda item: -item[1][2]
+        ):
+            lines.append(
+                f"{name:<40}{calls:>10}{own:>12.4f}{total:>12.4f}"
+                f"{1e3 * own / numIterations:>15.3f}{100 * own / ownTime:>7.1f}%"
+            )
+        return "\n".join(lines)
+
+    def trace(self):
+        """Totals and per-iteration times, as a dictionary that can be saved as JSON."""
+        entry = lambda calls, total, own: dict(calls=calls, total=total, self=own)
+        with self._lock:
+            iterations = list(self.iterations)
+        return dict(
+            stages={name: entry(*values) for name, values in self.totals().items()},
+            iterations=[
+                {name: entry(*values) for name, values in iteration.items()}
+                for iteration in iterations
+            ],
+        )
+
+    def saveTrace(self, filename):
+        """Save trace() as a JSON file."""
+        with open(filename, "w") as f:
+            json.dump(self.trace(), f, indent=1)
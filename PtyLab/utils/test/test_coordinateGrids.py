@@ -0,0 +1,29 @@
+import unittest
+from unittest import TestCase
+import numpy as np
+from PtyLab.utils.coordinateGrids import CoordinateGrids
+
+
+class TestCoordinateGrids(TestCase):
+    def test_get(self):
+        """
+        The cached grids match the meshgrid of the 1D coordinates and are only built once.
+        :return:
+        """
+        grids = CoordinateGrids()
+        N, dx = 64, 1.5e-6
+        X, Y = grids.get(N, dx)
+        x = np.linspace(-N / 2, N / 2, N) * dx
+        Xref, Yref = np.meshgrid(x, x)
+        self.assertEqual(X.dtype, np.float32)
+        np.testing.assert_allclose(X, Xref, rtol=1e-6)
+        np.testing.assert_allclose(Y, Yref, rtol=1e-6)
+        self.assertIs(grids.get(N, dx)[0], X)
+        self.assertFalse(X.flags.writeable)
+
+        grids.invalidate()
+        self.assertIsNot(grids.get(N, dx)[0], X)
+
+
+if __name__ == "__main__":
+    unittest.main()
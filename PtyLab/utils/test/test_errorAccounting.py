@@ -0,0 +1,49 @@
+import unittest
+from unittest import TestCase
+import numpy as np
+from PtyLab.utils.errorAccounting import ResidualReservoir
+
+
+class TestResidualReservoir(TestCase):
+    def test_subset(self):
+        """
+        The reservoir draws a fixed subset of distinct positions, at most numFrames, without changing the global
+        random state.
+        :return:
+        """
+        np.random.seed(1)
+        state = np.random.get_state()[1].copy()
+        reservoir = ResidualReservoir(4, 10)
+        np.testing.assert_array_equal(np.random.get_state()[1], state)
+        self.assertEqual(len(np.unique(reservoir.positionIndices)), 4)
+        self.assertTrue(np.all((reservoir.positionIndices >= 0) & (reservoir.positionIndices < 10)))
+        self.assertEqual(len(ResidualReservoir(20, 10).positionIndices), 10)
+        self.assertEqual(len(ResidualReservoir(0, 10).positionIndices), 0)
+
+    def test_push(self):
+        """
+        Only the latest map of the positions in the subset is kept, in single precision, also for a batch.
+        :return:
+        """
+        reservoir = ResidualReservoir(3, 10)
+        selected = reservoir.positionIndices
+        for positionIndex in range(10):
+            reservoir.push(positionIndex, np.full((4, 4), positionIndex, dtype=np.float64))
+        self.assertEqual(sorted(reservoir.maps), selected.tolist())
+        for positionIndex, residualMap in reservoir.maps.items():
+            self.assertEqual(residualMap.dtype, np.float32)
+            np.testing.assert_array_equal(residualMap, positionIndex)
+
+        # a batch overwrites the maps of the selected positions
+        residuals = -np.random.rand(10, 4, 4)
+        reservoir.push(np.arange(10), residuals)
+        for positionIndex in selected:
+            np.testing.assert_allclose(reservoir.maps[positionIndex], residuals[positionIndex], rtol=1e-6)
+
+        empty = ResidualReservoir(0, 10)
+        empty.push(np.arange(10), residuals)
+        self.assertEqual(empty.maps, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -20,6 +20,30 @@ class TestOperators(TestCase):
         assert_almost_equal(fft2c(ifft2c(E_in)), E_in)
         # assert_almost_equal(E_in, abs(E_out))
 
+    def test_centred_transform(self):
+        """
+        The checkerboard-modulated transform (even shapes) and the fftshift one (odd shapes) both
+        match the explicitly shifted transform.
+        :return:
+        """
+        axes = (-2, -1)
+        for shape in [(3, 64, 64), (3, 62, 64), (3, 63, 64)]:
+            E_in = np.random.rand(*shape) + 1j * np.random.rand(*shape)
+            assert_almost_equal(
+                fft2c(E_in),
+                np.fft.fftshift(
+                    np.fft.fft2(np.fft.ifftshift(E_in, axes=axes), norm="ortho"),
+                    axes=axes,
+                ),
+            )
+            assert_almost_equal(
+                ifft2c(E_in),
+                np.fft.fftshift(
+                    np.fft.ifft2(np.fft.ifftshift(E_in, axes=axes), norm="ortho"),
+                    axes=axes,
+                ),
+            )
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+from unittest import TestCase
+import numpy as np
+from numpy.testing import assert_allclose
+from PtyLab.utils import fftBackends
+from PtyLab.utils.utils import fft2c, ifft2c
+
+
+class TestFFTBackends(TestCase):
+    def tearDown(self) -> None:
+        fftBackends.setFFTBackend("numpy")
+
+    def test_backends_agree(self):
+        """
+        All available backends give the same (unitary) centered transform as numpy.
+        :return:
+        """
+        E_in = np.random.rand(3, 64, 64) + 1j * np.random.rand(3, 64, 64)
+        fftBackends.setFFTBackend("numpy")
+        reference = fft2c(E_in)
+        for name in fftBackends.availableFFTBackends():
+            try:
+                fftBackends.setFFTBackend(name, workers=2)
+            except ImportError:
+                continue
+            assert_allclose(fft2c(E_in), reference, atol=1e-10)
+            assert_allclose(ifft2c(fft2c(E_in)), E_in, atol=1e-10)
+            # overwrite is only a hint, the result has to be the same
+            assert_allclose(ifft2c(reference.copy(), overwrite=True), E_in, atol=1e-10)
+
+    def test_precision(self):
+        """
+        complex64 fields are transformed to complex64 by every backend.
+        :return:
+        """
+        E_in = (np.random.rand(2, 32, 32) + 1j * np.random.rand(2, 32, 32)).astype(np.complex64)
+        for name in fftBackends.availableFFTBackends():
+            try:
+                fftBackends.setFFTBackend(name, workers=2)
+            except ImportError:
+                continue
+            self.assertEqual(fft2c(E_in).dtype, np.complex64)
+            self.assertEqual(ifft2c(E_in, fftshiftSwitch=True).dtype, np.complex64)
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            fftBackends.setFFTBackend("doesnotexist")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,24 @@
+import unittest
+from unittest import TestCase
+import numpy as np
+from PtyLab.utils.focusSearch import goldenSectionSearch, brentSearch
+
+
+class TestFocusSearch(TestCase):
+    def test_search(self):
+        """
+        Both searches find the maximum of a smooth peak to within the tolerance, with far fewer evaluations than
+        a sweep with the same resolution.
+        :return:
+        """
+        z0, tol = 0.37, 1e-3
+        merit = lambda z: 1 / (1 + ((z - z0) / 0.1) ** 2)
+        for search in [goldenSectionSearch, brentSearch]:
+            best, zs, merits = search(merit, 0, 1, tol)
+            self.assertLess(abs(best - z0), tol)
+            self.assertEqual(len(zs), len(merits))
+            self.assertLess(len(zs), 30)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import logging
+import unittest
+from unittest import TestCase
+from PtyLab.utils.instrumentation import Instrumentation, debug
+
+
+class TestInstrumentation(TestCase):
+    def test_disabled(self):
+        """
+        Nothing is recorded or evaluated while instrumentation is disabled.
+        :return:
+        """
+        instrumentation = Instrumentation(enabled=False)
+        instrumentation.count("positions")
+        instrumentation.gauge("error", lambda: 1 / 0)
+        self.assertEqual(instrumentation.snapshot(), dict(counters={}, gauges={}))
+
+        instrumentation.enabled = True
+        instrumentation.count("positions", 3)
+        instrumentation.count("positions")
+        instrumentation.gauge("error", lambda: 0.5)
+        self.assertEqual(
+            instrumentation.snapshot(),
+            dict(counters={"positions": 4}, gauges={"error": 0.5}),
+        )
+
+    def test_lazy_debug(self):
+        """
+        Debug arguments are only evaluated when the message is emitted.
+        :return:
+        """
+        logger = logging.getLogger("test_lazy_debug")
+        logger.setLevel(logging.INFO)
+        debug(logger, "value: %s", lambda: 1 / 0)
+
+        logger.setLevel(logging.DEBUG)
+        with self.assertLogs(logger, logging.DEBUG) as logs:
+            debug(logger, "value: %s", lambda: 42)
+        self.assertIn("value: 42", logs.output[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
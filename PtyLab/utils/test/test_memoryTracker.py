@@ -0,0 +1,61 @@
+import unittest
+from types import SimpleNamespace
+from unittest import TestCase
+import numpy as np
+from PtyLab.Operators import _kernel_cache
+from PtyLab.utils.memoryTracker import MemoryTracker, arrayBytes, currentRSS
+from PtyLab.utils.profiler import StageProfiler
+
+
+class TestMemoryTracker(TestCase):
+    def setUp(self):
+        # the kernels cached by other tests are counted as well
+        _kernel_cache.clear()
+        self.object = np.zeros((64, 64), dtype=np.complex64)
+        self.engine = SimpleNamespace(
+            reconstruction=SimpleNamespace(
+                object=self.object, esw=np.zeros((16, 16), dtype=np.complex64)
+            ),
+            experimentalData=SimpleNamespace(
+                ptychogram=np.zeros((10, 16, 16), dtype=np.float32)
+            ),
+            # shared with the reconstruction, counted once
+            objectBuffer=self.object,
+            patches=[np.zeros(8), np.zeros(8)],
+            name="mPIE",
+        )
+
+    def test_arrayBytes(self):
+        """
+        Arrays, including arrays in lists, are counted once per owner attribute.
+        :return:
+        """
+        seen = set()
+        sizes = arrayBytes(self.engine.reconstruction, "reconstruction", seen)
+        sizes.update(arrayBytes(self.engine, "engine", seen))
+        self.assertEqual(sizes["reconstruction.object"], 64 * 64 * 8)
+        self.assertEqual(sizes["engine.patches"], 2 * 8 * 8)
+        self.assertNotIn("engine.objectBuffer", sizes)
+        self.assertNotIn("engine.name", sizes)
+
+    def test_profiler_hook(self):
+        """
+        The profiler samples the tracker at every stage and closes its iteration.
+        :return:
+        """
+        tracker = MemoryTracker(self.engine, top=2)
+        profiler = StageProfiler(enabled=True, memory=tracker)
+        with profiler.stage("object2detector"):
+            self.engine.reconstruction.ESW = np.zeros((256, 256), dtype=np.complex128)
+        profiler.endIteration()
+
+        record = tracker.iterations[0]
+        self.assertGreater(currentRSS(), 0)
+        self.assertEqual(record["peakStage"], "object2detector")
+        self.assertEqual(record["top"][0], ("reconstruction.ESW", 256 * 256 * 16))
+        self.assertEqual(len(record["top"]), 2)
+        self.assertIn("reconstruction.ESW", tracker.report())
+
+
+if __name__ == "__main__":
+    unittest.main()
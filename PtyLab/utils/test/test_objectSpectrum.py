@@ -0,0 +1,146 @@
+import time
+import unittest
+from unittest import TestCase
+import numpy as np
+from PtyLab.utils.utils import fft2c
+from PtyLab.utils.objectSpectrum import ObjectSpectrum
+
+
+class TestObjectSpectrum(TestCase):
+    def setUp(self) -> None:
+        np.random.seed(1)
+        self.Np = 8
+        self.No = 97
+        self.object = np.random.rand(1, 1, 1, 1, self.No, self.No) * np.exp(
+            1j * np.random.rand(1, 1, 1, 1, self.No, self.No)
+        )
+        self.positions = np.random.randint(0, self.No - self.Np + 1, size=(40, 2))
+
+    def expected(self, positions):
+        spectrum = fft2c(self.object)
+        return np.stack(
+            [spectrum[..., row : row + self.Np, col : col + self.Np] for row, col in positions]
+        )
+
+    def updatePatches(self, objectSpectrum, positions, factor=0.9 + 0.1j):
+        """Update the object at positions (overlapping patches from the same object, as a batch) and report it."""
+        previousPatches = np.stack(
+            [self.object[..., row : row + self.Np, col : col + self.Np] for row, col in positions]
+        )
+        for patch, (row, col) in zip(previousPatches, positions):
+            self.object[..., row : row + self.Np, col : col + self.Np] += (factor - 1) * patch
+        objectSpectrum.update(self.object, positions, previousPatches)
+
+    def test_windows(self):
+        """
+        After patch updates (single positions and overlapping batches) the windows match the FFT of the full
+        object, and the full FFT is only computed again when the updates get too expensive.
+        :return:
+        """
+        objectSpectrum = ObjectSpectrum()
+        objectSpectrum.matmulSpeedup = 1e3
+        for start in range(0, 12, 3):
+            batch = self.positions[start : start + 3] if start else self.positions[:1]
+            self.updatePatches(objectSpectrum, batch)
+            np.testing.assert_allclose(
+                objectSpectrum.windows(self.object, batch, self.Np),
+                self.expected(batch),
+                atol=1e-12,
+            )
+        self.assertEqual(objectSpectrum.ffts, 1)
+        # overlapping patches of one batch
+        batch = np.array([[10, 10], [12, 14], [10, 10]])
+        self.updatePatches(objectSpectrum, batch)
+        np.testing.assert_allclose(
+            objectSpectrum.windows(self.object, batch, self.Np), self.expected(batch), atol=1e-12
+        )
+
+    def test_refresh(self):
+        """
+        The full spectrum is computed again once the partial DFTs since the last FFT cost as much as an FFT, no
+        call costs more than that.
+        :return:
+        """
+        objectSpectrum = ObjectSpectrum()
+        objectSpectrum.matmulSpeedup = 1
+        fftCost = objectSpectrum.fftCost(self.object, self.Np)
+        for positionIndex in range(len(self.positions)):
+            batch = self.positions[positionIndex : positionIndex + 1]
+            self.updatePatches(objectSpectrum, batch)
+            np.testing.assert_allclose(
+                objectSpectrum.windows(self.object, batch, self.Np), self.expected(batch), atol=1e-12
+            )
+            self.assertLessEqual(objectSpectrum.spent, fftCost)
+        self.assertGreater(objectSpectrum.ffts, 1)
+        self.assertLess(objectSpectrum.ffts, len(self.positions) // 4)
+
+    def test_changes(self):
+        """
+        A new object array is detected, changes outside the patches are accounted for after reset().
+        :return:
+        """
+        objectSpectrum = ObjectSpectrum()
+        positions = self.positions[:2]
+        objectSpectrum.windows(self.object, positions, self.Np)
+        self.object = self.object * 1.5
+        np.testing.assert_allclose(
+            objectSpectrum.windows(self.object, positions, self.Np),
+            self.expected(positions),
+            atol=1e-12,
+        )
+        self.assertEqual(objectSpectrum.ffts, 2)
+        self.object *= 1.5
+        objectSpectrum.reset()
+        np.testing.assert_allclose(
+            objectSpectrum.windows(self.object, positions, self.Np),
+            self.expected(positions),
+            atol=1e-12,
+        )
+        self.assertEqual(objectSpectrum.ffts, 3)
+
+    def test_singlePrecision(self):
+        self.object = self.object.astype(np.complex64)
+        objectSpectrum = ObjectSpectrum()
+        objectSpectrum.windows(self.object, self.positions[:1], self.Np)
+        self.updatePatches(objectSpectrum, self.positions[1:2], 1.5)
+        windows = objectSpectrum.windows(self.object, self.positions[1:2], self.Np)
+        self.assertEqual(windows.dtype, np.complex64)
+        np.testing.assert_allclose(windows, self.expected(self.positions[1:2]), atol=1e-5)
+
+    def test_mean(self):
+        np.testing.assert_allclose(ObjectSpectrum.mean(self.object), fft2c(self.object).mean())
+
+    def test_largeObject(self):
+        """
+        At the scale of FPM data (2048 x 2048 object, 256 x 256 windows) the windows of 40 positions, each after a
+        patch update, take less time than a full FFT per position.
+        :return:
+        """
+        self.No, self.Np = 2048, 256
+        rng = np.random.default_rng(1)
+        shape = (1, 1, 1, 1, self.No, self.No)
+        self.object = (rng.random(shape) + 1j * rng.random(shape)).astype(np.complex64)
+        positions = rng.integers(0, self.No - self.Np + 1, size=(40, 2))
+
+        start = time.perf_counter()
+        for _ in range(3):
+            fft2c(self.object)
+        fftTime = (time.perf_counter() - start) / 3
+
+        objectSpectrum = ObjectSpectrum()
+        objectSpectrum.windows(self.object, positions[:1], self.Np)
+        start = time.perf_counter()
+        for positionIndex in range(len(positions)):
+            batch = positions[positionIndex : positionIndex + 1]
+            self.updatePatches(objectSpectrum, batch)
+            windows = objectSpectrum.windows(self.object, batch, self.Np)
+        windowsTime = time.perf_counter() - start
+
+        self.assertLess(objectSpectrum.ffts, len(positions) // 4)
+        self.assertLess(windowsTime, 0.5 * len(positions) * fftTime)
+        expected = self.expected(batch)
+        np.testing.assert_allclose(windows, expected, atol=1e-4 * abs(expected).max())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+from unittest import TestCase
+import numpy as np
+from PtyLab.utils.positionScheduling import (
+    getOverlapGraph,
+    colourOverlapGraph,
+    getNonOverlappingGroups,
+)
+
+
+class TestPositionScheduling(TestCase):
+    def setUp(self) -> None:
+        np.random.seed(1)
+        self.Np = 16
+        self.positions = np.random.randint(0, 100, size=(200, 2))
+
+    def test_getOverlapGraph(self):
+        """
+        Compare the binned overlap graph with the brute force one.
+        :return:
+        """
+        neighbours = getOverlapGraph(self.positions, self.Np)
+        distance = np.abs(self.positions[:, None, :] - self.positions[None, :, :])
+        overlap = np.all(distance < self.Np, axis=-1)
+        np.fill_diagonal(overlap, False)
+        for index in range(len(self.positions)):
+            np.testing.assert_array_equal(neighbours[index], np.flatnonzero(overlap[index]))
+
+    def test_getNonOverlappingGroups(self):
+        """
+        Every position is scheduled exactly once and no two positions in a group overlap.
+        :return:
+        """
+        colours = colourOverlapGraph(getOverlapGraph(self.positions, self.Np))
+        groups = getNonOverlappingGroups(colours, shuffle=True)
+        np.testing.assert_array_equal(
+            np.sort(np.concatenate(groups)), np.arange(len(self.positions))
+        )
+        for group in groups:
+            distance = np.abs(
+                self.positions[group][:, None, :] - self.positions[group][None, :, :]
+            )
+            overlap = np.all(distance < self.Np, axis=-1)
+            np.fill_diagonal(overlap, False)
+            self.assertFalse(np.any(overlap))
+
+
+if __name__ == "__main__":
+    unittest.main()
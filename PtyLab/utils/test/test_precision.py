@@ -0,0 +1,112 @@
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import TestCase
+import numpy as np
+import PtyLab
+from PtyLab import Engines
+from PtyLab.Engines.test.simulatedData import writeSimulatedData
+from PtyLab.Operators import Operators
+from PtyLab.utils import precision
+from PtyLab.utils.initializationFunctions import initialProbeOrObject
+
+
+class TestPrecision(TestCase):
+    def test_asPrecision(self):
+        """
+        Floating point arrays follow the policy, integer counts, masks and scalars are kept.
+        :return:
+        """
+        single = precision.getPrecision()
+        self.assertEqual(single, precision.getPrecision("single"))
+        self.assertEqual(precision.asPrecision(np.ones(3, dtype=np.complex128)).dtype, np.complex64)
+        self.assertEqual(precision.asPrecision(np.ones(3)).dtype, np.float32)
+        self.assertEqual(precision.asPrecision(np.ones(3, dtype=np.uint16)).dtype, np.uint16)
+        self.assertEqual(precision.asPrecision(np.ones(3, dtype=bool)).dtype, bool)
+        self.assertIsNone(precision.asPrecision(None))
+        double = precision.getPrecision("double")
+        self.assertEqual(precision.asPrecision(np.ones(3, dtype=np.complex64), double).dtype, np.complex128)
+        with self.assertRaises(ValueError):
+            precision.getPrecision("half")
+
+    def test_upcastFields(self):
+        """
+        Only the fields that are wider than the policy are reported.
+        :return:
+        """
+        owner = SimpleNamespace(
+            probe=np.ones(3, dtype=np.complex128),
+            object=np.ones(3, dtype=np.complex64),
+            Iestimated=np.ones(3),
+            counts=np.ones(3, dtype=np.int64),
+        )
+        names = ["probe", "object", "Iestimated", "counts", "missing"]
+        self.assertEqual(
+            precision.upcastFields(owner, names, precision.getPrecision("single")),
+            [("probe", np.complex128), ("Iestimated", np.float64)],
+        )
+        self.assertEqual(precision.upcastFields(owner, names, precision.getPrecision("double")), [])
+
+    def test_initialProbeOrObject(self):
+        """
+        The initial guesses are made in the requested complex dtype, single precision by default.
+        :return:
+        """
+        self.assertEqual(initialProbeOrObject((1, 1, 1, 1, 8, 8), "ones", None).dtype, np.complex64)
+        self.assertEqual(
+            initialProbeOrObject((1, 1, 1, 1, 8, 8), "ones", None, dtype=np.complex128).dtype,
+            np.complex128,
+        )
+
+    def test_kernels(self):
+        """
+        The cached kernels are made per precision, a double precision kernel does not replace the single one.
+        :return:
+        """
+        single = Operators.aspw(np.ones((16, 16), dtype=np.complex64), 1e-3, 500e-9, 1e-4)[1]
+        double = Operators.aspw(np.ones((16, 16)), 1e-3, 500e-9, 1e-4, precision="double")[1]
+        self.assertEqual(single.dtype, np.complex64)
+        self.assertEqual(double.dtype, np.complex128)
+        np.testing.assert_allclose(single, double, atol=1e-6)
+        self.assertIs(Operators.aspw(np.ones((16, 16)), 1e-3, 500e-9, 1e-4)[1], single)
+
+
+class TestEnginePrecision(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "simulated.hdf5")
+        writeSimulatedData(self.filename)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def initialize(self, name):
+        experimentalData, reconstruction, params, monitor, engine = PtyLab.easyInitialize(
+            self.filename, engine=Engines.mPIE, dummyMonitor=True
+        )
+        params.precision = name
+        params.propagatorType = "ASP"
+        engine._prepareReconstruction()
+        return engine
+
+    def test_engines(self):
+        """
+        Engines with different precisions keep their own dtypes and propagation kernels.
+        :return:
+        """
+        single = self.initialize("single")
+        double = self.initialize("double")
+        for engine, dtype in [(single, np.complex64), (double, np.complex128)]:
+            reconstruction = engine.reconstruction
+            self.assertEqual(reconstruction.probe.dtype, dtype)
+            reconstruction.esw = reconstruction.probe * np.ones_like(reconstruction.probe)
+            _, result = Operators.propagate_ASP(reconstruction.esw, engine.params, reconstruction)
+            self.assertEqual(result.dtype, dtype)
+        # the single precision engine is not affected by the double precision one
+        self.assertEqual(single.precision, precision.getPrecision("single"))
+        self.assertEqual(single.reconstruction.object.dtype, np.complex64)
+
+
+if __name__ == "__main__":
+    unittest.main()
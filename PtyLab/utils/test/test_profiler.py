@@ -0,0 +1,84 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest import TestCase
+from PtyLab.utils.profiler import StageProfiler
+
+
+class DummyEngine(object):
+    def intensityProjection(self):
+        time.sleep(0.002)
+        return self.object2detector()
+
+    def object2detector(self):
+        time.sleep(0.002)
+        return "esw"
+
+    def showReconstruction(self):
+        pass
+
+
+class TestStageProfiler(TestCase):
+    def test_disabled(self):
+        """
+        Nothing is recorded while the profiler is disabled.
+        :return:
+        """
+        profiler = StageProfiler(enabled=False)
+        with profiler.stage("objectUpdate"):
+            pass
+        profiler.lap("constraint.absObject")
+        profiler.endIteration()
+        self.assertEqual(profiler.totals(), {})
+        self.assertEqual(profiler.iterations, [])
+
+    def test_nested_stages(self):
+        """
+        Nested stages are only counted in the self time of the innermost stage, and laps split the enclosing stage.
+        :return:
+        """
+        profiler = StageProfiler(enabled=True)
+        with profiler.stage("applyConstraints"):
+            time.sleep(0.002)
+            profiler.lap("constraint.probeBoundary")
+            with profiler.stage("orthogonalization"):
+                time.sleep(0.002)
+        calls, total, own = profiler.totals()["applyConstraints"]
+        lap = profiler.totals()["constraint.probeBoundary"][2]
+        nested = profiler.totals()["orthogonalization"][1]
+        self.assertEqual(calls, 1)
+        self.assertGreaterEqual(lap, 0.002)
+        self.assertAlmostEqual(own, total - lap - nested)
+
+    def test_attach(self):
+        """
+        attach times the engine methods and closes an iteration with showReconstruction, detach undoes it.
+        :return:
+        """
+        engine = DummyEngine()
+        profiler = StageProfiler(enabled=True)
+        profiler.attach(engine)
+        for loop in range(2):
+            self.assertEqual(engine.intensityProjection(), "esw")
+            engine.showReconstruction()
+        self.assertEqual(len(profiler.iterations), 2)
+        self.assertEqual(profiler.iterations[0]["projection"][0], 1)
+        self.assertEqual(profiler.totals()["object2detector"][0], 2)
+        self.assertIn("projection", profiler.summary())
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "trace.json")
+            profiler.saveTrace(filename)
+            with open(filename) as f:
+                trace = json.load(f)
+        self.assertEqual(len(trace["iterations"]), 2)
+        self.assertEqual(trace["stages"]["projection"]["calls"], 2)
+
+        profiler.detach(engine)
+        self.assertEqual(vars(engine), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,46 +1,98 @@
 import numpy as np
+from functools import lru_cache
 from scipy import linalg
 import scipy.stats as st
 
 from PtyLab.utils.gpuUtils import getArrayModule
+from PtyLab.utils.fftBackends import getFFTBackend
 
 
-def fft2c(field, fftshiftSwitch=False, *args, **kwargs):
+def _fft2(field, overwrite=False):
+    """orthonormal 2D FFT over the last two axes, using the selected backend for numpy arrays"""
+    xp = getArrayModule(field)
+    if xp is np:
+        return getFFTBackend().fft2(field, overwrite=overwrite)
+    return xp.fft.fft2(field, norm="ortho")
+
+
+def _ifft2(field, overwrite=False):
+    """orthonormal 2D inverse FFT over the last two axes, using the selected backend for numpy arrays"""
+    xp = getArrayModule(field)
+    if xp is np:
+        return getFFTBackend().ifft2(field, overwrite=overwrite)
+    return xp.fft.ifft2(field, norm="ortho")
+
+
+@lru_cache(maxsize=32)
+def _checkerboard(shape, dtype, xp, output):
+    """
+    Modulation kernels for the shift-free centred FFT of arrays with an even shape (M, N):
+    fftshift(fft2(ifftshift(x))) == s * c * fft2(c * x), with c = (-1)^(m+n) and s = (-1)^(M/2+N/2)
+    (idem for ifft2). Returns the input kernel c, or the output kernel s*c if output is True (read-only).
+    """
+    M, N = shape
+    c = 1 - 2 * ((np.arange(M)[:, None] + np.arange(N)[None, :]) % 2)
+    if output:
+        c = c * (-1) ** ((M // 2 + N // 2) % 2)
+    kernel = xp.asarray(c, dtype=dtype)
+    if xp is np:
+        kernel.flags.writeable = False
+    return kernel
+
+
+def _centredTransform(field, transform):
+    """
+    centred (i)FFT over the last two axes. For even dimensions, the fftshifts are replaced by a
+    checkerboard modulation of the input and output, which avoids two full copies of the array.
+    """
+    xp = getArrayModule(field)
+    axes = (-2, -1)
+    shape = field.shape[-2:]
+    if shape[0] % 2 == 0 and shape[1] % 2 == 0 and xp.iscomplexobj(field):
+        # the modulated input is a temporary, so it can always be overwritten.
+        # The kernels have the (real) dtype of the arrays, to avoid casting in the multiplications
+        result = transform(
+            field * _checkerboard(shape, field.real.dtype.str, xp, False),
+            overwrite=True,
+        )
+        result *= _checkerboard(shape, result.real.dtype.str, xp, True)
+        return result
+    # the shifted copy is a temporary, so it can always be overwritten
+    return xp.fft.fftshift(
+        transform(xp.fft.ifftshift(field, axes=axes), overwrite=True), axes=axes
+    )
+
+
+def fft2c(field, fftshiftSwitch=False, *args, overwrite=False, **kwargs):
     """
     performs 2 - dimensional unitary Fourier transformation, where energy is preserved sum( abs(g)**2 ) == sum( abs(fft2c(g))**2 )
     if g is two - dimensional, fft2c(g) yields the 2D DFT of g
     if g is multi - dimensional, fft2c(g) yields the 2D DFT of g along the last two axes
+    the FFT backend for CPU arrays can be chosen with PtyLab.utils.fftBackends.setFFTBackend
     :param array:
+    :param overwrite: allow the backend to overwrite field (only use for temporary arrays)
     :return:
     """
-    xp = getArrayModule(field)
-
     if fftshiftSwitch:
-        return xp.fft.fft2(field, norm="ortho")
+        return _fft2(field, overwrite=overwrite)
     else:
-        axes = (-2, -1)
-        return xp.fft.fftshift(
-            xp.fft.fft2(xp.fft.ifftshift(field, axes=axes), norm="ortho"), axes=axes
-        )
+        return _centredTransform(field, _fft2)
 
 
-def ifft2c(field, fftshiftSwitch=False):
+def ifft2c(field, fftshiftSwitch=False, overwrite=False):
     """
     performs 2 - dimensional inverse Fourier transformation, where energy is preserved sum( abs(G)**2 ) == sum( abs(fft2c(g))**2 ) 
     if G is two - dimensional, fft2c(G) yields the 2D iDFT of G
     if G is multi - dimensional, fft2c(G) yields the 2D iDFT of G along the last two axes
+    the FFT backend for CPU arrays can be chosen with PtyLab.utils.fftBackends.setFFTBackend
     :param array:
+    :param overwrite: allow the backend to overwrite field (only use for temporary arrays)
     :return:
     """
-    xp = getArrayModule(field)
-
     if fftshiftSwitch:
-        return xp.fft.ifft2(field, norm="ortho")
+        return _ifft2(field, overwrite=overwrite)
     else:
-        axes = (-2, -1)
-        return xp.fft.fftshift(
-            xp.fft.ifft2(xp.fft.ifftshift(field, axes=axes), norm="ortho"), axes=axes
-        )
+        return _centredTransform(field, _ifft2)
 
 
 def circ(x, y, D):